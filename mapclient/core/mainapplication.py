@@ -37,6 +37,7 @@ class MainApplication(object):
     def __init__(self):
         self._size = QtCore.QSize(600, 400)
         self._pos = QtCore.QPoint(100, 150)
+        self._openGLViewport = False
         self._pluginManager = PluginManager()
         self._workflowManager = WorkflowManager()
         self._undoManager = UndoManager()
@@ -54,6 +55,12 @@ class MainApplication(object):
     def pos(self):
         return self._pos
 
+    def setOpenGLViewport(self, enabled):
+        self._openGLViewport = enabled
+
+    def openGLViewport(self):
+        return self._openGLViewport
+
     def undoManager(self):
         return self._undoManager
 
@@ -71,6 +78,7 @@ class MainApplication(object):
         settings.beginGroup('MainWindow')
         settings.setValue('size', self._size)
         settings.setValue('pos', self._pos)
+        settings.setValue('opengl_viewport', self._openGLViewport)
         settings.endGroup()
         self._pluginManager.writeSettings(settings)
         self._workflowManager.writeSettings(settings)
@@ -80,6 +88,7 @@ class MainApplication(object):
         settings.beginGroup('MainWindow')
         self._size = settings.value('size', self._size)
         self._pos = settings.value('pos', self._pos)
+        self._openGLViewport = settings.value('opengl_viewport', 'false') == 'true'
         settings.endGroup()
         self._pluginManager.readSettings(settings)
         self._workflowManager.readSettings(settings)
@@ -0,0 +1,209 @@
+'''
+MAP Client, a program to generate detailed musculoskeletal models for OpenSim.
+    Copyright (C) 2012  University of Auckland
+
+This file is part of MAP Client. (http://launchpad.net/mapclient)
+
+    MAP Client is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    MAP Client is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with MAP Client.  If not, see <http://www.gnu.org/licenses/>..
+'''
+import os
+import sys
+import numbers
+import shutil
+import tempfile
+import logging
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+logger = logging.getLogger(__name__)
+
+# 0 means no budget, all port data is kept in memory.
+DEFAULT_MEMORY_BUDGET = 0
+
+
+def payloadSize(data):
+    '''
+    Return the size in bytes of the given port data if it can be
+    determined, None otherwise.  Only array like payloads report
+    their size.
+    '''
+    nbytes = getattr(data, 'nbytes', None)
+    if isinstance(nbytes, numbers.Integral):
+        return nbytes
+
+    return None
+
+
+def isSpillable(data):
+    return numpy is not None and isinstance(data, numpy.ndarray) and not data.dtype.hasobject
+
+
+class _PortDataEntry(object):
+
+    def __init__(self, data, size, consumers):
+        self.data = data
+        self.size = size
+        self.consumers = consumers
+        self.filename = None
+
+    def spilled(self):
+        return self.filename is not None
+
+
+class PortDataStore(object):
+    '''
+    Holds the data provided by step ports while a workflow executes so that
+    a port feeding several steps is only asked for its data once.  When the
+    data held in memory would exceed the memory budget, array payloads are
+    spilled to a file in the scratch directory and handed to the consumers
+    as a memory-mapped (copy on write) array when they are delivered.
+
+    Only arrays the store is the sole owner of are spilled, spilling an
+    array a step still references would free nothing.  Such arrays stay
+    resident and are reconsidered the next time the budget is exceeded.
+    '''
+
+    def __init__(self, memory_budget=DEFAULT_MEMORY_BUDGET, scratch_dir=None):
+        self._memory_budget = memory_budget
+        self._scratch_dir = scratch_dir
+        self._own_scratch_dir = None
+        self._entries = {}
+        self._resident_bytes = 0
+        self._resetStatistics()
+
+    def _resetStatistics(self):
+        self._statistics = {
+            'bytes_spilled': 0,
+            'bytes_reloaded': 0,
+            'spill_count': 0,
+            'reload_count': 0,
+            'peak_resident_bytes': 0,
+        }
+
+    def memoryBudget(self):
+        return self._memory_budget
+
+    def statistics(self):
+        statistics = dict(self._statistics)
+        statistics['resident_bytes'] = self._resident_bytes
+        return statistics
+
+    def contains(self, key):
+        return key in self._entries
+
+    def put(self, key, data, consumers=1):
+        '''
+        Store the data for the port identified by key.  The data is
+        released after it has been fetched consumers times, with no
+        consumers left nothing is stored.
+        '''
+        self.release(key)
+        if consumers <= 0:
+            return
+
+        size = payloadSize(data)
+        entry = _PortDataEntry(data, size, consumers)
+        self._entries[key] = entry
+        if size is not None:
+            if self._exceedsBudget(size):
+                self._spillUnshared(size)
+            self._resident_bytes += size
+            self._statistics['peak_resident_bytes'] = max(self._statistics['peak_resident_bytes'], self._resident_bytes)
+
+    def get(self, key):
+        '''
+        Fetch the data for the port identified by key, rehydrating it
+        if it has been spilled to disk.
+        '''
+        entry = self._entries[key]
+        if entry.spilled():
+            data = numpy.load(entry.filename, mmap_mode='c')
+            self._statistics['bytes_reloaded'] += entry.size
+            self._statistics['reload_count'] += 1
+        else:
+            data = entry.data
+
+        entry.consumers -= 1
+        if entry.consumers <= 0:
+            self.release(key)
+
+        return data
+
+    def release(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+
+        if entry.spilled():
+            try:
+                os.remove(entry.filename)
+            except OSError:
+                # Possibly still mapped on some platforms, it goes with the scratch directory.
+                logger.debug('Could not remove spilled port data file {0}'.format(entry.filename))
+        elif entry.size is not None:
+            self._resident_bytes -= entry.size
+        entry.data = None
+
+    def clear(self):
+        for key in list(self._entries.keys()):
+            self.release(key)
+
+        if self._own_scratch_dir is not None:
+            shutil.rmtree(self._own_scratch_dir, ignore_errors=True)
+            self._own_scratch_dir = None
+
+    def _exceedsBudget(self, size):
+        return self._memory_budget > 0 and self._resident_bytes + size > self._memory_budget
+
+    def _solelyOwned(self, entry):
+        # One reference from the entry, one from the getrefcount argument.
+        return sys.getrefcount(entry.data) <= 2
+
+    def _spillUnshared(self, size):
+        '''
+        Spill resident arrays nobody but the store references until size
+        more bytes fit in the memory budget.
+        '''
+        for key, entry in list(self._entries.items()):
+            if not self._exceedsBudget(size):
+                break
+            if entry.spilled() or entry.size is None or not isSpillable(entry.data):
+                continue
+            if self._solelyOwned(entry):
+                self._spill(key, entry)
+                self._resident_bytes -= entry.size
+
+    def _scratchDirectory(self):
+        if self._scratch_dir:
+            if not os.path.exists(self._scratch_dir):
+                os.makedirs(self._scratch_dir)
+            return self._scratch_dir
+
+        if self._own_scratch_dir is None:
+            self._own_scratch_dir = tempfile.mkdtemp(prefix='mapclient-portdata-')
+
+        return self._own_scratch_dir
+
+    def _spill(self, key, entry):
+        handle, filename = tempfile.mkstemp(suffix='.npy', dir=self._scratchDirectory())
+        with os.fdopen(handle, 'wb') as f:
+            numpy.save(f, entry.data)
+        entry.filename = filename
+        entry.data = None
+        self._statistics['bytes_spilled'] += entry.size
+        self._statistics['spill_count'] += 1
+        logger.debug('Spilled {0} bytes of port data for {1} to {2}'.format(entry.size, key, filename))
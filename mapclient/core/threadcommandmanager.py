@@ -22,7 +22,7 @@ from threading import Thread
 from os import listdir
 from os.path import isfile, join, isdir
 from shutil import copy, move, rmtree
-from subprocess import call, Popen, PIPE, STDOUT
+from subprocess import call
 
 from PySide import QtCore
 
@@ -91,10 +91,7 @@ class CommandIgnoreDirectoriesHg(ThreadCommand):
     def __init__(self, location):
         ThreadCommand.__init__(self, 'CommandIgnoreDirectoriesHg')
         self._location = location
-        self._hg = None
-        hg = which('hg')
-        if len(hg) > 0:
-            self._hg = hg[0]
+        self._hg = hgExecutable()
 
     def run(self):
         if self._hg and os.path.exists(join(self._location, '.hg')):
@@ -114,10 +111,7 @@ class CommandCloneWorkspace(ThreadCommand):
         self._location = location
         self._username = username
         self._password = password
-        self._hg = None
-        hg = which('hg')
-        if len(hg) > 0:
-            self._hg = hg[0]
+        self._hg = hgExecutable()
 
     def run(self):
         '''Mercurial will not clone into a directory that is not empty.  To work
@@ -132,6 +126,7 @@ class CommandCloneWorkspace(ThreadCommand):
                 repourl = self._repourl
             else:
                 repourl = self._repourl[:7] + self._username + ':' + self._password + '@' + self._repourl[7:]
+            # There is no repository for a command server to run in yet.
             call([self._hg, 'clone', repourl, d])
             mvdir(d, self._location)
 #            move(join(d, '.hg'), self._location)
@@ -150,25 +145,21 @@ class CommandCommit(ThreadCommand):
         self._username = username
         self._password = password
         self._comment = comment
-        self._hg = None
-        hg = which('hg')
-        if len(hg) > 0:
-            self._hg = hg[0]
+        self._hg = hgExecutable()
 
     def run(self):
         if self._hg and os.path.exists(join(self._location, '.hg')):
-            # This is for the commit command
-            call([self._hg, 'add', self._location])
-            process = Popen([self._hg, 'commit', '-u', self._username, '-m', self._comment], cwd=self._location)
-            process.communicate()
-            process = Popen([self._hg, 'paths'], cwd=self._location, stdout=PIPE, stdin=PIPE, stderr=STDOUT)
-            paths = process.communicate()[0].split()
+            # Imported here, the command server module needs hgExecutable from this one.
+            from mapclient.tools.pmr.hgcmdserver import hgServerPool
+            pool = hgServerPool()
+            pool.runCommand(self._location, 'add')
+            pool.runCommand(self._location, 'commit', '-u', self._username, '-m', self._comment)
+            paths = pool.runCommand(self._location, 'paths')[1].decode('utf-8').split()
             if len(paths) > 2:
                 repourl = paths[2]
                 insert = repourl.find('@')
                 repourl = repourl[:insert] + ':' + self._password + repourl[insert:]
-                process = Popen([self._hg, 'push', repourl], cwd=self._location)
-                process.communicate()
+                pool.runCommand(self._location, 'push', repourl)
 
         self.runFinished()
 
@@ -216,6 +207,21 @@ def which(name, flags=os.X_OK):
         return result
 
 
+_hg_executable = []
+
+
+def hgExecutable():
+    '''
+    Return the path to the hg executable, or None if it is not installed.
+    The PATH is only searched the first time.
+    '''
+    if not _hg_executable:
+        hg = which('hg')
+        _hg_executable.append(hg[0] if len(hg) > 0 else None)
+
+    return _hg_executable[0]
+
+
 def mvdir(root_src_dir, root_dst_dir):
     for src_dir, _, files in os.walk(root_src_dir):
         dst_dir = src_dir.replace(root_src_dir, root_dst_dir)
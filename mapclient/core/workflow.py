@@ -25,8 +25,11 @@ from mapclient.settings import info
 from mapclient.core.workflowscene import WorkflowScene
 from mapclient.core.workflowerror import WorkflowError
 from mapclient.core.workflowrdf import serializeWorkflowAnnotation
+from mapclient.core.portdatastore import DEFAULT_MEMORY_BUDGET
 
 _PREVIOUS_LOCATION_STRING = 'previousLocation'
+_PORT_DATA_MEMORY_BUDGET_STRING = 'portDataMemoryBudget'
+_PORT_DATA_SCRATCH_DIRECTORY_STRING = 'portDataScratchDirectory'
 
 def _getWorkflowConfiguration(location):
 #     print('get workflow confiburation: ' + location)
@@ -59,6 +62,8 @@ class WorkflowManager(object):
         self._currentStateIndex = 0
 
         self._title = None
+        self._portDataMemoryBudget = DEFAULT_MEMORY_BUDGET
+        self._portDataScratchDirectory = ''
 
         self._scene = WorkflowScene(self)
 
@@ -97,6 +102,26 @@ class WorkflowManager(object):
     def execute(self):
         self._scene.execute()
 
+    def setPortDataMemoryBudget(self, budget, scratch_dir=''):
+        '''
+        Set the memory budget, in bytes, for port data held during
+        execution.  Array payloads over the budget are spilled to
+        scratch_dir, or a temporary directory when it is empty.  A budget
+        of 0 keeps all port data in memory.
+        '''
+        self._portDataMemoryBudget = budget
+        self._portDataScratchDirectory = scratch_dir
+        self._scene.setPortDataMemoryBudget(budget, scratch_dir or None)
+
+    def portDataMemoryBudget(self):
+        return self._portDataMemoryBudget
+
+    def portDataScratchDirectory(self):
+        return self._portDataScratchDirectory
+
+    def portDataStatistics(self):
+        return self._scene.portDataStatistics()
+
     def isModified(self):
         return self._saveStateIndex != self._currentStateIndex
 
@@ -199,12 +224,17 @@ class WorkflowManager(object):
     def writeSettings(self, settings):
         settings.beginGroup(self.name)
         settings.setValue(_PREVIOUS_LOCATION_STRING, self._previousLocation)
+        settings.setValue(_PORT_DATA_MEMORY_BUDGET_STRING, self._portDataMemoryBudget)
+        settings.setValue(_PORT_DATA_SCRATCH_DIRECTORY_STRING, self._portDataScratchDirectory)
         settings.endGroup()
 
     def readSettings(self, settings):
         settings.beginGroup(self.name)
         self._previousLocation = settings.value(_PREVIOUS_LOCATION_STRING, '')
+        budget = int(settings.value(_PORT_DATA_MEMORY_BUDGET_STRING, DEFAULT_MEMORY_BUDGET))
+        scratch_dir = settings.value(_PORT_DATA_SCRATCH_DIRECTORY_STRING, '')
         settings.endGroup()
+        self.setPortDataMemoryBudget(budget, scratch_dir)
 
 def versionTuple(v):
     return tuple(map(int, (v.split("."))))
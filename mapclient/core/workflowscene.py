@@ -17,10 +17,23 @@ This file is part of MAP Client. (http://launchpad.net/mapclient)
     You should have received a copy of the GNU General Public License
     along with MAP Client.  If not, see <http://www.gnu.org/licenses/>..
 '''
+import os
+import logging
+
 from PySide import QtCore
 
 from mapclient.mountpoints.workflowstep import workflowStepFactory
 from mapclient.core.workflowerror import WorkflowError
+from mapclient.core.portdatastore import PortDataStore, DEFAULT_MEMORY_BUDGET
+
+logger = logging.getLogger(__name__)
+
+# Changes reported to the change observers of a workflow scene.
+ITEM_ADDED = 'added'
+ITEM_REMOVED = 'removed'
+ITEM_MOVED = 'moved'
+ITEM_CONFIGURED = 'configured'
+SCENE_CLEARED = 'cleared'
 
 class Item(object):
 
@@ -82,6 +95,25 @@ class WorkflowDependencyGraph(object):
         self._reverseDependencyGraph = {}
         self._topologicalOrder = []
         self._current = -1
+        self._portDataMemoryBudget = DEFAULT_MEMORY_BUDGET
+        self._portDataScratchDirectory = None
+        self._portDataStore = None
+        self._portDataStatistics = {}
+        self._consumerCounts = {}
+
+    def setPortDataMemoryBudget(self, budget, scratch_dir=None):
+        self._portDataMemoryBudget = budget
+        self._portDataScratchDirectory = scratch_dir
+
+    def portDataStatistics(self):
+        '''
+        Return the port data spill statistics of the current, or
+        last completed, execution of the workflow.
+        '''
+        if self._portDataStore is not None:
+            return self._portDataStore.statistics()
+
+        return self._portDataStatistics
 
     def _findAllConnectedNodes(self):
         '''
@@ -180,27 +212,76 @@ class WorkflowDependencyGraph(object):
         can = len(configured) == len(self._topologicalOrder) and len(self._topologicalOrder) >= 0
         return can and self._current == -1
 
+    def _calculateConsumerCounts(self):
+        '''
+        Return the number of connections fed by each (source, port index).
+        '''
+        counts = {}
+        for item in self._scene.items():
+            if item.Type == Connection.Type:
+                key = (item.source(), item.sourceIndex())
+                counts[key] = counts.get(key, 0) + 1
+
+        return counts
+
+    def _portData(self, connection):
+        '''
+        Get the data for the source port of the given connection through the
+        port data store, so that a port with many consumers is only asked for
+        its data once and large payloads can be spilled to disk in between.
+        '''
+        key = (connection.source(), connection.sourceIndex())
+        if self._portDataStore.contains(key):
+            return self._portDataStore.get(key)
+
+        dataIn = connection.source()._step.getPortData(connection.sourceIndex())
+        # The first consumer is handed the data directly, it is only kept,
+        # and spilled if need be, for the consumers that come later.
+        self._portDataStore.put(key, dataIn, self._consumerCounts.get(key, 1) - 1)
+        return dataIn
+
+    def _finishExecution(self):
+        self._current = -1
+        self._consumerCounts = {}
+        if self._portDataStore is not None:
+            self._portDataStatistics = self._portDataStore.statistics()
+            logger.info('Port data statistics: {0}'.format(self._portDataStatistics))
+            self._portDataStore.clear()
+            self._portDataStore = None
+
     def execute(self):
+        if self._current == -1:
+            self._portDataStore = PortDataStore(self._portDataMemoryBudget, self._portDataScratchDirectory)
+            self._consumerCounts = self._calculateConsumerCounts()
         self._current += 1
         if self._current >= len(self._topologicalOrder):
-            self._current = -1
-        else:
-            # Form input requirements
-            current_node = self._topologicalOrder[self._current]
-            if current_node in self._reverseDependencyGraph:
-                connections = []
-                for node in self._reverseDependencyGraph[current_node]:
-                    # Find connection information and extract outputs from steps
-                    new_connections = self._connectionsForNodes(node, current_node)
-                    connections.extend([c for c in new_connections if c not in connections])
-                    if len(new_connections) == 0:
-                        raise WorkflowError('Connection in workflow not found, something has gone horribly wrong')
-
-                for connection in connections:
-                    dataIn = connection.source()._step.getPortData(connection.sourceIndex())
-                    current_node._step.setPortData(connection.destinationIndex(), dataIn)
-
-            current_node._step.execute()
+            self._finishExecution()
+            return
+
+        try:
+            self._executeCurrent()
+        except:
+            # Nothing more will run, let go of the port data and scratch files.
+            self._finishExecution()
+            raise
+
+    def _executeCurrent(self):
+        # Form input requirements
+        current_node = self._topologicalOrder[self._current]
+        if current_node in self._reverseDependencyGraph:
+            connections = []
+            for node in self._reverseDependencyGraph[current_node]:
+                # Find connection information and extract outputs from steps
+                new_connections = self._connectionsForNodes(node, current_node)
+                connections.extend([c for c in new_connections if c not in connections])
+                if len(new_connections) == 0:
+                    raise WorkflowError('Connection in workflow not found, something has gone horribly wrong')
+
+            for connection in connections:
+                dataIn = self._portData(connection)
+                current_node._step.setPortData(connection.destinationIndex(), dataIn)
+
+        current_node._step.execute()
 
 
 class WorkflowScene(object):
@@ -211,8 +292,24 @@ class WorkflowScene(object):
     def __init__(self, manager):
         self._manager = manager
         self._items = {}
+        self._changeObservers = []
         self._dependencyGraph = WorkflowDependencyGraph(self)
 
+    def registerChangeObserver(self, observer):
+        '''
+        Register observer(change, item) to be told of every change made to
+        the items in this scene.  The item is None when the scene is cleared.
+        '''
+        self._changeObservers.append(observer)
+
+    def unregisterChangeObserver(self, observer):
+        if observer in self._changeObservers:
+            self._changeObservers.remove(observer)
+
+    def _notifyChange(self, change, item):
+        for observer in self._changeObservers:
+            observer(change, item)
+
     def saveAnnotation(self, f):
         pass
 
@@ -283,6 +380,7 @@ class WorkflowScene(object):
             # Deserialize after adding the step to the scene, this is so
             # we can validate the step identifier
             step.deserialize(location)
+            self._notifyChange(ITEM_CONFIGURED, metastep)
             arcCount = ws.beginReadArray('connections')
             for j in range(arcCount):
                 ws.setArrayIndex(j)
@@ -310,22 +408,67 @@ class WorkflowScene(object):
     def execute(self):
         self._dependencyGraph.execute()
 
+    def setPortDataMemoryBudget(self, budget, scratch_dir=None):
+        self._dependencyGraph.setPortDataMemoryBudget(budget, scratch_dir)
+
+    def portDataStatistics(self):
+        return self._dependencyGraph.portDataStatistics()
+
+    def stepLocations(self):
+        '''
+        Return the directories of the identified steps in this scene.
+        '''
+        return [os.path.join(item._step._location, item.getIdentifier()) for item in self._items
+                if item.Type == MetaStep.Type and item.getIdentifier()]
+
+    def pmrWorkspaces(self):
+        '''
+        Return the (remote workspace url, local directory) pairs of the PMR
+        workspaces the steps in this scene still need to clone.
+        '''
+        workspaces = []
+        for item in self._items:
+            if item.Type == MetaStep.Type:
+                workspaces.extend(item._step.getPMRWorkspaces())
+
+        return workspaces
+
+    def revalidateSteps(self):
+        '''
+        Deserialize the steps that are not configured again, so that they
+        are validated against the PMR workspaces cloned since they were loaded.
+        '''
+        location = self._manager.location()
+        for item in self._items:
+            if item.Type == MetaStep.Type and not item._step.isConfigured():
+                item._step.deserialize(location)
+                self._notifyChange(ITEM_CONFIGURED, item)
+
     def clear(self):
         self._items.clear()
+        self._notifyChange(SCENE_CLEARED, None)
 
     def items(self):
         return self._items.keys()
 
     def addItem(self, item):
-        self._items[item] = item
+        if item not in self._items:
+            self._items[item] = item
+            self._notifyChange(ITEM_ADDED, item)
 
     def removeItem(self, item):
         if item in self._items:
             del self._items[item]
+            self._notifyChange(ITEM_REMOVED, item)
 
     def setItemPos(self, item, pos):
         if item in self._items:
             self._items[item]._pos = pos
+            self._notifyChange(ITEM_MOVED, item)
+
+    def itemConfigured(self, item):
+        if item in self._items:
+            self._notifyChange(ITEM_CONFIGURED, item)
 
     def setItemSelected(self, item, selected):
         if item in self._items:
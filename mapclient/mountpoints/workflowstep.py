@@ -101,6 +101,11 @@ A plugin that registers this mount point must:
 A plugin that registers this mount point could have:
   - An attribute _icon that is a QImage icon for a visual representation of the step
   - An attribute _category that is a string representation of the step's category
+  - A function 'getToolTip(self)' that returns the tool tip text for the step, it
+    should be cheap to call as it is used when the step is displayed
+  - A function 'getPMRWorkspaces(self)' that returns a list of (remote workspace url,
+    local directory) pairs for the PMR workspaces the step needs that have not been
+    cloned yet, they are cloned when the workflow is imported from PMR
   
 '''
 
@@ -171,6 +176,12 @@ def _workflow_step_getName(self):
 
     return self.__class__.__name__
 
+def _workflow_step_getToolTip(self):
+    return self.getName()
+
+def _workflow_step_getPMRWorkspaces(self):
+    return []
+
 attr_dict = {}
 attr_dict['__init__'] = _workflow_step_init
 attr_dict['execute'] = _workflow_step_execute
@@ -184,6 +195,8 @@ attr_dict['registerIdentifierOccursCount'] = _workflow_step_registerIdentifierOc
 attr_dict['registerConfiguredObserver'] = _workflow_step_registerConfiguredObserver
 attr_dict['addPort'] = _workflow_step_addPort
 attr_dict['getName'] = _workflow_step_getName
+attr_dict['getToolTip'] = _workflow_step_getToolTip
+attr_dict['getPMRWorkspaces'] = _workflow_step_getPMRWorkspaces
 attr_dict['deserialize'] = _workflow_step_deserialize
 attr_dict['serialize'] = _workflow_step_serialize
 
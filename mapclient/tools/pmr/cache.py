@@ -0,0 +1,279 @@
+'''
+MAP Client, a program to generate detailed musculoskeletal models for OpenSim.
+    Copyright (C) 2012  University of Auckland
+
+This file is part of MAP Client. (http://launchpad.net/mapclient)
+
+    MAP Client is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    MAP Client is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with MAP Client.  If not, see <http://www.gnu.org/licenses/>..
+'''
+import os
+import json
+import time
+import hashlib
+import logging
+import tempfile
+import threading
+from collections import OrderedDict
+
+from PySide import QtGui
+
+logger = logging.getLogger(__name__)
+
+# Time to live, in seconds, of the cached responses for each endpoint.
+DEFAULT_TTLS = {
+    'search': 300,
+    'ricordo': 300,
+    'map': 300,
+    'dashboard': 600,
+    'object-info': 120,
+}
+
+# Number of decoded responses kept in memory, the least recently used go first.
+MAX_MEMORY_ENTRIES = 256
+# Number of response files kept on disk, and the age in seconds after which
+# they are removed.  Stale files are still useful for revalidation so they
+# are kept well beyond their TTL.
+MAX_DISK_ENTRIES = 2048
+MAX_DISK_AGE = 7 * 24 * 3600
+
+_CACHE_DIRNAME = 'pmr-responses'
+
+
+def defaultCacheDirectory():
+    location = QtGui.QDesktopServices.storageLocation(QtGui.QDesktopServices.CacheLocation)
+    if not location:
+        location = os.path.join(tempfile.gettempdir(), 'mapclient')
+
+    return os.path.join(location, _CACHE_DIRNAME)
+
+
+class _InFlight(object):
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.value = None
+        self.error = None
+
+
+class ResponseCache(object):
+    '''
+    Caches the decoded JSON responses of the PMR endpoints named in ttls.
+    Fresh entries are served without touching the network, stale entries are
+    revalidated with If-None-Match/If-Modified-Since, and identical requests
+    made while one is already in flight wait for and share its result.
+    Entries are also written to directory so they outlive the session, the
+    files there are pruned by age and count the first time it is used.
+    '''
+
+    def __init__(self, ttls=None, directory=None, max_entries=MAX_MEMORY_ENTRIES):
+        self._ttls = dict(DEFAULT_TTLS if ttls is None else ttls)
+        self._directory = directory
+        self._max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._pruned = False
+        self._inflight = {}
+        self._statistics = {'hits': 0, 'revalidated': 0, 'misses': 0, 'coalesced': 0}
+
+    def _cacheDirectory(self):
+        if self._directory is None:
+            self._directory = defaultCacheDirectory()
+
+        return self._directory
+
+    def _filename(self, digest):
+        return os.path.join(self._cacheDirectory(), digest + '.json')
+
+    def _digest(self, key):
+        return hashlib.sha1(repr(key).encode('utf-8')).hexdigest()
+
+    def _remember(self, digest, entry):
+        '''
+        Put entry at the most recently used end of the memory cache and drop
+        the least recently used entries beyond the limit.  Call with the lock
+        held.
+        '''
+        self._entries.pop(digest, None)
+        self._entries[digest] = entry
+        while len(self._entries) > self._max_entries:
+            self._entries.popitem(last=False)
+
+    def _recall(self, digest):
+        with self._lock:
+            entry = self._entries.get(digest)
+            if entry is not None:
+                self._remember(digest, entry)
+                return entry
+
+        try:
+            with open(self._filename(digest)) as f:
+                entry = json.load(f)
+        except (IOError, OSError, ValueError):
+            return None
+
+        with self._lock:
+            # Another thread may have stored a newer entry meanwhile.
+            if digest in self._entries:
+                return self._entries[digest]
+            self._remember(digest, entry)
+
+        return entry
+
+    def _store(self, digest, entry):
+        with self._lock:
+            self._remember(digest, entry)
+
+        try:
+            directory = self._cacheDirectory()
+            if not os.path.exists(directory):
+                os.makedirs(directory)
+            self._prune(directory)
+            handle, temporary = tempfile.mkstemp(suffix='.tmp', dir=directory)
+            with os.fdopen(handle, 'w') as f:
+                json.dump(entry, f)
+            _replaceFile(temporary, self._filename(digest))
+        except (IOError, OSError):
+            logger.debug('Could not write the PMR response cache entry {0}'.format(digest))
+
+    def _prune(self, directory):
+        with self._lock:
+            if self._pruned:
+                return
+            self._pruned = True
+
+        now = time.time()
+        files = []
+        for name in os.listdir(directory):
+            if not name.endswith('.json'):
+                continue
+            filename = os.path.join(directory, name)
+            try:
+                files.append((os.path.getmtime(filename), filename))
+            except OSError:
+                pass
+
+        files.sort(reverse=True)
+        for index, (mtime, filename) in enumerate(files):
+            if index >= MAX_DISK_ENTRIES or now - mtime > MAX_DISK_AGE:
+                try:
+                    os.remove(filename)
+                except OSError:
+                    pass
+
+    def fetch(self, endpoint, key, request):
+        '''
+        Return the JSON value of the response for key.  request is called
+        with a dict of extra headers, for conditional revalidation, and must
+        return a requests response.  Endpoints without a TTL are not cached.
+        '''
+        ttl = self._ttls.get(endpoint)
+        if ttl is None:
+            return self._decode(request({}))
+
+        digest = self._digest((endpoint, key))
+        entry = self._recall(digest)
+        with self._lock:
+            if entry is not None and time.time() - entry['time'] < ttl:
+                self._statistics['hits'] += 1
+                return entry['value']
+
+            inflight = self._inflight.get(digest)
+            owner = inflight is None
+            if owner:
+                inflight = _InFlight()
+                self._inflight[digest] = inflight
+            else:
+                self._statistics['coalesced'] += 1
+
+        if not owner:
+            inflight.event.wait()
+            if inflight.error is not None:
+                raise inflight.error
+            return inflight.value
+
+        try:
+            inflight.value = self._refresh(digest, entry, request)
+            return inflight.value
+        except Exception as e:
+            inflight.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._inflight[digest]
+            inflight.event.set()
+
+    def _refresh(self, digest, entry, request):
+        headers = {}
+        if entry is not None:
+            if entry.get('etag'):
+                headers['If-None-Match'] = entry['etag']
+            if entry.get('last_modified'):
+                headers['If-Modified-Since'] = entry['last_modified']
+
+        r = request(headers)
+        if entry is not None and r.status_code == 304:
+            entry = dict(entry, time=time.time())
+            with self._lock:
+                self._statistics['revalidated'] += 1
+            self._store(digest, entry)
+            return entry['value']
+
+        value = self._decode(r)
+        with self._lock:
+            self._statistics['misses'] += 1
+        self._store(digest, {
+            'time': time.time(),
+            'etag': r.headers.get('ETag'),
+            'last_modified': r.headers.get('Last-Modified'),
+            'value': value,
+        })
+
+        return value
+
+    def _decode(self, r):
+        r.raise_for_status()
+        return r.json()
+
+    def clear(self):
+        with self._lock:
+            self._entries = OrderedDict()
+
+        directory = self._cacheDirectory()
+        if os.path.isdir(directory):
+            for name in os.listdir(directory):
+                if name.endswith('.json') or name.endswith('.tmp'):
+                    try:
+                        os.remove(os.path.join(directory, name))
+                    except OSError:
+                        pass
+
+    def statistics(self):
+        with self._lock:
+            return dict(self._statistics)
+
+
+def _replaceFile(source, destination):
+    if hasattr(os, 'replace'):
+        os.replace(source, destination)
+    else:
+        if os.path.exists(destination):
+            os.remove(destination)
+        os.rename(source, destination)
+
+
+_response_cache = ResponseCache()
+
+
+def responseCache():
+    return _response_cache
@@ -0,0 +1,111 @@
+'''
+MAP Client, a program to generate detailed musculoskeletal models for OpenSim.
+    Copyright (C) 2012  University of Auckland
+
+This file is part of MAP Client. (http://launchpad.net/mapclient)
+
+    MAP Client is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    MAP Client is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with MAP Client.  If not, see <http://www.gnu.org/licenses/>..
+'''
+import os
+import time
+import logging
+from collections import OrderedDict
+
+from mapclient.tools.pmr.pmrtool import PMRToolError
+from mapclient.tools.pmr.pmrhghelper import trackedChanges
+from mapclient.tools.pmr.workerpool import runConcurrently
+
+logger = logging.getLogger(__name__)
+
+# Repositories committed and pushed at the same time.
+DEFAULT_COMMIT_WORKERS = 4
+DEFAULT_PUSH_ATTEMPTS = 3
+# Seconds before the first push retry, doubled for each further retry.
+PUSH_RETRY_DELAY = 1.0
+
+
+class CommitPlanner(object):
+    '''
+    Gathers the changes to commit across a workflow directory and the
+    repositories of its steps, then commits each repository with a single
+    add and commit.  Repositories are committed, and pushed, in parallel.
+    '''
+
+    def __init__(self, pmr_tool, max_workers=DEFAULT_COMMIT_WORKERS,
+                 push_attempts=DEFAULT_PUSH_ATTEMPTS):
+        self._pmr_tool = pmr_tool
+        self._max_workers = max_workers
+        self._push_attempts = push_attempts
+        self._plan = OrderedDict()
+
+    def addFiles(self, local_workspace_dir, files):
+        '''
+        Add the given files to the commit for the repository at
+        local_workspace_dir.
+        '''
+        planned = self._plan.setdefault(local_workspace_dir, [])
+        planned.extend(filename for filename in files if filename not in planned)
+
+    def addChangedRepository(self, local_workspace_dir):
+        '''
+        Add the repository at local_workspace_dir to the plan if its tracked
+        files have uncommitted changes.  Nothing is added to it, so files
+        the repository does not already track are left out of the commit.
+        Returns True if it was added.
+        '''
+        if not os.path.isdir(local_workspace_dir) or not self._pmr_tool.hasDVCS(local_workspace_dir):
+            return False
+        if not trackedChanges(local_workspace_dir):
+            return False
+
+        self.addFiles(local_workspace_dir, [])
+        return True
+
+    def removeRepository(self, local_workspace_dir):
+        self._plan.pop(local_workspace_dir, None)
+
+    def repositories(self):
+        return list(self._plan.keys())
+
+    def _push(self, local_workspace_dir):
+        delay = PUSH_RETRY_DELAY
+        for attempt in range(1, self._push_attempts + 1):
+            try:
+                return self._pmr_tool.pushToRemote(local_workspace_dir)
+            except Exception as e:
+                if attempt == self._push_attempts:
+                    raise
+                logger.info('Push of {0} failed, retrying: {1}'.format(local_workspace_dir, e))
+                time.sleep(delay)
+                delay *= 2
+
+    def execute(self, message, push=True, progress=None):
+        '''
+        Commit, and push unless push is False, every repository in the plan.
+        progress(completed, total, local_workspace_dir) is called on the
+        calling thread as each repository finishes.  Raises a PMRToolError
+        listing the repositories that failed once all have finished.
+        '''
+        def commit(local_workspace_dir):
+            self._pmr_tool.commitFiles(local_workspace_dir, message, self._plan[local_workspace_dir])
+            if push:
+                self._push(local_workspace_dir)
+
+        repositories = self.repositories()
+        outcomes = runConcurrently(commit, repositories, self._max_workers, progress, 'PMRCommit')
+        failures = ['%s: %s' % (repository, error)
+                    for repository, (_, error) in zip(repositories, outcomes) if error is not None]
+        if failures:
+            raise PMRToolError('Commit Failed',
+                'The changes to the following repositories could not be committed:\n' + '\n'.join(failures))
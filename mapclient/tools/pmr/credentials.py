@@ -0,0 +1,151 @@
+'''
+MAP Client, a program to generate detailed musculoskeletal models for OpenSim.
+    Copyright (C) 2012  University of Auckland
+
+This file is part of MAP Client. (http://launchpad.net/mapclient)
+
+    MAP Client is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    MAP Client is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with MAP Client.  If not, see <http://www.gnu.org/licenses/>..
+'''
+import time
+import calendar
+import threading
+
+# Seconds a temporary password is reused for when the server does not say.
+DEFAULT_CREDENTIAL_LIFETIME = 300
+# Credentials this close to expiring are requested again rather than used.
+EXPIRY_MARGIN = 30
+
+# ISO 8601 forms of the expiry time, always read as UTC.
+_EXPIRY_FORMATS = (
+    '%Y-%m-%dT%H:%M:%SZ',
+    '%Y-%m-%dT%H:%M:%S',
+    '%Y-%m-%d %H:%M:%S',
+)
+
+_AUTHENTICATION_FAILURES = (
+    'authorization failed',
+    'authentication failed',
+    'http error 401',
+    'http error 403',
+)
+
+
+def isAuthenticationFailure(message):
+    '''
+    Return True if the error output of a VCS command reports that the
+    credentials were rejected.
+    '''
+    if not message:
+        return False
+    if isinstance(message, bytes):
+        message = message.decode('utf-8', 'replace')
+
+    message = message.lower()
+    return any(failure in message for failure in _AUTHENTICATION_FAILURES)
+
+
+def _parseExpiry(value):
+    '''
+    Return the expiry time given as seconds since the epoch or as an ISO
+    8601 UTC time, or None if it can not be read.
+    '''
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        pass
+
+    try:
+        # Fractional seconds and a +00:00 offset are ignored.
+        text = str(value).split('.')[0].replace('+00:00', '')
+    except UnicodeError:
+        return None
+    for expiry_format in _EXPIRY_FORMATS:
+        try:
+            return calendar.timegm(time.strptime(text, expiry_format))
+        except ValueError:
+            pass
+
+    return None
+
+
+def credentialExpiry(credentials, now):
+    '''
+    Return the time the given temporary credentials expire, from the
+    lifetime or expiry time given by the server if there is one.  A value
+    that can not be read is treated as if it was not given.
+    '''
+    if 'expires_in' in credentials:
+        try:
+            return now + float(credentials['expires_in'])
+        except (TypeError, ValueError):
+            pass
+    if 'expires' in credentials:
+        expiry = _parseExpiry(credentials['expires'])
+        if expiry is not None:
+            return expiry
+
+    return now + DEFAULT_CREDENTIAL_LIFETIME
+
+
+class CredentialCache(object):
+    '''
+    Keeps the temporary passwords handed out by PMR, keyed by workspace
+    url and access token, until shortly before they expire.
+    '''
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._credentials = {}
+        self._statistics = {'hits': 0, 'requests': 0}
+
+    def get(self, key, request, refresh=False):
+        '''
+        Return the credentials for key, calling request() for new ones
+        when there are none, they are about to expire or refresh is True.
+        '''
+        now = time.time()
+        with self._lock:
+            cached = self._credentials.get(key)
+            if not refresh and cached is not None and cached[1] - EXPIRY_MARGIN > now:
+                self._statistics['hits'] += 1
+                return cached[0]
+
+        credentials = request()
+        with self._lock:
+            self._statistics['requests'] += 1
+            if credentials:
+                self._credentials[key] = (credentials, credentialExpiry(credentials, now))
+            else:
+                self._credentials.pop(key, None)
+
+        return credentials
+
+    def invalidate(self, key):
+        with self._lock:
+            self._credentials.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._credentials = {}
+
+    def statistics(self):
+        with self._lock:
+            return dict(self._statistics)
+
+
+_credential_cache = CredentialCache()
+
+
+def credentialCache():
+    return _credential_cache
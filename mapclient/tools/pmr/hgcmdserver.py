@@ -0,0 +1,333 @@
+'''
+MAP Client, a program to generate detailed musculoskeletal models for OpenSim.
+    Copyright (C) 2012  University of Auckland
+
+This file is part of MAP Client. (http://launchpad.net/mapclient)
+
+    MAP Client is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    MAP Client is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with MAP Client.  If not, see <http://www.gnu.org/licenses/>..
+'''
+import os
+import atexit
+import time
+import struct
+import logging
+import threading
+from collections import OrderedDict
+from subprocess import Popen, PIPE
+
+from mapclient.core.threadcommandmanager import hgExecutable
+
+logger = logging.getLogger(__name__)
+
+# Command servers kept running at once.  When all are busy, that is used
+# within SERVER_IDLE_TIME seconds, commands for other repositories run hg
+# directly rather than stopping a server that is likely to be used again.
+# Servers not used for SERVER_IDLE_TIME seconds are stopped.
+DEFAULT_MAX_SERVERS = 32
+SERVER_IDLE_TIME = 60
+# Seconds to wait before trying to start a command server again after a
+# start failed.
+START_RETRY_DELAY = 60
+
+_HEADER = struct.Struct('>cI')
+_RESULT = struct.Struct('>i')
+
+
+class HgCommandServerError(Exception):
+    pass
+
+
+class HgCommandServer(object):
+    '''
+    A long running 'hg serve --cmdserver pipe' process for one repository.
+    Commands are run one at a time over the pipe without starting a new
+    Mercurial process for each.
+    '''
+
+    def __init__(self, location, hg=None):
+        self._location = location
+        self._lock = threading.Lock()
+        if hg is None:
+            hg = hgExecutable()
+        if hg is None:
+            raise HgCommandServerError('Mercurial is not installed')
+
+        env = dict(os.environ)
+        env['HGPLAIN'] = '1'
+        env['HGENCODING'] = 'UTF-8'
+        self._process = Popen([hg, 'serve', '--cmdserver', 'pipe', '--config', 'ui.interactive=False'],
+                              stdin=PIPE, stdout=PIPE, cwd=location, env=env)
+        channel, hello = self._readChannel()
+        if channel != b'o' or b'runcommand' not in hello:
+            self.close()
+            raise HgCommandServerError('Mercurial command server did not start for: ' + location)
+
+    def location(self):
+        return self._location
+
+    def isRunning(self):
+        return self._process.poll() is None
+
+    def _readChannel(self):
+        header = self._process.stdout.read(_HEADER.size)
+        if len(header) < _HEADER.size:
+            raise HgCommandServerError('Mercurial command server stopped for: ' + self._location)
+
+        channel, length = _HEADER.unpack(header)
+        if channel in (b'I', b'L'):
+            # Input requested, length is the amount wanted not the amount sent.
+            return channel, length
+
+        return channel, self._process.stdout.read(length)
+
+    def runCommand(self, *args):
+        '''
+        Run the hg command given by args in the repository and return
+        (return code, stdout, stderr) with the output as bytes.
+        '''
+        data = b'\0'.join(arg.encode('utf-8') if not isinstance(arg, bytes) else arg for arg in args)
+        with self._lock:
+            if self._process.stdin.closed:
+                raise HgCommandServerError('Mercurial command server closed for: ' + self._location)
+            self._process.stdin.write(b'runcommand\n' + struct.pack('>I', len(data)) + data)
+            self._process.stdin.flush()
+            out = []
+            err = []
+            while True:
+                channel, value = self._readChannel()
+                if channel == b'o':
+                    out.append(value)
+                elif channel == b'e':
+                    err.append(value)
+                elif channel == b'r':
+                    return _RESULT.unpack(value)[0], b''.join(out), b''.join(err)
+                elif channel in (b'I', b'L'):
+                    # Nothing to give, an empty reply signals the end of input.
+                    self._process.stdin.write(struct.pack('>I', 0))
+                    self._process.stdin.flush()
+                elif channel.isupper():
+                    raise HgCommandServerError('Unexpected required channel: %r' % channel)
+
+    def _stop(self):
+        if self._process.poll() is None:
+            self._process.stdin.close()
+            self._process.wait()
+
+    def close(self):
+        with self._lock:
+            self._stop()
+
+    def closeIfIdle(self):
+        '''
+        Close the server unless it is running a command, returns True
+        when it was closed.
+        '''
+        if not self._lock.acquire(False):
+            return False
+        try:
+            self._stop()
+        finally:
+            self._lock.release()
+        return True
+
+
+class HgCommandServerPool(object):
+    '''
+    Hands out a command server per repository, starting them on first use.
+    When the command server cannot be started, or the pool is full of busy
+    servers, commands are run by starting hg directly, so callers need not
+    care which is used.
+    '''
+
+    def __init__(self, max_servers=DEFAULT_MAX_SERVERS):
+        self._max_servers = max_servers
+        self._lock = threading.Lock()
+        self._start_locks = {}
+        # location: (server, time last used), least recently used first.
+        self._servers = OrderedDict()
+        self._retry_after = 0
+        self._reaper = None
+        self._statistics = {'commands': 0, 'servers_started': 0, 'fallbacks': 0, 'servers_reaped': 0}
+
+    def setMaximumServers(self, max_servers):
+        self._max_servers = max_servers
+
+    def _runningServer(self, location):
+        '''
+        Return the running server for location, call with the lock held.
+        '''
+        entry = self._servers.pop(location, None)
+        if entry is not None and entry[0].isRunning():
+            self._servers[location] = (entry[0], time.time())
+            return entry[0]
+
+        return None
+
+    def _makeRoom(self):
+        '''
+        Stop the least recently used server if the pool is full and it is
+        idle.  Returns False when there is no room, call with the lock held.
+        '''
+        if len(self._servers) < self._max_servers:
+            return True
+
+        location, (server, last_used) = next(iter(self._servers.items()))
+        if time.time() - last_used < SERVER_IDLE_TIME:
+            return False
+
+        del self._servers[location]
+        server.close()
+        return True
+
+    def _reapIdle(self):
+        '''
+        Stop the servers that have not been used for SERVER_IDLE_TIME
+        seconds, returns the number of servers left running.
+        '''
+        now = time.time()
+        with self._lock:
+            idle = [(location, server) for location, (server, last_used) in self._servers.items()
+                    if now - last_used >= SERVER_IDLE_TIME]
+
+        for location, server in idle:
+            if server.closeIfIdle():
+                with self._lock:
+                    entry = self._servers.get(location)
+                    if entry is not None and entry[0] is server:
+                        del self._servers[location]
+                        self._statistics['servers_reaped'] += 1
+
+        with self._lock:
+            return len(self._servers)
+
+    def _runReaper(self):
+        while True:
+            time.sleep(SERVER_IDLE_TIME)
+            if self._reapIdle() == 0:
+                with self._lock:
+                    # A server may have started since the count was taken.
+                    if not self._servers:
+                        self._reaper = None
+                        return
+
+    def _startReaper(self):
+        '''
+        Start the thread stopping idle servers if it is not running, call
+        with the lock held.
+        '''
+        if self._reaper is None:
+            self._reaper = threading.Thread(target=self._runReaper, name='HgCommandServerReaper')
+            self._reaper.daemon = True
+            self._reaper.start()
+
+    def _server(self, location):
+        with self._lock:
+            server = self._runningServer(location)
+            if server is not None:
+                return server
+            if time.time() < self._retry_after:
+                return None
+            start_lock = self._start_locks.setdefault(location, threading.Lock())
+
+        # Only one thread starts the server for a location, the others
+        # wait for it and use the same one.
+        with start_lock:
+            with self._lock:
+                server = self._runningServer(location)
+                if server is not None:
+                    return server
+                if not self._makeRoom():
+                    return None
+
+            try:
+                server = HgCommandServer(location)
+            except (HgCommandServerError, OSError) as e:
+                logger.info('Not using the Mercurial command server for {0} seconds: {1}'.format(START_RETRY_DELAY, e))
+                with self._lock:
+                    self._retry_after = time.time() + START_RETRY_DELAY
+                return None
+
+            with self._lock:
+                self._statistics['servers_started'] += 1
+                self._servers[location] = (server, time.time())
+                self._startReaper()
+
+        return server
+
+    def _discard(self, location, server):
+        with self._lock:
+            entry = self._servers.get(location)
+            if entry is not None and entry[0] is server:
+                del self._servers[location]
+        server.close()
+
+    def _touch(self, location, server):
+        # A long command must not make its server look idle.
+        with self._lock:
+            entry = self._servers.get(location)
+            if entry is not None and entry[0] is server:
+                del self._servers[location]
+                self._servers[location] = (server, time.time())
+
+    def runCommand(self, location, *args):
+        '''
+        Run the hg command given by args in the repository at location and
+        return (return code, stdout, stderr).
+        '''
+        location = os.path.abspath(location)
+        with self._lock:
+            self._statistics['commands'] += 1
+        # A server closed by another thread, e.g. by close(), is replaced
+        # by a fresh one once.
+        for _ in range(2):
+            server = self._server(location)
+            if server is None:
+                break
+            try:
+                result = server.runCommand(*args)
+            except (HgCommandServerError, IOError, OSError, ValueError) as e:
+                logger.info('Mercurial command server failed: {0}'.format(e))
+                self._discard(location, server)
+            else:
+                self._touch(location, server)
+                return result
+
+        hg = hgExecutable()
+        if hg is None:
+            raise HgCommandServerError('Mercurial is not installed')
+
+        with self._lock:
+            self._statistics['fallbacks'] += 1
+        process = Popen([hg] + list(args), stdout=PIPE, stderr=PIPE, cwd=location)
+        stdout, stderr = process.communicate()
+        return process.returncode, stdout, stderr
+
+    def close(self):
+        with self._lock:
+            servers = [server for server, _ in self._servers.values()]
+            self._servers.clear()
+        for server in servers:
+            server.close()
+
+    def statistics(self):
+        with self._lock:
+            return dict(self._statistics)
+
+
+_server_pool = HgCommandServerPool()
+atexit.register(_server_pool.close)
+
+
+def hgServerPool():
+    return _server_pool
@@ -0,0 +1,305 @@
+'''
+MAP Client, a program to generate detailed musculoskeletal models for OpenSim.
+    Copyright (C) 2012  University of Auckland
+
+This file is part of MAP Client. (http://launchpad.net/mapclient)
+
+    MAP Client is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    MAP Client is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with MAP Client.  If not, see <http://www.gnu.org/licenses/>..
+'''
+import os
+import json
+import logging
+import tempfile
+import threading
+
+from PySide import QtCore, QtGui
+
+logger = logging.getLogger(__name__)
+
+OPERATION_PUSH = 'push'
+OPERATION_INDEX = 'index'
+
+# Seconds to wait before replaying again after a failure, doubled for
+# every further failure up to the maximum.
+RETRY_INTERVAL = 15.0
+MAX_RETRY_INTERVAL = 600.0
+# Failed attempts after which an operation is parked, it is then left
+# alone until the user retries or discards it, or it is queued again.
+MAX_ATTEMPTS = 8
+
+_JOURNAL_FILENAME = 'pmr-journal.json'
+_JOURNAL_VERSION = 1
+
+
+def defaultJournalFilename():
+    location = QtGui.QDesktopServices.storageLocation(QtGui.QDesktopServices.DataLocation)
+    if not location:
+        location = os.path.join(tempfile.gettempdir(), 'mapclient')
+
+    return os.path.join(location, _JOURNAL_FILENAME)
+
+
+class OfflineJournal(QtCore.QObject):
+    '''
+    A durable queue of the PMR operations that do not need to hold up the
+    user: pushing a repository and setting the files of a workspace to
+    index.  Operations are written to disk as they are queued and replayed
+    on a background thread, with a growing delay while PMR cannot be
+    reached.  Operations are coalesced, a repository is pushed once however
+    many commits were queued and only the latest indexer paths are sent.
+    The oldest operation that can run is replayed first, so one that keeps
+    failing does not hold up the others, and after MAX_ATTEMPTS failures
+    it is parked.
+    '''
+
+    failed = QtCore.Signal(str, str)
+    parked = QtCore.Signal(str, str)
+    pendingChanged = QtCore.Signal(int)
+
+    def __init__(self, filename=None, pmr_tool=None, parent=None):
+        super(OfflineJournal, self).__init__(parent)
+        self._filename = filename
+        self._pmr_tool = pmr_tool
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = None
+        self._entries = None
+        self._sequence = 0
+
+    def _journalFilename(self):
+        if self._filename is None:
+            self._filename = defaultJournalFilename()
+
+        return self._filename
+
+    def _pmrTool(self):
+        if self._pmr_tool is None:
+            from mapclient.tools.pmr.pmrtool import PMRTool
+            self._pmr_tool = PMRTool()
+
+        return self._pmr_tool
+
+    def _load(self):
+        if self._entries is None:
+            self._entries = []
+            try:
+                with open(self._journalFilename()) as f:
+                    content = json.load(f)
+            except (IOError, OSError, ValueError):
+                return
+
+            if content.get('version') == _JOURNAL_VERSION:
+                self._entries = content.get('entries', [])
+                self._sequence = max([entry['sequence'] for entry in self._entries] + [0])
+
+    def _save(self):
+        filename = self._journalFilename()
+        temporary_filename = filename + '.tmp'
+        try:
+            directory = os.path.dirname(filename)
+            if not os.path.exists(directory):
+                os.makedirs(directory)
+            with open(temporary_filename, 'w') as f:
+                json.dump({'version': _JOURNAL_VERSION, 'entries': self._entries}, f)
+            if os.path.exists(filename):
+                os.remove(filename)
+            os.rename(temporary_filename, filename)
+        except (IOError, OSError):
+            logger.warning('Could not write the PMR journal {0}'.format(filename))
+
+    def _queue(self, operation, local_workspace_dir, paths=None):
+        with self._lock:
+            self._load()
+            self._sequence += 1
+            for entry in self._entries:
+                if entry['operation'] == operation and entry['workspace'] == local_workspace_dir:
+                    break
+            else:
+                entry = {'operation': operation, 'workspace': local_workspace_dir, 'attempts': 0}
+                self._entries.append(entry)
+            entry['sequence'] = self._sequence
+            entry['paths'] = paths
+            # Queued again, so worth trying again.
+            entry['attempts'] = 0
+            entry['parked'] = False
+            self._save()
+            pending = len(self._entries)
+
+        self.pendingChanged.emit(pending)
+        self._wake.set()
+
+    def queuePush(self, local_workspace_dir):
+        '''
+        Push the repository at local_workspace_dir to its remote once PMR
+        can be reached.
+        '''
+        self._queue(OPERATION_PUSH, local_workspace_dir)
+
+    def queueIndexerPaths(self, local_workspace_dir, paths):
+        '''
+        Set the files of the remote workspace of local_workspace_dir that
+        are indexed for ontological searching, replacing any paths queued
+        earlier.
+        '''
+        self._queue(OPERATION_INDEX, local_workspace_dir, list(paths))
+
+    def pending(self):
+        with self._lock:
+            self._load()
+            return [dict(entry) for entry in self._entries]
+
+    def parkedEntries(self):
+        '''
+        Return the operations that are no longer replayed because they
+        failed too many times.
+        '''
+        return [entry for entry in self.pending() if entry.get('parked')]
+
+    def _find(self, operation, local_workspace_dir):
+        for entry in self._entries:
+            if entry['operation'] == operation and entry['workspace'] == local_workspace_dir:
+                return entry
+
+        return None
+
+    def retry(self, operation, local_workspace_dir):
+        '''
+        Replay the given operation again, from the first attempt.
+        '''
+        with self._lock:
+            self._load()
+            entry = self._find(operation, local_workspace_dir)
+            if entry is None:
+                return
+            entry['attempts'] = 0
+            entry['parked'] = False
+            self._save()
+
+        self._wake.set()
+
+    def discard(self, operation, local_workspace_dir):
+        '''
+        Remove the given operation from the journal without replaying it.
+        '''
+        with self._lock:
+            self._load()
+            entry = self._find(operation, local_workspace_dir)
+            if entry is None:
+                return
+            self._entries.remove(entry)
+            self._save()
+            pending = len(self._entries)
+
+        self.pendingChanged.emit(pending)
+
+    def start(self):
+        '''
+        Start replaying the journal, including anything left over from an
+        earlier session, in the background.
+        '''
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._run, name='PMRJournal')
+            self._thread.daemon = True
+            self._thread.start()
+        self._wake.set()
+
+    def _nextEntry(self):
+        '''
+        Return the oldest entry that is not parked and, for an indexer
+        update, has no push of the same workspace before it, as the
+        indexer can only see files that have been pushed.
+        '''
+        with self._lock:
+            self._load()
+            pushing = set(entry['workspace'] for entry in self._entries
+                          if entry['operation'] == OPERATION_PUSH)
+            for entry in self._entries:
+                if entry.get('parked'):
+                    continue
+                if entry['operation'] == OPERATION_INDEX and entry['workspace'] in pushing:
+                    continue
+                return dict(entry)
+
+        return None
+
+    def _replay(self, entry):
+        pmr_tool = self._pmrTool()
+        if entry['operation'] == OPERATION_PUSH:
+            pmr_tool.pushToRemote(entry['workspace'])
+        else:
+            pmr_tool.setIndexerPaths(entry['workspace'], entry['paths'])
+
+    def _completed(self, entry):
+        with self._lock:
+            for current in self._entries:
+                if current['operation'] == entry['operation'] and current['workspace'] == entry['workspace']:
+                    # Queued again while replaying, keep it for another pass.
+                    if current['sequence'] == entry['sequence']:
+                        self._entries.remove(current)
+                        self._save()
+                    break
+            pending = len(self._entries)
+
+        self.pendingChanged.emit(pending)
+
+    def _failed(self, entry, error):
+        parked = False
+        with self._lock:
+            current = self._find(entry['operation'], entry['workspace'])
+            if current is not None:
+                current['attempts'] += 1
+                parked = current['attempts'] >= MAX_ATTEMPTS
+                current['parked'] = parked
+                current['error'] = str(error)
+                # To the back of the queue so it does not hold up the others.
+                self._entries.remove(current)
+                self._entries.append(current)
+                self._save()
+
+        logger.info('Replaying PMR {0} of {1} failed: {2}'.format(entry['operation'], entry['workspace'], error))
+        if parked:
+            self.parked.emit(entry['workspace'], str(error))
+        else:
+            self.failed.emit(entry['workspace'], str(error))
+
+    def _run(self):
+        delay = RETRY_INTERVAL
+        while True:
+            self._wake.clear()
+            entry = self._nextEntry()
+            if entry is None:
+                self._wake.wait()
+                continue
+
+            try:
+                self._replay(entry)
+            except Exception as e:
+                self._failed(entry, e)
+                # Queuing something new cuts the wait short.
+                self._wake.wait(delay)
+                delay = min(delay * 2, MAX_RETRY_INTERVAL)
+            else:
+                self._completed(entry)
+                delay = RETRY_INTERVAL
+
+
+_offline_journal = None
+
+
+def offlineJournal():
+    global _offline_journal
+    if _offline_journal is None:
+        _offline_journal = OfflineJournal()
+
+    return _offline_journal
@@ -0,0 +1,91 @@
+'''
+MAP Client, a program to generate detailed musculoskeletal models for OpenSim.
+    Copyright (C) 2012  University of Auckland
+
+This file is part of MAP Client. (http://launchpad.net/mapclient)
+
+    MAP Client is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    MAP Client is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with MAP Client.  If not, see <http://www.gnu.org/licenses/>..
+'''
+from PySide import QtGui, QtCore
+
+
+class JournalDialog(QtGui.QDialog):
+    '''
+    Lists the PMR operations waiting in the offline journal, parked ones
+    with the error they last failed with, and lets the user retry or
+    discard them.
+    '''
+
+    def __init__(self, journal, parent=None):
+        QtGui.QDialog.__init__(self, parent)
+        self._journal = journal
+        self.setWindowTitle('PMR Updates')
+        self.resize(600, 300)
+
+        self._list = QtGui.QListWidget(self)
+        self._list.setSelectionMode(QtGui.QAbstractItemView.ExtendedSelection)
+        button_box = QtGui.QDialogButtonBox(QtGui.QDialogButtonBox.Close, parent=self)
+        self._retry_button = button_box.addButton('Retry', QtGui.QDialogButtonBox.ActionRole)
+        self._discard_button = button_box.addButton('Discard', QtGui.QDialogButtonBox.ActionRole)
+
+        layout = QtGui.QVBoxLayout(self)
+        layout.addWidget(self._list)
+        layout.addWidget(button_box)
+
+        button_box.rejected.connect(self.reject)
+        self._retry_button.clicked.connect(self._retryClicked)
+        self._discard_button.clicked.connect(self._discardClicked)
+        self._list.itemSelectionChanged.connect(self._updateUi)
+        self._journal.pendingChanged.connect(self._refresh)
+
+        self._refresh()
+
+    def _refresh(self, pending=None):
+        self._list.clear()
+        for entry in self._journal.pending():
+            text = '%s %s' % (entry['operation'], entry['workspace'])
+            if entry.get('parked'):
+                text += ' (stopped after %d attempts: %s)' % (entry['attempts'], entry.get('error', ''))
+            elif entry['attempts']:
+                text += ' (%d failed attempts)' % entry['attempts']
+            item = QtGui.QListWidgetItem(text, self._list)
+            item.setData(QtCore.Qt.UserRole, (entry['operation'], entry['workspace']))
+        self._updateUi()
+
+    def _updateUi(self):
+        selected = len(self._list.selectedItems()) > 0
+        self._retry_button.setEnabled(selected)
+        self._discard_button.setEnabled(selected)
+
+    def _selectedEntries(self):
+        return [item.data(QtCore.Qt.UserRole) for item in self._list.selectedItems()]
+
+    def _retryClicked(self):
+        for operation, workspace in self._selectedEntries():
+            self._journal.retry(operation, workspace)
+        self._refresh()
+
+    def _discardClicked(self):
+        entries = self._selectedEntries()
+        answer = QtGui.QMessageBox.question(self, 'Discard PMR Updates',
+            'Discard the %d selected update(s)?  They will not be sent to PMR.' % len(entries),
+            QtGui.QMessageBox.Yes | QtGui.QMessageBox.No, QtGui.QMessageBox.No)
+        if answer == QtGui.QMessageBox.Yes:
+            for operation, workspace in entries:
+                self._journal.discard(operation, workspace)
+            self._refresh()
+
+    def done(self, result):
+        self._journal.pendingChanged.disconnect(self._refresh)
+        QtGui.QDialog.done(self, result)
@@ -0,0 +1,197 @@
+'''
+MAP Client, a program to generate detailed musculoskeletal models for OpenSim.
+    Copyright (C) 2012  University of Auckland
+
+This file is part of MAP Client. (http://launchpad.net/mapclient)
+
+    MAP Client is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    MAP Client is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with MAP Client.  If not, see <http://www.gnu.org/licenses/>..
+'''
+import os
+import json
+import time
+import shutil
+import hashlib
+import logging
+import tempfile
+import threading
+
+from PySide import QtGui
+
+logger = logging.getLogger(__name__)
+
+# Bytes the mirrors may take up on disk before the least recently used are evicted.
+DEFAULT_MIRROR_SIZE = 2 * 1024 * 1024 * 1024
+
+_MIRROR_DIRNAME = 'pmr-mirrors'
+_META_FILENAME = 'mirror.json'
+
+
+def defaultMirrorDirectory():
+    location = QtGui.QDesktopServices.storageLocation(QtGui.QDesktopServices.DataLocation)
+    if not location:
+        location = os.path.join(tempfile.gettempdir(), 'mapclient')
+
+    return os.path.join(location, _MIRROR_DIRNAME)
+
+
+def directorySize(directory):
+    size = 0
+    for root, _, filenames in os.walk(directory):
+        for filename in filenames:
+            try:
+                size += os.lstat(os.path.join(root, filename)).st_size
+            except OSError:
+                pass
+
+    return size
+
+
+class WorkspaceMirror(object):
+    '''
+    A local store of PMR workspace repositories addressed by remote
+    workspace url.  A workspace is fetched from PMR once, brought up to
+    date with a pull when it is next used, and step directories are then
+    cloned from the local copy.  Once the store is larger than max_bytes
+    the least recently used mirrors are removed, except those acquired and
+    not yet released.
+    '''
+
+    def __init__(self, directory=None, max_bytes=DEFAULT_MIRROR_SIZE):
+        self._directory = directory
+        self._max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._url_locks = {}
+        self._users = {}
+
+    def directory(self):
+        if self._directory is None:
+            self._directory = defaultMirrorDirectory()
+
+        return self._directory
+
+    def setMaximumSize(self, max_bytes):
+        self._max_bytes = max_bytes
+
+    def maximumSize(self):
+        return self._max_bytes
+
+    def mirrorDirectory(self, remote_workspace_url):
+        digest = hashlib.sha1(remote_workspace_url.rstrip('/').encode('utf-8')).hexdigest()
+        return os.path.join(self.directory(), digest)
+
+    def _urlLock(self, remote_workspace_url):
+        with self._lock:
+            return self._url_locks.setdefault(remote_workspace_url, threading.Lock())
+
+    def _readMeta(self, mirror_dir):
+        try:
+            with open(os.path.join(mirror_dir, _META_FILENAME)) as f:
+                return json.load(f)
+        except (IOError, OSError, ValueError):
+            return None
+
+    def _writeMeta(self, mirror_dir, remote_workspace_url):
+        meta = {'url': remote_workspace_url, 'last_used': time.time(),
+                'size': directorySize(mirror_dir)}
+        with open(os.path.join(mirror_dir, _META_FILENAME), 'w') as f:
+            json.dump(meta, f)
+
+    def _use(self, mirror_dir, count):
+        with self._lock:
+            users = self._users.get(mirror_dir, 0) + count
+            if users:
+                self._users[mirror_dir] = users
+            else:
+                del self._users[mirror_dir]
+
+    def _inUse(self, mirror_dir):
+        with self._lock:
+            return mirror_dir in self._users
+
+    def acquire(self, remote_workspace_url, fetch, update):
+        '''
+        Return the mirror directory for the given workspace.  fetch(mirror_dir)
+        is called to create a new mirror in the existing, empty, directory
+        and update(mirror_dir) to pull the changes into an existing one.
+        The mirror is not evicted until it is given back with release().
+        '''
+        mirror_dir = self.mirrorDirectory(remote_workspace_url)
+        self._use(mirror_dir, 1)
+        try:
+            with self._urlLock(remote_workspace_url):
+                if self._readMeta(mirror_dir) is None:
+                    # Missing, or left incomplete by an earlier failure.
+                    if os.path.exists(mirror_dir):
+                        shutil.rmtree(mirror_dir)
+                    os.makedirs(mirror_dir)
+                    try:
+                        fetch(mirror_dir)
+                    except Exception:
+                        shutil.rmtree(mirror_dir, ignore_errors=True)
+                        raise
+                else:
+                    update(mirror_dir)
+                self._writeMeta(mirror_dir, remote_workspace_url)
+        except Exception:
+            self._use(mirror_dir, -1)
+            raise
+
+        return mirror_dir
+
+    def release(self, mirror_dir):
+        '''
+        Give back a mirror directory returned by acquire(), once it is no
+        longer used the store is trimmed to the maximum size.
+        '''
+        self._use(mirror_dir, -1)
+        self.evict()
+
+    def evict(self, keep=None):
+        '''
+        Remove the least recently used mirrors until the store fits in the
+        maximum size.  The mirror at keep, and mirrors in use, are never
+        removed.
+        '''
+        directory = self.directory()
+        if not os.path.isdir(directory):
+            return
+
+        mirrors = []
+        for name in os.listdir(directory):
+            mirror_dir = os.path.join(directory, name)
+            meta = self._readMeta(mirror_dir)
+            if meta is not None:
+                mirrors.append((meta['last_used'], meta['size'], mirror_dir, meta['url']))
+
+        total = sum(mirror[1] for mirror in mirrors)
+        for _, size, mirror_dir, url in sorted(mirrors):
+            if total <= self._max_bytes:
+                break
+            if mirror_dir == keep:
+                continue
+            with self._urlLock(url):
+                # Checked under the url lock, acquire() marks a mirror
+                # in use before it takes that lock.
+                if self._inUse(mirror_dir):
+                    continue
+                shutil.rmtree(mirror_dir, ignore_errors=True)
+            total -= size
+            logger.info('Evicted the PMR workspace mirror of {0}'.format(url))
+
+
+_workspace_mirror = WorkspaceMirror()
+
+
+def workspaceMirror():
+    return _workspace_mirror
@@ -19,9 +19,8 @@ This file is part of MAP Client. (http://launchpad.net/mapclient)
 '''
 import os
 
-from subprocess import Popen, PIPE
-
-from mapclient.core.threadcommandmanager import which
+from mapclient.core.threadcommandmanager import hgExecutable
+from mapclient.tools.pmr.hgcmdserver import hgServerPool
 
 def isHgRepository(location):
     return os.path.exists(os.path.join(location, '.hg'))
@@ -29,13 +28,39 @@ def isHgRepository(location):
 def repositoryIsUpToDate(location):
     result = True
     if isHgRepository(location):
-        hg = which('hg')
-        if len(hg) > 0:
-            process = Popen([hg[0], "status", location], stdout=PIPE, stderr=PIPE)
-            outputs = process.communicate()
-            stdout = outputs[0]
-            stderr = outputs[1]
+        if hgExecutable() is not None:
+            _, stdout, stderr = hgServerPool().runCommand(location, 'status', location)
             if len(stdout) > 0 or len(stderr) > 0:
                 result = False
         
     return result
+
+def repositoriesAreUpToDate(locations):
+    '''
+    Return a dict of location to whether the repository there is up to
+    date.  The status of every repository is asked of the command server
+    of the first one, rather than starting a server per repository.
+    '''
+    results = dict((location, True) for location in locations)
+    repositories = [location for location in locations if isHgRepository(location)]
+    if not repositories or hgExecutable() is None:
+        return results
+
+    pool = hgServerPool()
+    for location in repositories:
+        _, stdout, stderr = pool.runCommand(repositories[0], 'status', '-R', location, location)
+        results[location] = len(stdout) == 0 and len(stderr) == 0
+
+    return results
+
+def trackedChanges(location):
+    '''
+    Return the tracked files in the repository at location that are
+    modified, added or removed.  Untracked files, such as caches written
+    by steps, are not included.
+    '''
+    if not isHgRepository(location) or hgExecutable() is None:
+        return []
+
+    _, stdout, _ = hgServerPool().runCommand(location, 'status', '--modified', '--added', '--removed', '--no-status', location)
+    return [line for line in stdout.decode('utf-8', 'replace').splitlines() if line]
@@ -21,13 +21,11 @@ from PySide import QtGui, QtCore
 
 from mapclient.settings import info
 from mapclient.tools.annotation.annotationtool import AnnotationTool
-from mapclient.tools.pmr.pmrtool import PMRTool
+from mapclient.tools.pmr.pmrtool import PMRTool, DEFAULT_SEARCH_TIMEOUT
+from mapclient.tools.pmr.requestrunner import PMRRequestRunner
 from mapclient.tools.pmr.authoriseapplicationdialog import AuthoriseApplicationDialog
 from mapclient.tools.pmr.ui_pmrsearchdialog import Ui_PMRSearchDialog
 
-from mapclient.widgets.utils import set_wait_cursor
-from mapclient.widgets.utils import handle_runtime_error
-
 
 class PMRSearchDialog(QtGui.QDialog):
     '''
@@ -45,6 +43,7 @@ class PMRSearchDialog(QtGui.QDialog):
 
         self._pmrTool = PMRTool()
         self._annotationTool = AnnotationTool()
+        self._search_runner = PMRRequestRunner(self)
 
         self._makeConnections()
 
@@ -60,9 +59,9 @@ class PMRSearchDialog(QtGui.QDialog):
         self._ui.searchButton.clicked.connect(self._searchClicked)
         self._ui.registerLabel.linkActivated.connect(self.register)
         self._ui.deregisterLabel.linkActivated.connect(self.deregister)
+        self._search_runner.finished.connect(self._searchFinished)
+        self._search_runner.failed.connect(self._searchFailed)
 
-    @handle_runtime_error
-    @set_wait_cursor
     def _searchClicked(self):
         # Set pmrlib to go
         self._ui.searchResultsListWidget.clear()
@@ -75,8 +74,13 @@ class PMRSearchDialog(QtGui.QDialog):
             if rdfterm:
                 search_text = search_text + ' ' + rdfterm[1:-1]
 
-        results = self._pmrTool.search(search_text)
+        # Runs in the background, clicking search again supersedes this search.
+        self._search_runner.start(self._pmrTool.search, search_text, timeout=DEFAULT_SEARCH_TIMEOUT)
+
+    def _searchFailed(self, error):
+        QtGui.QMessageBox.critical(self, error.title, error.description)
 
+    def _searchFinished(self, results):
         for r in results:
             if 'title' in r and r['title']:
                 item = QtGui.QListWidgetItem(r['title'], self._ui.searchResultsListWidget)
@@ -84,6 +88,10 @@ class PMRSearchDialog(QtGui.QDialog):
                 item = QtGui.QListWidgetItem(r['target'], self._ui.searchResultsListWidget)
             item.setData(QtCore.Qt.UserRole, r)
 
+    def reject(self):
+        self._search_runner.cancel()
+        QtGui.QDialog.reject(self)
+
     def getSelectedWorkspace(self):
         items = self._ui.searchResultsListWidget.selectedItems()
         for item in items:
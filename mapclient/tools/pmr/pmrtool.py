@@ -4,12 +4,13 @@ Created on Jun 20, 2013
 @author: hsorby
 '''
 
+import os
 import json
+import time
 import logging
 
 from requests import HTTPError
-from requests import Session
-from requests_oauthlib import OAuth1Session
+from requests import Timeout
 
 from pmr2.wfctrl.core import get_cmd_by_name
 from pmr2.wfctrl.core import CmdWorkspace
@@ -20,6 +21,14 @@ import pmr2.wfctrl.cmd
 
 from mapclient.exceptions import ClientRuntimeError
 from mapclient.settings import info
+from mapclient.tools.pmr.session import sessionManager
+from mapclient.tools.pmr.cache import responseCache
+from mapclient.tools.pmr.requestexecutor import requestExecutor
+from mapclient.tools.pmr.mirror import workspaceMirror
+from mapclient.tools.pmr.hgcmdserver import hgServerPool
+from mapclient.core.threadcommandmanager import hgExecutable
+from mapclient.tools.pmr.workerpool import runConcurrently
+from mapclient.tools.pmr.credentials import credentialCache, isAuthenticationFailure
 
 logger = logging.getLogger(__name__)
 
@@ -28,6 +37,12 @@ plain_text_search_string = 'Plain text'
 workflow_search_string = 'Workflow'
 search_domains = [ontological_search_string, plain_text_search_string, workflow_search_string]
 
+# Seconds to wait for the server to respond to a search.
+DEFAULT_SEARCH_TIMEOUT = 30
+SEARCH_PAGE_SIZE = 200
+# Workspaces cloned at the same time by cloneWorkspaces.
+DEFAULT_CLONE_WORKERS = 4
+
 endpoints = {
     '': {
         'dashboard': 'pmr2-dashboard',
@@ -120,22 +135,24 @@ class PMRTool(object):
         self._termLookUpLimit = 32
 
     def make_session(self, pmr_info=None):
+        '''
+        Return the shared keep-alive session for the current PMR host
+        and credentials.
+        '''
         if pmr_info is None:
             pmr_info = info.PMRInfo()
 
-        if self.hasAccess():
-            kwargs = pmr_info.get_session_kwargs()
-            session = OAuth1Session(**kwargs)
-        else:
-            # normal session without OAuth requirements.
-            session = Session()
-
-        session.headers.update({
+        return sessionManager().session(pmr_info, {
             'Accept': self.PROTOCOL,
             'Content-Type': self.PROTOCOL,
             'User-Agent': self.UA,
         })
-        return session
+
+    def sessionStatistics(self):
+        return sessionManager().statistics()
+
+    def requestStatistics(self):
+        return requestExecutor().statistics()
 
     def hasAccess(self):
         pmr_info = info.PMRInfo()
@@ -144,45 +161,65 @@ class PMRTool(object):
     def deregister(self):
         pmr_info = info.PMRInfo()
         pmr_info.update_token(None, None)
+        credentialCache().clear()
 
-    # also workaround the resigning redirections by manually resolving
-    # redirects while using allow_redirects=False when making all requests
+    # All requests go through the request executor, which resolves
+    # redirects manually so OAuth signatures are regenerated for each hop.
 
-    def _search(self, text, search_type):
+    def _search(self, text, search_type, timeout=None, batch_start=None, batch_size=None):
         pmr_info = info.PMRInfo()
-        session = self.make_session()
+        session = self.make_session(pmr_info)
 
         if search_type == ontological_search_string:
-            r = session.post('/'.join((pmr_info.host, endpoints['']['ricordo'])),
-                data=make_form_request('search',
-                    simple_query=text,
-                ),
-                allow_redirects=False)
+            endpoint = 'ricordo'
+            data = make_form_request('search',
+                simple_query=text,
+            )
         elif search_type == workflow_search_string:
-            r = session.post('/'.join((pmr_info.host, endpoints['']['map'])),
-                data=make_form_request('search',
-                    workflow_object='Workflow Project',
-                    ontological_term=text
-                ),
-                allow_redirects=False)
-        else:
-            data = json.dumps({'SearchableText': text, 'portal_type': 'Workspace'})
-            r = session.post(
-                '/'.join((pmr_info.host, endpoints['']['search'])),
-                data=data,
+            endpoint = 'map'
+            data = make_form_request('search',
+                workflow_object='Workflow Project',
+                ontological_term=text
             )
-        r.raise_for_status()
-        return r.json()
-
-    def search(self, text, search_type=plain_text_search_string):
+        else:
+            endpoint = 'search'
+            query = {'SearchableText': text, 'portal_type': 'Workspace'}
+            if batch_size:
+                # Only the catalog search supports server side batching.
+                query['b_start'] = batch_start or 0
+                query['b_size'] = batch_size
+            data = json.dumps(query)
+
+        target = '/'.join((pmr_info.host, endpoints[''][endpoint]))
+        # The timeout bounds the whole search, retries included.
+        deadline = None if timeout is None else time.time() + timeout
+
+        def request(headers):
+            # Searching does not modify anything so it is safe to retry.
+            return requestExecutor().execute(session, 'POST', target, endpoint,
+                data=data, headers=headers, timeout=timeout, deadline=deadline,
+                idempotent=True)
+
+        return responseCache().fetch(endpoint,
+            (target, data, pmr_info.user_public_token), request)
+
+    def search(self, text, search_type=plain_text_search_string, timeout=None,
+               batch_start=None, batch_size=None):
         '''
         Search PMR for the given text, the search type
         can be either 'plain' for plain text searching or
         'ontological' for ricordo knowledge base searching.
+        The timeout is in seconds, None waits for as long as it takes.
+        Plain text searches return batch_size results from batch_start
+        when a batch size is given.
         '''
-        self._search(text, search_type)
         try:
-            return self._search(text, search_type)
+            return self._search(text, search_type, timeout, batch_start, batch_size)
+        except Timeout:
+            raise PMRToolError('Search Timed Out',
+                'The PMR server did not respond to the search in time.  '
+                'Please try again later.'
+            )
         except HTTPError as e:
             msg_403 = 'The configured PMR server may have disallowed searching.'
             if self.hasAccess():
@@ -208,10 +245,15 @@ class PMRTool(object):
             raise PMRToolError('Unexpected exception', str(e))
 
     def _getObjectInfo(self, target_url):
-        session = self.make_session()
-        r = session.get(target_url)
-        r.raise_for_status()
-        return r.json()
+        pmr_info = info.PMRInfo()
+        session = self.make_session(pmr_info)
+
+        def request(headers):
+            return requestExecutor().execute(session, 'GET', target_url,
+                'object-info', headers=headers)
+
+        return responseCache().fetch('object-info',
+            (target_url, pmr_info.user_public_token), request)
 
     def getObjectInfo(self, target_url):
         return self._getObjectInfo(target_url)
@@ -228,33 +270,61 @@ class PMRTool(object):
         except Exception as e:
             raise PMRToolError('Unexpected exception', str(e))
 
-    def requestTemporaryPassword(self, workspace_url):
-        if not self.hasAccess():
-            return None
-
-        session = self.make_session()
-        r = session.post(
+    def _requestTemporaryPassword(self, pmr_info, workspace_url):
+        session = self.make_session(pmr_info)
+        # A new temporary password replaces the previous one, so retrying is harmless.
+        r = requestExecutor().execute(session, 'POST',
             '/'.join((workspace_url, endpoints['Workspace']['temppass'])),
-            data='{}',
-        )
+            'temppass', data='{}', idempotent=True)
         r.raise_for_status()
         return r.json()
 
+    def requestTemporaryPassword(self, workspace_url, refresh=False):
+        '''
+        Return temporary credentials for the workspace, these are reused
+        until they expire unless refresh is True.
+        '''
+        pmr_info = info.PMRInfo()
+        if not pmr_info.has_access():
+            return None
+
+        return credentialCache().get((workspace_url, pmr_info.user_public_token),
+            lambda: self._requestTemporaryPassword(pmr_info, workspace_url), refresh)
+
+    def _withTemporaryPassword(self, workspace_url, command):
+        '''
+        Run command(creds), for a VCS command returning (stdout, stderr),
+        once more with fresh credentials if the cached ones were rejected.
+        '''
+        creds = self.requestTemporaryPassword(workspace_url)
+        result = command(creds)
+        if creds and isAuthenticationFailure(result[1]):
+            creds = self.requestTemporaryPassword(workspace_url, refresh=True)
+            result = command(creds)
+
+        return result
+
     def authorizationUrl(self, key):
         return self._client.authorizationUrl(key)
 
-    def getDashboard(self):
-        pmr_info = info.PMRInfo()
+    def getDashboard(self, pmr_info=None):
+        if pmr_info is None:
+            pmr_info = info.PMRInfo()
         session = self.make_session(pmr_info)
         target = '/'.join([pmr_info.host, endpoints['']['dashboard']])
-        r = session.get(target)
-        r.raise_for_status()
-        return r.json()
+
+        def request(headers):
+            return requestExecutor().execute(session, 'GET', target,
+                'dashboard', headers=headers)
+
+        return responseCache().fetch('dashboard',
+            (target, pmr_info.user_public_token), request)
 
     def addWorkspace(self, title, description, storage='mercurial'):
-        session = self.make_session()
+        pmr_info = info.PMRInfo()
+        session = self.make_session(pmr_info)
 
-        dashboard = self.getDashboard()
+        dashboard = self.getDashboard(pmr_info)
         option = dashboard.get('workspace-add', {})
         target = option.get('target')
 
@@ -262,11 +332,10 @@ class PMRTool(object):
             # XXX exception?
             return
 
-        # XXX until requests and requests_oauthlib work together to
-        # provide a fix for the redirection and OAuth signature
-        # regeneration, we have to handle all redirects manually.
-        r = session.get(target, allow_redirects=False)
-        target = r.headers.get('Location')
+        # the executor follows the redirect to the add form, signing
+        # each hop separately.
+        r = requestExecutor().execute(session, 'GET', target, 'workspace-add')
+        target = r.url
 
         # the real form get
         # XXX I need to get PMR to generate IDs if the autoinc isn't
@@ -274,53 +343,126 @@ class PMRTool(object):
         # XXX should verify the contents of the fields.
         # r = session.get(target, allow_redirects=False)
 
-        # For now, just post
-        r = session.post(target,
+        # For now, just post.  Never retried as that could create the
+        # workspace twice.
+        r = requestExecutor().execute(session, 'POST', target, 'workspace-add',
             data=make_form_request('add',
                 title=title,
                 description=description,
                 storage=storage,
             ),
-            allow_redirects=False)
+            follow_redirects=False)
 
         workspace_target = r.headers.get('Location')
         # verify that this is an actual workspace by getting it.
-        r = session.get(workspace_target)
+        r = requestExecutor().execute(session, 'GET', workspace_target, 'workspace')
         return r.json().get('url')
 
-    def cloneWorkspace(self, remote_workspace_url, local_workspace_dir):
+    def _pullWorkspace(self, remote_workspace_url, local_workspace_dir, link=True):
         # XXX target_dir is assumed to exist, so we can't just clone
         # but we have to instantiate that as a new repo, define the
         # remote and pull.
 
         # link
-        self.linkWorkspaceDirToUrl(
-            local_workspace_dir=local_workspace_dir,
-            remote_workspace_url=remote_workspace_url,
-        )
+        if link:
+            self.linkWorkspaceDirToUrl(
+                local_workspace_dir=local_workspace_dir,
+                remote_workspace_url=remote_workspace_url,
+            )
 
         workspace = CmdWorkspace(local_workspace_dir, auto=True)
 
         # Another caveat: that workspace is possibly private.  Acquire
         # temporary password.
-        creds = self.requestTemporaryPassword(remote_workspace_url)
-        if creds:
-            result = workspace.cmd.pull(workspace,
-                username=creds['user'], password=creds['key'])
-        else:
+        def pull(creds):
+            if creds:
+                return workspace.cmd.pull(workspace,
+                    username=creds['user'], password=creds['key'])
+
             # no credentials
             logger.info('not using credentials as none are detected')
-            result = workspace.cmd.pull(workspace)
+            return workspace.cmd.pull(workspace)
+
+        result = self._withTemporaryPassword(remote_workspace_url, pull)
+        # Newer command wrappers also return the exit status.
+        failed = result[2] != 0 if len(result) > 2 else bool(result[1])
+        if failed:
+            raise PMRToolError('Error pulling changes from PMR',
+                'The command line tool gave us this error message:\n\n' +
+                    str(result[1]))
+
+        return result
+
+    def cloneWorkspace(self, remote_workspace_url, local_workspace_dir):
+        # The workspace is fetched into, or updated in, the shared mirror
+        # and the local workspace is then made from the mirror.
+        mirror = workspaceMirror()
+        mirror_dir = mirror.acquire(remote_workspace_url,
+            lambda d: self._pullWorkspace(remote_workspace_url, d),
+            lambda d: self._pullWorkspace(remote_workspace_url, d, link=False))
 
+        try:
+            cmd_cls = CmdWorkspace(mirror_dir, auto=True).cmd.__class__
+            if not os.listdir(local_workspace_dir):
+                # A local clone hardlinks the repository store of the mirror.
+                workspace = CmdWorkspace(local_workspace_dir, cmd_cls(remote=mirror_dir))
+                result = None
+            else:
+                workspace = CmdWorkspace(local_workspace_dir, cmd_cls())
+                cmd_cls(remote=mirror_dir).write_remote(workspace)
+                result = workspace.cmd.pull(workspace)
+        finally:
+            mirror.release(mirror_dir)
+
+        # Point the workspace back at PMR for subsequent pushes and pulls.
+        cmd = cmd_cls(remote=remote_workspace_url)
+        cmd.write_remote(workspace)
         # TODO trap this result too?
-        workspace.cmd.reset_to_remote(workspace)
+        cmd.reset_to_remote(workspace)
         return result
 
+    def cloneWorkspaces(self, workspaces, max_workers=DEFAULT_CLONE_WORKERS, progress=None):
+        '''
+        Clone each (remote_workspace_url, local_workspace_dir) pair in
+        workspaces, with up to max_workers clones running at a time.
+        progress(completed, total, remote_workspace_url) is called on the
+        calling thread as each clone finishes, when that is not the GUI
+        thread it should only emit a signal.  Once every clone has
+        finished a PMRToolError listing the failed workspaces is raised if
+        any failed, otherwise the pull results are returned in order.
+        '''
+        def clone(workspace):
+            remote_workspace_url, local_workspace_dir = workspace
+            if not os.path.exists(local_workspace_dir):
+                os.makedirs(local_workspace_dir)
+            return self.cloneWorkspace(remote_workspace_url, local_workspace_dir)
+
+        def report(completed, total, workspace):
+            if progress is not None:
+                progress(completed, total, workspace[0])
+
+        workspaces = list(workspaces)
+        outcomes = runConcurrently(clone, workspaces, max_workers, report, 'PMRClone')
+        failures = ['%s: %s' % (workspace[0], error)
+                    for workspace, (_, error) in zip(workspaces, outcomes) if error is not None]
+        if failures:
+            raise PMRToolError('Clone Failed',
+                'The following workspaces could not be cloned:\n' + '\n'.join(failures))
+
+        return [result for result, _ in outcomes]
+
     def addFileToIndexer(self, local_workspace_dir, workspace_file):
         '''
         Add the given workspace file in the remote workspace to the 
         indexer for ontological searching.
         '''
+        return self.setIndexerPaths(local_workspace_dir, [workspace_file])
+
+    def setIndexerPaths(self, local_workspace_dir, paths):
+        '''
+        Set the files in the remote workspace that are indexed for
+        ontological searching.
+        '''
         if not self.hasAccess():
             return
 
@@ -330,11 +472,12 @@ class PMRTool(object):
         target = '/'.join([remote_workspace_url, 'rdf_indexer'])
 #         {u'fields': {u'paths': {u'items': None, u'error': None, u'description': u'Paths that will be indexed as RDF.', u'value': u'', u'klass': u'textarea-widget list-field'}}, u'actions': {u'apply': {u'title': u'Apply'}, u'export_rdf': {u'title': u'Apply Changes and Export To RDF Store'}}}
         session = self.make_session()
-        r = session.post(target,
+        # Exporting the same paths again gives the same index.
+        r = requestExecutor().execute(session, 'POST', target, 'rdf-indexer',
             data=make_form_request('export_rdf',
-                paths=[workspace_file],
+                paths=paths,
             ),
-            allow_redirects=False)
+            idempotent=True, follow_redirects=False)
 
         r.raise_for_status()
         return r.json()
@@ -373,6 +516,19 @@ class PMRTool(object):
 
         logger.info('Using `%s` for committing files.', cmd.__class__.__name__)
 
+        if cmd.name == 'mercurial' and hgExecutable() is not None:
+            # Avoids starting hg for every file added.
+            pool = hgServerPool()
+            if files:
+                pool.runCommand(local_workspace_dir, 'add', *files)
+            code, sout, serr = pool.runCommand(local_workspace_dir, 'commit', '-m', message)
+            # hg commit returns 1 when there was nothing to commit.
+            if code != 0 and not (code == 1 and b'nothing changed' in sout + serr):
+                raise PMRToolError('Error committing changes',
+                    'The command line tool gave us this error message:\n\n' +
+                        serr.decode('utf-8', 'replace'))
+            return sout, serr
+
         for fn in files:
             sout, serr = cmd.add(workspace, fn)
             # if serr has something we need to handle?
@@ -387,10 +543,11 @@ class PMRTool(object):
         if remote_workspace_url is None:
             remote_workspace_url = cmd.read_remote(workspace)
         # acquire temporary creds
-        creds = self.requestTemporaryPassword(remote_workspace_url)
+        def push(creds):
+            return cmd.push(workspace,
+                username=creds['user'], password=creds['key'])
 
-        stdout, stderr = cmd.push(workspace,
-            username=creds['user'], password=creds['key'])
+        stdout, stderr = self._withTemporaryPassword(remote_workspace_url, push)
 
         if stderr:
             raise PMRToolError('Error pushing changes to PMR',
@@ -18,15 +18,41 @@ This file is part of MAP Client. (http://launchpad.net/mapclient)
     along with MAP Client.  If not, see <http://www.gnu.org/licenses/>..
 '''
 from PySide import QtGui, QtCore
+from requests import Session
+from requests.exceptions import Timeout
 
 from mapclient.tools.pmr.ui_pmrworkflowwidget import Ui_PMRWorkflowWidget
-from mapclient.widgets.utils import handle_runtime_error, set_wait_cursor
 from mapclient.tools.pmr.pmrtool import PMRTool, search_domains, \
-    workflow_search_string, ontological_search_string
+    ontological_search_string, plain_text_search_string, \
+    DEFAULT_SEARCH_TIMEOUT, SEARCH_PAGE_SIZE, PMRToolError
+from mapclient.tools.pmr.requestrunner import PMRRequestRunner
+from mapclient.tools.pmr.searchresultsmodel import SearchResultsModel
+from mapclient.tools.pmr.termindex import TermIndex, termDescription
+from mapclient.tools.annotation.annotationtool import AnnotationTool
 from mapclient.tools.pmr.authoriseapplicationdialog import AuthoriseApplicationDialog
 from pmr2.client.client import Client
 from mapclient.settings import info
 import re
+from functools import partial
+
+# Seconds to wait for the server to respond to an ontology term look up.
+DEFAULT_TERMS_TIMEOUT = 10
+
+
+class _TimeoutSession(Session):
+    '''
+    A requests session that applies a default timeout to every request,
+    the pmr2 client does not take one itself.
+    '''
+
+    def __init__(self, timeout):
+        super(_TimeoutSession, self).__init__()
+        self._timeout = timeout
+
+    def request(self, *args, **kwargs):
+        kwargs.setdefault('timeout', self._timeout)
+        return super(_TimeoutSession, self).request(*args, **kwargs)
+
 
 class PMRWorkflowWidget(QtGui.QWidget):
     '''
@@ -48,11 +74,15 @@ class PMRWorkflowWidget(QtGui.QWidget):
         self._timer = QtCore.QTimer()
         self._timer.setInterval(500)
 
-        self._busy_waiting = False
         self._ontological_search = False
 
-        word_list = ['pending ...']
-        self._list_model = OWLTermsListModel(word_list)
+        self._search_runner = PMRRequestRunner(self)
+        self._terms_runner = PMRRequestRunner(self)
+
+        annotation_tool = AnnotationTool()
+        self._term_index = TermIndex((term, annotation_tool.rdfFormOfTerm(term)) for term in annotation_tool.getTerms())
+        self._list_model = OWLTermsListModel([])
+        self._results_model = SearchResultsModel(self)
 
 #         self._client = Client(site=pmr_target, use_default_headers=True)
 
@@ -74,10 +104,16 @@ class PMRWorkflowWidget(QtGui.QWidget):
         self._ui.pushButtonImport.clicked.connect(self._importClicked)
         self._ui.pushButtonExport.clicked.connect(self._exportClicked)
         self._ui.labelLink.linkActivated.connect(self._linkActivated)
-        self._ui.listWidgetResults.itemClicked.connect(self._searchResultClicked)
+        self._ui.listViewResults.setModel(self._results_model)
+        self._ui.listViewResults.clicked.connect(self._searchResultClicked)
+        self._results_model.pageFailed.connect(self._requestFailed)
         self._ui.lineEditSearch.textEdited.connect(self._searchTextEdited)
         self._timer.timeout.connect(self._queryRepository)
         self._ui.comboBoxSearch.currentIndexChanged.connect(self._searchTypeChanged)
+        self._search_runner.finished.connect(self._searchFinished)
+        self._search_runner.failed.connect(self._requestFailed)
+        self._terms_runner.finished.connect(self._termsFound)
+        self._terms_runner.failed.connect(self._requestFailed)
 
     def _initialiseCompleter(self):
         completer = QtGui.QCompleter(self._ui.lineEditSearch)
@@ -100,29 +136,38 @@ class PMRWorkflowWidget(QtGui.QWidget):
             self._ui.lineEditSearch.setCompleter(None)
 
     def _searchTextEdited(self, new_text):
-        if self._ontological_search and len(new_text) and not self._busy_waiting:
-            if self._timer.isActive():
-                QtGui.QApplication.restoreOverrideCursor()
-            QtGui.QApplication.setOverrideCursor(QtCore.Qt.WaitCursor)
+        if self._ontological_search and len(new_text):
+            self._updateCompletions(new_text)
+            # Restarting the timer debounces the look up while typing.
             self._timer.start()
 
-    def _queryRepository(self):
-        self._timer.stop()
-        self._busy_waiting = True
-        search_text = self._ui.lineEditSearch.text()
+    def _lookUpTerms(self, search_text):
         pmr_target = info.PMRInfo().ipaddress
         target = pmr_target + '/pmr2_ricordo/owlterms' + '/%s/%d' % (search_text, self._termLookUpLimit)
-        client = Client(site=pmr_target, use_default_headers=True)
-        state = client(target=target)  # , data=json.dumps({'actions': {'search': 1}, 'fields': {'simple_query': 'femur'}}))  # , endpoint='ricordo', data='femur')
-        response = state.value()
-        descriptions = ['%s [%s]' % (line[0], line[1].split('#')[-1]) for line in response['results']]
-        self._list_model.removeRows(0, self._list_model.rowCount())
-        self._list_model.insertRows(0, len(descriptions), descriptions)
-        self._busy_waiting = False
-        QtGui.QApplication.restoreOverrideCursor()
-
-    def _searchResultClicked(self, item):
-        r = item.data(QtCore.Qt.UserRole)
+        client = Client(site=pmr_target, session=_TimeoutSession(DEFAULT_TERMS_TIMEOUT), use_default_headers=True)
+        try:
+            state = client(target=target)  # , data=json.dumps({'actions': {'search': 1}, 'fields': {'simple_query': 'femur'}}))  # , endpoint='ricordo', data='femur')
+        except Timeout:
+            raise PMRToolError('Term Look Up Timed Out',
+                'The PMR server did not respond to the ontology term look up in time.  '
+                'Please try again later.'
+            )
+        return state.value()
+
+    def _queryRepository(self):
+        self._timer.stop()
+        self._terms_runner.start(self._lookUpTerms, self._ui.lineEditSearch.text())
+
+    def _termsFound(self, response):
+        if self._term_index.addTerms((line[0], line[1]) for line in response['results']):
+            self._updateCompletions(self._ui.lineEditSearch.text())
+
+    def _updateCompletions(self, text):
+        matches = self._term_index.match(text, self._termLookUpLimit)
+        self._list_model.setTerms([termDescription(label, uri) for label, uri in matches])
+
+    def _searchResultClicked(self, index):
+        r = index.data(QtCore.Qt.UserRole)
         if 'source' in r:
             self._ui.lineEditWorkspace.setText(r['source'])
         elif 'href' in r:
@@ -182,11 +227,9 @@ class PMRWorkflowWidget(QtGui.QWidget):
     def setWorkspaceUrl(self, url):
         self._ui.lineEditWorkspace.setText(url)
 
-    @handle_runtime_error
-    @set_wait_cursor
     def _doSearch(self, search_type):
         # Set pmrlib to go
-        self._ui.listWidgetResults.clear()
+        self._results_model.clear()
 
         # fix up known terms to be full blown uri
         search_text = self._ui.lineEditSearch.text()
@@ -201,32 +244,29 @@ class PMRWorkflowWidget(QtGui.QWidget):
 #             rdfterm = self._annotationTool.rdfFormOfTerm(term)
 #             if rdfterm:
 #                 search_text = search_text + ' ' + rdfterm[1:-1]
-        results = self._pmrTool.search(search_text, search_type)
-
-        if search_type == workflow_search_string:
-            results_list = results['results']
-            for r in results_list:
-                item = QtGui.QListWidgetItem(r['obj']['title'], self._ui.listWidgetResults)
-                item.setData(QtCore.Qt.UserRole, r)
-        elif search_type == ontological_search_string:
-            if type(results) is dict:
-                return
-
-            for r in results:
-                label = r['label']
-                for sr in r['items']:
-                    item = QtGui.QListWidgetItem(sr['title'] + ' [%s, %s]' % (sr['value'], label), self._ui.listWidgetResults)
-                    tool_tip = 'Workspace title: %s, Ontological term: %s, Target: %s' % (sr['title'], label, sr['href'])
-                    item.setToolTip(tool_tip)
-                    item.setData(QtCore.Qt.UserRole, sr)
-
+        self._search_type = search_type
+        self._search_text = search_text
+        # The search runs in the background, a newer search supersedes this one.
+        self._search_runner.start(self._fetchSearchPage, search_text, search_type, 0)
+
+    def _fetchSearchPage(self, search_text, search_type, start):
+        batch_size = SEARCH_PAGE_SIZE if search_type == plain_text_search_string else None
+        return self._pmrTool.search(search_text, search_type, DEFAULT_SEARCH_TIMEOUT,
+                                    batch_start=start, batch_size=batch_size)
+
+    def _requestFailed(self, error):
+        QtGui.QMessageBox.critical(self, error.title, error.description)
+
+    def _searchFinished(self, results):
+        search_type = self._search_type
+        if search_type == ontological_search_string and type(results) is not dict:
+            self._term_index.addTerms((r['label'], '') for r in results)
+
+        if search_type == plain_text_search_string:
+            fetch_page = partial(self._fetchSearchPage, self._search_text, search_type)
+            self._results_model.setResults(search_type, results, fetch_page, SEARCH_PAGE_SIZE)
         else:
-            for r in results:
-                if 'title' in r and r['title']:
-                    item = QtGui.QListWidgetItem(r['title'], self._ui.listWidgetResults)
-                else:
-                    item = QtGui.QListWidgetItem(r['target'], self._ui.listWidgetResults)
-                item.setData(QtCore.Qt.UserRole, r)
+            self._results_model.setResults(search_type, results)
 
 class OWLTermsListModel(QtCore.QAbstractListModel):
 
@@ -259,6 +299,11 @@ class OWLTermsListModel(QtCore.QAbstractListModel):
         self.endInsertRows()
         return True
 
+    def setTerms(self, terms):
+        self.beginResetModel()
+        self._list_in = terms
+        self.endResetModel()
+
     def removeRows(self, position, rows, parent=QtCore.QModelIndex()):
         self.beginRemoveRows(parent, position, position + rows - 1)
 
@@ -0,0 +1,208 @@
+'''
+MAP Client, a program to generate detailed musculoskeletal models for OpenSim.
+    Copyright (C) 2012  University of Auckland
+
+This file is part of MAP Client. (http://launchpad.net/mapclient)
+
+    MAP Client is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    MAP Client is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with MAP Client.  If not, see <http://www.gnu.org/licenses/>..
+'''
+import os
+import logging
+import threading
+
+from PySide import QtCore
+
+from mapclient.tools.pmr.pmrhghelper import repositoriesAreUpToDate
+
+logger = logging.getLogger(__name__)
+
+# Milliseconds to wait for further changes before running a status pass.
+DEFAULT_SETTLE_INTERVAL = 250
+# Milliseconds between re-checks of repositories that cannot be watched.
+DEFAULT_POLL_INTERVAL = 5000
+# Locations with more directories than this are polled rather than watched.
+MAX_WATCHED_DIRECTORIES = 256
+
+
+class RepositoryStatusService(QtCore.QObject):
+    '''
+    Caches whether the repositories at the watched locations have
+    uncommitted changes.  The status of every location that needs it is
+    worked out together in one background pass, and a location is checked
+    again when the file system watcher reports a change in it, or on a
+    timer when it cannot be watched.  statusChanged is emitted with the
+    location and whether it is up to date when the cached status changes.
+    The directories to watch in a location are found in the background
+    pass too, only the location itself is watched straight away.  A
+    location with too many directories to watch is polled instead.
+    '''
+
+    statusChanged = QtCore.Signal(str, bool)
+
+    _passFinished = QtCore.Signal(object)
+
+    def __init__(self, parent=None, settle_interval=DEFAULT_SETTLE_INTERVAL,
+                 poll_interval=DEFAULT_POLL_INTERVAL):
+        super(RepositoryStatusService, self).__init__(parent)
+        self._status = {}
+        self._watched = set()
+        self._polled = set()
+        self._stale = set()
+        self._running = False
+
+        self._watcher = QtCore.QFileSystemWatcher(self)
+        self._watcher.directoryChanged.connect(self._pathChanged)
+        self._watcher.fileChanged.connect(self._fileChanged)
+
+        self._settle_timer = QtCore.QTimer(self)
+        self._settle_timer.setSingleShot(True)
+        self._settle_timer.setInterval(settle_interval)
+        self._settle_timer.timeout.connect(self._startPass)
+
+        self._poll_timer = QtCore.QTimer(self)
+        self._poll_timer.setInterval(poll_interval)
+        self._poll_timer.timeout.connect(self._poll)
+
+        self._passFinished.connect(self._updateStatus, QtCore.Qt.QueuedConnection)
+
+    def _watchPaths(self, location):
+        '''
+        Return the paths to watch for changes in location, all of its
+        sub-directories and the dirstate, or None when there are more
+        directories than can be watched.  Runs in the background pass.
+        '''
+        paths = []
+        for directory, names, _ in os.walk(location):
+            if directory == location and '.hg' in names:
+                names.remove('.hg')
+            paths.extend(os.path.join(directory, name) for name in names)
+            if len(paths) > MAX_WATCHED_DIRECTORIES:
+                return None
+        # Commits and adds rewrite the dirstate.
+        dirstate = os.path.join(location, '.hg', 'dirstate')
+        if os.path.exists(dirstate):
+            paths.append(dirstate)
+
+        return paths
+
+    def watch(self, location):
+        if location in self._watched:
+            return
+
+        self._watched.add(location)
+        if os.path.isdir(location):
+            self._watcher.addPath(location)
+            if location not in self._watcher.directories():
+                self._startPolling(location)
+        self.invalidate(location)
+
+    def _startPolling(self, location):
+        self._polled.add(location)
+        if not self._poll_timer.isActive():
+            self._poll_timer.start()
+
+    def unwatch(self, location):
+        if location not in self._watched:
+            return
+
+        self._watched.discard(location)
+        self._polled.discard(location)
+        self._status.pop(location, None)
+        self._stale.discard(location)
+        watching = [path for path in self._watcher.directories() + self._watcher.files()
+                    if path == location or path.startswith(location + os.sep)]
+        if watching:
+            self._watcher.removePaths(watching)
+        if not self._polled:
+            self._poll_timer.stop()
+
+    def clear(self):
+        for location in list(self._watched):
+            self.unwatch(location)
+
+    def status(self, location):
+        '''
+        Return True if the repository at location is up to date, False if
+        it has uncommitted changes and None if it is not known yet.
+        '''
+        self.watch(location)
+        return self._status.get(location)
+
+    def invalidate(self, location):
+        self._stale.add(location)
+        self._settle_timer.start()
+
+    def _pathChanged(self, path):
+        for location in self._watched:
+            if path == location or path.startswith(location + os.sep):
+                self.invalidate(location)
+
+    def _fileChanged(self, path):
+        # Mercurial replaces the dirstate rather than writing to it, which
+        # drops the watch on it.
+        if path not in self._watcher.files() and os.path.exists(path):
+            self._watcher.addPath(path)
+        self._pathChanged(path)
+
+    def _poll(self):
+        for location in self._polled:
+            self.invalidate(location)
+
+    def _startPass(self):
+        if self._running or not self._stale:
+            return
+
+        locations = list(self._stale)
+        self._stale.clear()
+        self._running = True
+        thread = threading.Thread(target=self._runPass, args=(locations, set(self._polled)), name='RepositoryStatus')
+        thread.daemon = True
+        thread.start()
+
+    def _runPass(self, locations, polled):
+        results = {}
+        try:
+            up_to_date = repositoriesAreUpToDate(locations)
+        except Exception as e:
+            logger.info('Failed to get the repository status of {0}: {1}'.format(', '.join(locations), e))
+            up_to_date = {}
+        for location in up_to_date:
+            try:
+                paths = self._watchPaths(location) if os.path.isdir(location) and location not in polled else []
+            except OSError as e:
+                logger.info('Failed to find the directories to watch in {0}: {1}'.format(location, e))
+                paths = []
+            results[location] = (up_to_date[location], paths)
+        self._passFinished.emit(results)
+
+    def _updateStatus(self, results):
+        self._running = False
+        watching = set(self._watcher.directories() + self._watcher.files())
+        for location, (up_to_date, paths) in results.items():
+            if location not in self._watched:
+                continue
+            if paths is None:
+                if location not in self._polled:
+                    logger.info('Too many directories to watch in {0}, polling it instead'.format(location))
+                    self._startPolling(location)
+            elif location not in self._polled:
+                new_paths = [path for path in paths if path not in watching]
+                if new_paths:
+                    self._watcher.addPaths(new_paths)
+            if self._status.get(location) != up_to_date:
+                self._status[location] = up_to_date
+                self.statusChanged.emit(location, up_to_date)
+
+        if self._stale:
+            self._settle_timer.start()
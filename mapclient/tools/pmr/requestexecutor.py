@@ -0,0 +1,193 @@
+'''
+MAP Client, a program to generate detailed musculoskeletal models for OpenSim.
+    Copyright (C) 2012  University of Auckland
+
+This file is part of MAP Client. (http://launchpad.net/mapclient)
+
+    MAP Client is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    MAP Client is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with MAP Client.  If not, see <http://www.gnu.org/licenses/>..
+'''
+import time
+import random
+import logging
+import threading
+
+try:
+    from urllib.parse import urljoin
+except ImportError:
+    from urlparse import urljoin
+
+from requests.exceptions import ConnectionError, Timeout
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MAX_RETRIES = 3
+# Seconds, the backoff before retry n is drawn from [0, min(max, base * 2 ** n)].
+DEFAULT_BACKOFF_BASE = 0.5
+DEFAULT_BACKOFF_MAX = 8.0
+DEFAULT_MAX_REDIRECTS = 5
+
+IDEMPOTENT_METHODS = ('GET', 'HEAD', 'OPTIONS', 'PUT', 'DELETE')
+RETRY_STATUS_CODES = (500, 502, 503, 504)
+REDIRECT_STATUS_CODES = (301, 302, 303, 307, 308)
+
+
+class DeadlineExceeded(Timeout):
+    pass
+
+
+class _EndpointMetrics(object):
+
+    def __init__(self):
+        self.calls = 0
+        self.failures = 0
+        self.retries = 0
+        self.redirects = 0
+        self.total_latency = 0.0
+        self.max_latency = 0.0
+
+    def asDict(self):
+        return {
+            'calls': self.calls,
+            'failures': self.failures,
+            'retries': self.retries,
+            'redirects': self.redirects,
+            'mean_latency': self.total_latency / self.calls if self.calls else 0.0,
+            'max_latency': self.max_latency,
+        }
+
+
+class RequestExecutor(object):
+    '''
+    Makes the HTTP requests of the PMR client.  Redirects are followed by
+    hand so every hop is a new request that the OAuth session signs for
+    its own url.  Connection errors, timeouts and transient server errors
+    are retried with jittered exponential backoff, but only for requests
+    that are safe to repeat, and no retry is started past the deadline.
+    '''
+
+    def __init__(self, max_retries=DEFAULT_MAX_RETRIES, backoff_base=DEFAULT_BACKOFF_BASE,
+                 backoff_max=DEFAULT_BACKOFF_MAX, max_redirects=DEFAULT_MAX_REDIRECTS):
+        self._max_retries = max_retries
+        self._backoff_base = backoff_base
+        self._backoff_max = backoff_max
+        self._max_redirects = max_redirects
+        self._lock = threading.Lock()
+        self._metrics = {}
+
+    def _backoff(self, attempt, response=None):
+        if response is not None and response.headers.get('Retry-After', '').isdigit():
+            # A server asking for a long wait must not stall the caller past the maximum.
+            return min(self._backoff_max, float(response.headers['Retry-After']))
+
+        return random.uniform(0, min(self._backoff_max, self._backoff_base * 2 ** attempt))
+
+    def _sendWithRetries(self, session, method, url, endpoint, data, headers, timeout, deadline, idempotent):
+        attempt = 0
+        while True:
+            request_timeout = timeout
+            if deadline is not None:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    raise DeadlineExceeded('Deadline exceeded for ' + url)
+                request_timeout = remaining if timeout is None else min(timeout, remaining)
+
+            response = None
+            error = None
+            try:
+                response = session.request(method, url, data=data, headers=headers,
+                                           timeout=request_timeout, allow_redirects=False)
+            except (ConnectionError, Timeout) as e:
+                error = e
+
+            retry = idempotent and attempt < self._max_retries and \
+                (error is not None or response.status_code in RETRY_STATUS_CODES)
+            if not retry:
+                if error is not None:
+                    raise error
+                return response
+
+            delay = self._backoff(attempt, response)
+            if deadline is not None and time.time() + delay >= deadline:
+                if error is not None:
+                    raise error
+                return response
+
+            logger.info('Retrying {0} {1} in {2:.2f}s: {3}'.format(
+                method, url, delay, error if error is not None else response.status_code))
+            with self._lock:
+                self._metrics[endpoint].retries += 1
+            time.sleep(delay)
+            attempt += 1
+
+    def execute(self, session, method, url, endpoint, data=None, headers=None, timeout=None,
+                deadline=None, idempotent=None, follow_redirects=True):
+        '''
+        Send the request and return the response.  endpoint names the
+        request in the metrics, timeout bounds each attempt and deadline,
+        an absolute time, bounds the whole call including retries and
+        redirects.  idempotent defaults to whether the method is safe to
+        repeat.
+        '''
+        if idempotent is None:
+            idempotent = method in IDEMPOTENT_METHODS
+
+        with self._lock:
+            metrics = self._metrics.setdefault(endpoint, _EndpointMetrics())
+            metrics.calls += 1
+
+        start = time.time()
+        try:
+            response = self._sendWithRetries(session, method, url, endpoint, data, headers,
+                                             timeout, deadline, idempotent)
+            redirects = 0
+            while follow_redirects and response.status_code in REDIRECT_STATUS_CODES \
+                    and response.headers.get('Location'):
+                redirects += 1
+                if redirects > self._max_redirects:
+                    break
+                url = urljoin(url, response.headers['Location'])
+                if response.status_code not in (307, 308):
+                    # As browsers do, only 307 and 308 keep the method and body.
+                    method = 'GET'
+                    data = None
+                    idempotent = True
+                response = self._sendWithRetries(session, method, url, endpoint, data, headers,
+                                                 timeout, deadline, idempotent)
+            with self._lock:
+                metrics.redirects += redirects
+        except Exception:
+            with self._lock:
+                metrics.failures += 1
+            raise
+        finally:
+            latency = time.time() - start
+            with self._lock:
+                metrics.total_latency += latency
+                metrics.max_latency = max(metrics.max_latency, latency)
+
+        return response
+
+    def statistics(self):
+        '''
+        Return the call, failure, retry, redirect and latency metrics per endpoint.
+        '''
+        with self._lock:
+            return dict((endpoint, metrics.asDict()) for endpoint, metrics in self._metrics.items())
+
+
+_request_executor = RequestExecutor()
+
+
+def requestExecutor():
+    return _request_executor
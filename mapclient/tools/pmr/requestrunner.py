@@ -0,0 +1,84 @@
+'''
+MAP Client, a program to generate detailed musculoskeletal models for OpenSim.
+    Copyright (C) 2012  University of Auckland
+
+This file is part of MAP Client. (http://launchpad.net/mapclient)
+
+    MAP Client is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    MAP Client is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with MAP Client.  If not, see <http://www.gnu.org/licenses/>..
+'''
+import logging
+import threading
+
+from PySide import QtCore
+
+from mapclient.exceptions import ClientRuntimeError
+
+logger = logging.getLogger(__name__)
+
+
+class PMRRequestRunner(QtCore.QObject):
+    '''
+    Runs a (PMR) request on a worker thread and delivers the outcome back
+    on the GUI thread through the finished and failed signals.  Starting a
+    new request supersedes the one in flight: the result of a superseded,
+    or cancelled, request is dropped when it arrives.
+    '''
+
+    finished = QtCore.Signal(object)
+    failed = QtCore.Signal(object)
+
+    _completed = QtCore.Signal(int, object, object)
+
+    def __init__(self, parent=None):
+        super(PMRRequestRunner, self).__init__(parent)
+        self._last_id = 0
+        self._pending_id = None
+        # Queued so the outcome is always handled on the thread this object lives in.
+        self._completed.connect(self._requestCompleted, QtCore.Qt.QueuedConnection)
+
+    def start(self, f, *args, **kwargs):
+        self._last_id += 1
+        self._pending_id = self._last_id
+        thread = threading.Thread(target=self._run, args=(self._pending_id, f, args, kwargs),
+                                  name='PMRRequestRunner')
+        thread.daemon = True
+        thread.start()
+
+    def cancel(self):
+        self._pending_id = None
+
+    def isBusy(self):
+        return self._pending_id is not None
+
+    def _run(self, request_id, f, args, kwargs):
+        try:
+            result = f(*args, **kwargs)
+        except ClientRuntimeError as e:
+            self._completed.emit(request_id, None, e)
+        except Exception as e:
+            logger.exception('Background request failed')
+            self._completed.emit(request_id, None, ClientRuntimeError('Unexpected exception', str(e)))
+        else:
+            self._completed.emit(request_id, result, None)
+
+    def _requestCompleted(self, request_id, result, error):
+        if request_id != self._pending_id:
+            # Superseded or cancelled.
+            return
+
+        self._pending_id = None
+        if error is not None:
+            self.failed.emit(error)
+        else:
+            self.finished.emit(result)
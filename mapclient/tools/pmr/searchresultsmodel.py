@@ -0,0 +1,170 @@
+'''
+MAP Client, a program to generate detailed musculoskeletal models for OpenSim.
+    Copyright (C) 2012  University of Auckland
+
+This file is part of MAP Client. (http://launchpad.net/mapclient)
+
+    MAP Client is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    MAP Client is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with MAP Client.  If not, see <http://www.gnu.org/licenses/>..
+'''
+from itertools import islice
+
+from PySide import QtCore
+
+from mapclient.tools.pmr.pmrtool import workflow_search_string, ontological_search_string
+from mapclient.tools.pmr.requestrunner import PMRRequestRunner
+
+# Rows added to the model each time the view asks for more.
+DEFAULT_BATCH_SIZE = 100
+
+
+def resultList(search_type, results):
+    '''
+    Return the list of raw results in a search response.
+    '''
+    if search_type == workflow_search_string:
+        return results['results']
+    elif search_type == ontological_search_string and type(results) is dict:
+        return []
+
+    return results
+
+
+def resultRows(search_type, results):
+    '''
+    Generate the (display, tool tip, data) rows for the raw search results.
+    '''
+    for r in results:
+        if search_type == workflow_search_string:
+            yield r['obj']['title'], None, r
+        elif search_type == ontological_search_string:
+            label = r['label']
+            for sr in r['items']:
+                tool_tip = 'Workspace title: %s, Ontological term: %s, Target: %s' % (sr['title'], label, sr['href'])
+                yield sr['title'] + ' [%s, %s]' % (sr['value'], label), tool_tip, sr
+        elif 'title' in r and r['title']:
+            yield r['title'], None, r
+        else:
+            yield r['target'], None, r
+
+
+class SearchResultsModel(QtCore.QAbstractListModel):
+    '''
+    List model over a PMR search response.  Rows are only built from the
+    raw results as the view scrolls them into view.  When a fetch_page
+    function is given the next page of results is requested from the
+    server, in the background, once the rows of the current page run out.
+    '''
+
+    pageFailed = QtCore.Signal(object)
+
+    def __init__(self, parent=None, batch_size=DEFAULT_BATCH_SIZE):
+        super(SearchResultsModel, self).__init__(parent)
+        self._batch_size = batch_size
+        self._search_type = None
+        self._rows = []
+        self._pending = None
+        self._fetch_page = None
+        self._page_size = 0
+        self._next_start = 0
+        self._first_result = None
+        self._runner = PMRRequestRunner(self)
+        self._runner.finished.connect(self._pageFetched)
+        self._runner.failed.connect(self._pageFailed)
+
+    def clear(self):
+        self.setResults(None, [])
+
+    def setResults(self, search_type, results, fetch_page=None, page_size=0):
+        '''
+        Show the given search response.  fetch_page(start) must return the
+        response for the page of page_size results beginning at start.
+        '''
+        self._runner.cancel()
+        self.beginResetModel()
+        self._search_type = search_type
+        self._rows = []
+        self._first_result = None
+        self._setPage(resultList(search_type, results), fetch_page, page_size)
+        self._next_start = page_size
+        self.endResetModel()
+
+    def _setPage(self, raw_results, fetch_page, page_size):
+        self._page_size = page_size
+        first_result = raw_results[0] if len(raw_results) else None
+        if first_result is not None and first_result == self._first_result:
+            # The server ignored the batch start and sent the same page
+            # again, everything it has is already shown.
+            self._fetch_page = None
+            return
+
+        self._first_result = first_result
+        self._pending = resultRows(self._search_type, raw_results)
+        # A short page is the last page, a long one means the server
+        # ignored the batch size and returned everything.
+        if fetch_page is not None and page_size and len(raw_results) == page_size:
+            self._fetch_page = fetch_page
+        else:
+            self._fetch_page = None
+
+    def rowCount(self, parent=QtCore.QModelIndex()):
+        if parent.isValid():
+            return 0
+
+        return len(self._rows)
+
+    def data(self, index, role=QtCore.Qt.DisplayRole):
+        if not index.isValid() or index.row() >= len(self._rows):
+            return None
+
+        display, tool_tip, data = self._rows[index.row()]
+        if role == QtCore.Qt.DisplayRole:
+            return display
+        elif role == QtCore.Qt.ToolTipRole:
+            return tool_tip
+        elif role == QtCore.Qt.UserRole:
+            return data
+
+        return None
+
+    def canFetchMore(self, parent=QtCore.QModelIndex()):
+        if parent.isValid():
+            return False
+
+        return self._pending is not None or (self._fetch_page is not None and not self._runner.isBusy())
+
+    def fetchMore(self, parent=QtCore.QModelIndex()):
+        if parent.isValid():
+            return
+
+        if self._pending is not None:
+            rows = list(islice(self._pending, self._batch_size))
+            if len(rows) < self._batch_size:
+                self._pending = None
+            if rows:
+                self.beginInsertRows(QtCore.QModelIndex(), len(self._rows), len(self._rows) + len(rows) - 1)
+                self._rows.extend(rows)
+                self.endInsertRows()
+
+        if self._pending is None and self._fetch_page is not None and not self._runner.isBusy():
+            self._runner.start(self._fetch_page, self._next_start)
+
+    def _pageFetched(self, results):
+        self._setPage(resultList(self._search_type, results), self._fetch_page, self._page_size)
+        self._next_start += self._page_size
+        self.fetchMore()
+
+    def _pageFailed(self, error):
+        # Stop paging rather than retry on every scroll.
+        self._fetch_page = None
+        self.pageFailed.emit(error)
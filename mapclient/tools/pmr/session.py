@@ -0,0 +1,141 @@
+'''
+MAP Client, a program to generate detailed musculoskeletal models for OpenSim.
+    Copyright (C) 2012  University of Auckland
+
+This file is part of MAP Client. (http://launchpad.net/mapclient)
+
+    MAP Client is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    MAP Client is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with MAP Client.  If not, see <http://www.gnu.org/licenses/>..
+'''
+import logging
+import threading
+
+from requests import Session
+from requests.adapters import HTTPAdapter
+from requests_oauthlib import OAuth1Session
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_POOL_CONNECTIONS = 4
+DEFAULT_POOL_MAXSIZE = 8
+
+
+def _connectionPools(session):
+    for adapter in session.adapters.values():
+        pools = adapter.poolmanager.pools
+        for key in pools.keys():
+            pool = pools.get(key)
+            if pool is not None:
+                yield pool
+
+
+class SessionManager(object):
+    '''
+    Hands out one pooled, keep-alive session per PMR host and set of
+    credentials for the whole process.  A session is replaced when the
+    tokens for its host change, so connections are only opened again
+    after registering or deregistering.
+    '''
+
+    def __init__(self, pool_connections=DEFAULT_POOL_CONNECTIONS, pool_maxsize=DEFAULT_POOL_MAXSIZE):
+        self._pool_connections = pool_connections
+        self._pool_maxsize = pool_maxsize
+        self._lock = threading.Lock()
+        self._sessions = {}
+        self._requests = 0
+        self._sessions_created = 0
+        self._retired_connections = 0
+
+    def _key(self, pmr_info):
+        if pmr_info.has_access():
+            credentials = tuple(sorted(pmr_info.get_session_kwargs().items()))
+        else:
+            credentials = None
+
+        return pmr_info.host, credentials
+
+    def _countRequest(self, response, *args, **kwargs):
+        with self._lock:
+            self._requests += 1
+
+    def _createSession(self, pmr_info, headers):
+        if pmr_info.has_access():
+            session = OAuth1Session(**pmr_info.get_session_kwargs())
+        else:
+            # normal session without OAuth requirements.
+            session = Session()
+
+        for prefix in ('http://', 'https://'):
+            session.mount(prefix, HTTPAdapter(pool_connections=self._pool_connections,
+                                              pool_maxsize=self._pool_maxsize))
+        session.headers.update(headers)
+        session.hooks['response'].append(self._countRequest)
+        return session
+
+    def session(self, pmr_info, headers):
+        '''
+        Return the session for the host and credentials in pmr_info.
+        '''
+        key = self._key(pmr_info)
+        with self._lock:
+            session = self._sessions.get(key)
+            if session is None:
+                # Credentials for this host have changed, retire the old session.
+                for old_key in [k for k in self._sessions if k[0] == key[0]]:
+                    self._retire(self._sessions.pop(old_key))
+                session = self._createSession(pmr_info, headers)
+                self._sessions[key] = session
+                self._sessions_created += 1
+                logger.debug('Created a new PMR session for {0}'.format(key[0]))
+
+        return session
+
+    def _retire(self, session):
+        self._retired_connections += sum(pool.num_connections for pool in _connectionPools(session))
+        session.close()
+
+    def clear(self):
+        with self._lock:
+            for session in self._sessions.values():
+                self._retire(session)
+            self._sessions = {}
+
+    def statistics(self):
+        '''
+        Return the request counters, the connection reuse rate is the
+        fraction of requests that did not need a new connection.
+        '''
+        with self._lock:
+            connections = self._retired_connections
+            for session in self._sessions.values():
+                connections += sum(pool.num_connections for pool in _connectionPools(session))
+            requests = self._requests
+            sessions_created = self._sessions_created
+
+        reuse_rate = 0.0
+        if requests:
+            reuse_rate = max(0.0, 1.0 - float(connections) / requests)
+
+        return {
+            'requests': requests,
+            'connections': connections,
+            'sessions_created': sessions_created,
+            'connection_reuse_rate': reuse_rate,
+        }
+
+
+_session_manager = SessionManager()
+
+
+def sessionManager():
+    return _session_manager
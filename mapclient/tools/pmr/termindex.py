@@ -0,0 +1,155 @@
+'''
+MAP Client, a program to generate detailed musculoskeletal models for OpenSim.
+    Copyright (C) 2012  University of Auckland
+
+This file is part of MAP Client. (http://launchpad.net/mapclient)
+
+    MAP Client is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    MAP Client is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with MAP Client.  If not, see <http://www.gnu.org/licenses/>..
+'''
+import bisect
+
+DEFAULT_MATCH_LIMIT = 50
+
+_GRAM_SIZE = 3
+
+
+def termFragment(uri):
+    '''
+    Return the identifying part of an ontology term uri.
+    '''
+    return uri.strip('<>').split('#')[-1].split('/')[-1]
+
+
+def termDescription(label, uri):
+    if uri:
+        return '%s [%s]' % (label, termFragment(uri))
+
+    return label
+
+
+def _grams(key):
+    return set(key[i:i + _GRAM_SIZE] for i in range(len(key) - _GRAM_SIZE + 1))
+
+
+class TermIndex(object):
+    '''
+    An index of ontology terms, labels and uris, for completing search text.
+    Prefix matches come from a sorted array of lower cased keys searched with
+    bisect, substring matches from a trigram index.  Terms can be merged in
+    at any time, terms already in the index are ignored.
+    '''
+
+    def __init__(self, terms=None):
+        self._terms = []
+        self._known = set()
+        self._keys = []
+        self._grams = {}
+        if terms is not None:
+            self.addTerms(terms)
+
+    def __len__(self):
+        return len(self._terms)
+
+    def addTerms(self, terms):
+        '''
+        Merge the given (label, uri) pairs into the index, uri may be empty.
+        Returns the number of terms that were new.
+        '''
+        new_keys = []
+        added = 0
+        for label, uri in terms:
+            label = label.strip()
+            uri = uri.strip() if uri else ''
+            if not label or (label, uri) in self._known:
+                continue
+
+            term_id = len(self._terms)
+            added += 1
+            self._terms.append((label, uri))
+            self._known.add((label, uri))
+            keys = set([label.lower()])
+            if uri:
+                keys.add(termFragment(uri).lower())
+            for key in keys:
+                new_keys.append((key, term_id))
+                for gram in _grams(key):
+                    self._grams.setdefault(gram, set()).add(term_id)
+
+        if new_keys:
+            # Sorting the concatenation of two sorted runs is linear.
+            new_keys.sort()
+            self._keys = sorted(self._keys + new_keys)
+
+        return added
+
+    def addTerm(self, label, uri=''):
+        return self.addTerms([(label, uri)])
+
+    def _prefixMatches(self, key, limit, found):
+        matches = []
+        index = bisect.bisect_left(self._keys, (key,))
+        while index < len(self._keys) and len(found) < limit:
+            candidate, term_id = self._keys[index]
+            if not candidate.startswith(key):
+                break
+            if term_id not in found:
+                found.add(term_id)
+                matches.append(term_id)
+            index += 1
+
+        return matches
+
+    def _substringMatches(self, key, limit, found):
+        matches = []
+        grams = _grams(key)
+        if grams:
+            candidates = None
+            for gram in sorted(grams, key=lambda g: len(self._grams.get(g, ()))):
+                ids = self._grams.get(gram)
+                if not ids:
+                    return matches
+                candidates = set(ids) if candidates is None else candidates & ids
+                if not candidates:
+                    return matches
+        else:
+            # Too short for the trigram index, fall back to scanning the terms.
+            candidates = range(len(self._terms))
+
+        for term_id in sorted(candidates):
+            if len(found) >= limit:
+                break
+            if term_id in found:
+                continue
+            label, uri = self._terms[term_id]
+            if key in label.lower() or (uri and key in termFragment(uri).lower()):
+                found.add(term_id)
+                matches.append(term_id)
+
+        return matches
+
+    def match(self, text, limit=DEFAULT_MATCH_LIMIT):
+        '''
+        Return up to limit (label, uri) pairs matching text, terms starting
+        with text come before terms that only contain it.
+        '''
+        key = text.strip().lower()
+        if not key:
+            return []
+
+        found = set()
+        matches = self._prefixMatches(key, limit, found)
+        if len(matches) < limit:
+            matches.extend(self._substringMatches(key, limit, found))
+
+        return [self._terms[term_id] for term_id in matches]
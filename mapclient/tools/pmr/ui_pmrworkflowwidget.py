@@ -54,9 +54,9 @@ class Ui_PMRWorkflowWidget(object):
         self.pushButtonSearch.setObjectName("pushButtonSearch")
         self.horizontalLayout_2.addWidget(self.pushButtonSearch)
         self.verticalLayout.addLayout(self.horizontalLayout_2)
-        self.listWidgetResults = QtGui.QListWidget(self.groupBox)
-        self.listWidgetResults.setObjectName("listWidgetResults")
-        self.verticalLayout.addWidget(self.listWidgetResults)
+        self.listViewResults = QtGui.QListView(self.groupBox)
+        self.listViewResults.setObjectName("listViewResults")
+        self.verticalLayout.addWidget(self.listViewResults)
         self.gridLayout.addWidget(self.groupBox, 1, 0, 1, 2)
         self.verticalLayout_2.addLayout(self.gridLayout)
         self.horizontalLayout_3 = QtGui.QHBoxLayout()
@@ -0,0 +1,74 @@
+'''
+MAP Client, a program to generate detailed musculoskeletal models for OpenSim.
+    Copyright (C) 2012  University of Auckland
+
+This file is part of MAP Client. (http://launchpad.net/mapclient)
+
+    MAP Client is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    MAP Client is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with MAP Client.  If not, see <http://www.gnu.org/licenses/>..
+'''
+import logging
+import threading
+
+try:
+    from queue import Queue, Empty
+except ImportError:
+    from Queue import Queue, Empty
+
+logger = logging.getLogger(__name__)
+
+
+def runConcurrently(function, items, max_workers, progress=None, name='PMRWorker'):
+    '''
+    Call function(item) for each item with up to max_workers calls running
+    at a time and return a list of (result, exception) pairs in item order.
+    progress(completed, total, item) is called on the calling thread as
+    each call finishes.
+    '''
+    items = list(items)
+    total = len(items)
+    pending = Queue()
+    for index, item in enumerate(items):
+        pending.put((index, item))
+    done = Queue()
+
+    def worker():
+        while True:
+            try:
+                index, item = pending.get_nowait()
+            except Empty:
+                return
+
+            try:
+                done.put((index, function(item), None))
+            except Exception as e:
+                logger.warning('{0} failed for {1}: {2}'.format(name, item, e))
+                done.put((index, None, e))
+
+    threads = [threading.Thread(target=worker, name=name)
+               for _ in range(min(max_workers, total))]
+    for thread in threads:
+        thread.daemon = True
+        thread.start()
+
+    outcomes = [None] * total
+    for completed in range(1, total + 1):
+        index, result, error = done.get()
+        outcomes[index] = (result, error)
+        if progress is not None:
+            progress(completed, total, items[index])
+
+    for thread in threads:
+        thread.join()
+
+    return outcomes
@@ -53,25 +53,60 @@ class CommandRemove(QtGui.QUndoCommand):
 class CommandSelection(QtGui.QUndoCommand):
     '''
     We block signals  when setting the selection so that we
-    don't end up in a recursive loop.
+    don't end up in a recursive loop.  Only the items added to
+    and removed from the selection are kept, and the selection
+    changes of one interaction, e.g. a rubber band drag, are
+    merged into one command.  Changes made outside of an
+    interaction, given as None, are never merged.
     '''
-    def __init__(self, scene, selection, previous):
+    Id = 1
+
+    def __init__(self, scene, selection, previous, interaction=None):
         super(CommandSelection, self).__init__()
         self._scene = scene
-        self._selection = selection
-        self._previousSelection = previous
+        self._interaction = interaction
+        selection = set(selection)
+        previous = set(previous)
+        self._added = selection - previous
+        self._removed = previous - selection
+
+    def id(self):
+        return CommandSelection.Id
+
+    def mergeWith(self, other):
+        if other.id() != self.id() or other._scene is not self._scene:
+            return False
+        if self._interaction is None or other._interaction != self._interaction:
+            return False
+
+        # An item added by one and removed by the other has not changed.
+        added = (self._added - other._removed) | (other._added - self._removed)
+        removed = (self._removed - other._added) | (other._removed - self._added)
+        self._added = added
+        self._removed = removed
+        return True
+
+    def _setSelected(self, items, selected):
+        for item in items:
+            # Items removed from the scene by a later command are left alone.
+            if item.scene() is self._scene:
+                item.setSelected(selected)
 
     def redo(self):
         self._scene.blockSignals(True)
-        for item in self._scene.items():
-            item.setSelected(item in self._selection)
+        self._setSelected(self._removed, False)
+        self._setSelected(self._added, True)
         self._scene.blockSignals(False)
+        # Later selection changes are worked out from what is selected now.
+        self._scene.setPreviouslySelectedItems(self._scene.selectedItems())
 
     def undo(self):
         self._scene.blockSignals(True)
-        for item in self._scene.items():
-            item.setSelected(item in self._previousSelection)
+        self._setSelected(self._added, False)
+        self._setSelected(self._removed, True)
         self._scene.blockSignals(False)
+        # Later selection changes are worked out from what is selected now.
+        self._scene.setPreviouslySelectedItems(self._scene.selectedItems())
 
 
 class CommandAdd(QtGui.QUndoCommand):
@@ -119,12 +154,16 @@ class CommandConfigure(QtGui.QUndoCommand):
 
     def redo(self):
         self._node.updateConfigureIcon()
+        self._node.updateToolTip()
+        self._node.updateMercurialIcon()
         self._node.update()
 #        for item in self._scene.items():
 #            item.update()
 
     def undo(self):
         self._node.updateConfigureIcon()
+        self._node.updateToolTip()
+        self._node.updateMercurialIcon()
         self._node.update()
 #        for item in self._scene.items():
 #            item.update()
@@ -23,9 +23,12 @@ from PySide import QtCore, QtGui
 
 from mapclient.core.workflowscene import Connection
 from mapclient.tools.annotation.annotationdialog import AnnotationDialog
-from mapclient.tools.pmr.pmrhghelper import repositoryIsUpToDate
 from mapclient.widgets.utils import createDefaultImageIcon
 
+# Below this level of detail, the scale of the view, steps are drawn as plain
+# boxes without their ports and icons and arcs as plain lines.
+SIMPLE_LEVEL_OF_DETAIL = 0.4
+
 class ErrorItem(QtGui.QGraphicsItem):
 
     def __init__(self, sourceNode, destNode):
@@ -184,6 +187,13 @@ class Arc(Item):
         if line.length() == 0.0:
             return
 
+        if option.levelOfDetailFromTransform(painter.worldTransform()) < SIMPLE_LEVEL_OF_DETAIL:
+            painter.setRenderHint(QtGui.QPainter.Antialiasing, False)
+            pen = QtGui.QPen(QtCore.Qt.darkGray if self.isSelected() else QtCore.Qt.black, 0)
+            painter.setPen(pen)
+            painter.drawLine(line)
+            return
+
         brush = QtGui.QBrush(QtCore.Qt.black)
         if self.isSelected():  # or self.selected:
             painter.setBrush(QtCore.Qt.darkGray)
@@ -230,7 +240,7 @@ class Node(Item):
 
         self._pixmap = QtGui.QPixmap.fromImage(icon).scaled(self.Size, self.Size, aspectRatioMode=QtCore.Qt.KeepAspectRatio, transformMode=QtCore.Qt.FastTransformation)
 
-        self.setToolTip(metastep._step._name)
+        self.updateToolTip()
 
         self.setFlag(QtGui.QGraphicsItem.ItemIsMovable)
         self.setFlag(QtGui.QGraphicsItem.ItemSendsGeometryChanges)
@@ -293,18 +303,36 @@ class Node(Item):
 
         self._modified_item = MercurialIcon(self)
         self._modified_item.moveBy(5, 40)
+        # Shown once the scene knows the repository status.
+        self._modified_item.hide()
 
-        self.updateMercurialIcon()
+        self._detailed = True
+
+    def updateToolTip(self):
+        self.setToolTip(self._metastep._step.getToolTip())
 
     def updateConfigureIcon(self):
         self._configure_item.setConfigured(self._metastep._step.isConfigured())
 
+    def setDetailed(self, detailed):
+        '''
+        Show or hide the ports and icons of this node, they are hidden
+        when the view is zoomed out too far for them to be of any use.
+        '''
+        if detailed == self._detailed:
+            return
+
+        self._detailed = detailed
+        for port_item in self._step_port_items:
+            port_item.setVisible(detailed)
+        self._configure_item.setVisible(detailed)
+        self.updateMercurialIcon()
+
     def updateMercurialIcon(self):
-        if self._metastep._step.getIdentifier():
-            if repositoryIsUpToDate(self._getStepLocation()):
-                self._modified_item.hide()
-            else:
-                self._modified_item.show()
+        scene = self.scene()
+        if self._detailed and self._metastep._step.getIdentifier() and scene is not None \
+                and scene.repositoryStatus(self._getStepLocation(), self) is False:
+            self._modified_item.show()
         else:
             self._modified_item.hide()
 
@@ -318,9 +346,10 @@ class Node(Item):
 
     def commitMe(self):
         step_location = self._getStepLocation()
-        if not repositoryIsUpToDate(step_location):
+        # The cached status, the icon that calls this only shows when it is False.
+        if self.scene().repositoryStatus(step_location) is False:
             self.scene().commitChanges(step_location)
-            self.updateMercurialIcon()
+            self.scene().invalidateRepositoryStatus(step_location)
 
     def _removeMe(self):
         self.scene().removeStep(self)
@@ -344,14 +373,19 @@ class Node(Item):
                              self._pixmap.height() + 2 * adjust)
 
     def paint(self, painter, option, widget):
-            if option.state & QtGui.QStyle.State_Selected:  # or self.selected:
-                painter.setBrush(QtCore.Qt.darkGray)
-                painter.drawRoundedRect(self.boundingRect(), 5, 5)
+        if option.levelOfDetailFromTransform(painter.worldTransform()) < SIMPLE_LEVEL_OF_DETAIL:
+            colour = QtCore.Qt.darkGray if option.state & QtGui.QStyle.State_Selected else QtCore.Qt.lightGray
+            painter.fillRect(QtCore.QRectF(0, 0, self.Size, self.Size), colour)
+            return
 
-#            super(Node, self).paint(painter, option, widget)
-            painter.drawPixmap(0, 0, self._pixmap)
-#            if not self._metastep._step.isConfigured():
-#                painter.drawPixmap(40, 40, self._configure_red)
+        if option.state & QtGui.QStyle.State_Selected:  # or self.selected:
+            painter.setBrush(QtCore.Qt.darkGray)
+            painter.drawRoundedRect(self.boundingRect(), 5, 5)
+
+#        super(Node, self).paint(painter, option, widget)
+        painter.drawPixmap(0, 0, self._pixmap)
+#        if not self._metastep._step.isConfigured():
+#            painter.drawPixmap(40, 40, self._configure_red)
 
     def itemChange(self, change, value):
         if change == QtGui.QGraphicsItem.ItemPositionChange and self.scene():
@@ -425,8 +459,12 @@ class StepPort(QtGui.QGraphicsEllipseItem):
     def itemChange(self, change, value):
         if change == QtGui.QGraphicsItem.ItemPositionHasChanged:
             self._removeDeadwood()
+            scene = self.scene()
             for arc in self._connections:
-                arc().adjust()
+                if scene is not None and hasattr(scene, 'scheduleArcUpdate'):
+                    scene.scheduleArcUpdate(arc())
+                else:
+                    arc().adjust()
 
         return QtGui.QGraphicsItem.itemChange(self, change, value)
 
@@ -17,18 +17,36 @@ This file is part of MAP Client. (http://launchpad.net/mapclient)
     You should have received a copy of the GNU General Public License
     along with MAP Client.  If not, see <http://www.gnu.org/licenses/>..
 '''
-from PySide import QtGui
+import math
 
-from mapclient.core.workflowscene import MetaStep, Connection
-from mapclient.widgets.workflowgraphicsitems import Node, Arc
+from PySide import QtCore, QtGui
+
+from mapclient.core.workflowscene import MetaStep, Connection, ITEM_ADDED, \
+    ITEM_REMOVED, ITEM_MOVED, ITEM_CONFIGURED, SCENE_CLEARED
+from mapclient.widgets.workflowgraphicsitems import Node, Arc, SIMPLE_LEVEL_OF_DETAIL
 from mapclient.widgets.workflowcommands import CommandConfigure, CommandRemove
+from mapclient.tools.pmr.repositorystatus import RepositoryStatusService
+
+# Graphics items aimed for in each leaf of the BSP tree.
+BSP_ITEMS_PER_LEAF = 16
+
+
+def bspTreeDepth(item_count):
+    '''
+    Return the BSP tree depth giving about BSP_ITEMS_PER_LEAF items per
+    leaf, each level of the tree halves the area of its leaves.
+    '''
+    leaves = max(2.0, float(item_count) / BSP_ITEMS_PER_LEAF)
+    return int(math.ceil(math.log(leaves, 2)))
 
 
 class WorkflowGraphicsScene(QtGui.QGraphicsScene):
     '''
     This view side class is a non-authoratative representation
     of the current workflow scene model.  It must be kept in 
-    sync with the authoratative workflow scene model.
+    sync with the authoratative workflow scene model, which it
+    does by applying the changes the model reports to the
+    graphics items of the affected model items only.
     '''
 
     sceneWidth = 500
@@ -37,11 +55,29 @@ class WorkflowGraphicsScene(QtGui.QGraphicsScene):
     def __init__(self, parent=None):
         QtGui.QGraphicsScene.__init__(self, -self.sceneHeight // 2, -self.sceneWidth // 2, self.sceneHeight, self.sceneWidth, parent)
         self._workflow_scene = None
+        # Workflow scene item to the graphics item representing it.
+        self._graphics_items = {}
         self._previousSelection = []
+        self._detailed = True
         self._undoStack = None
+        self._repository_status = RepositoryStatusService(self)
+        self._repository_status.statusChanged.connect(self._repositoryStatusChanged)
+        # Repository location to the nodes showing its status.
+        self._status_nodes = {}
+        # Arcs to adjust and the bounds of the moving selection are
+        # gathered over a frame, so each is only worked out once.
+        self._pending_arcs = set()
+        self._move_bounds = None
+        self._frame_timer = QtCore.QTimer(self)
+        self._frame_timer.setSingleShot(True)
+        self._frame_timer.setInterval(0)
+        self._frame_timer.timeout.connect(self._endFrame)
 
     def setWorkflowScene(self, scene):
+        if self._workflow_scene is not None:
+            self._workflow_scene.unregisterChangeObserver(self._workflowSceneChanged)
         self._workflow_scene = scene
+        self._workflow_scene.registerChangeObserver(self._workflowSceneChanged)
 
     def workflowScene(self):
         return self._workflow_scene
@@ -52,63 +88,209 @@ class WorkflowGraphicsScene(QtGui.QGraphicsScene):
     def addItem(self, item):
         QtGui.QGraphicsScene.addItem(self, item)
         if hasattr(item, 'Type'):
+            # Record the graphics item first so the change reported by the
+            # workflow scene is recognised as already applied.
             if item.Type == Node.Type:
+                self._graphics_items[item._metastep] = item
                 self._workflow_scene.addItem(item._metastep)
+                item.setDetailed(self._detailed)
+                item.updateMercurialIcon()
             elif item.Type == Arc.Type:
+                self._graphics_items[item._connection] = item
                 self._workflow_scene.addItem(item._connection)
 
     def removeItem(self, item):
         QtGui.QGraphicsScene.removeItem(self, item)
         if hasattr(item, 'Type'):
             if item.Type == Node.Type:
+                self._graphics_items.pop(item._metastep, None)
+                self._forgetStatusNode(item)
                 self._workflow_scene.removeItem(item._metastep)
             elif item.Type == Arc.Type:
                 item.sourceNode().removeArc(item)
                 item.destinationNode().removeArc(item)
+                self._graphics_items.pop(item._connection, None)
                 self._workflow_scene.removeItem(item._connection)
 
+    def _addNode(self, metastep):
+        node = Node(metastep)
+        metastep._step.registerConfiguredObserver(self.stepConfigured)
+        metastep._step.registerDoneExecution(self.doneExecution)
+        metastep._step.registerOnExecuteEntry(self.setCurrentWidget, self.setWidgetUndoRedoStack)
+        metastep._step.registerIdentifierOccursCount(self.identifierOccursCount)
+        # Put the node into the scene straight away so that the items scene will
+        # be valid when we set the position.
+        QtGui.QGraphicsScene.addItem(self, node)
+        # The position comes from the workflow scene, no need to tell it again.
+        QtGui.QGraphicsItem.setPos(node, metastep.pos())
+        node.setDetailed(self._detailed)
+        node.updateMercurialIcon()
+        self.blockSignals(True)
+        node.setSelected(metastep.selected())
+        self.blockSignals(False)
+        self._graphics_items[metastep] = node
+
+    def _addArc(self, connection):
+        source_node = self._graphics_items.get(connection.source())
+        destination_node = self._graphics_items.get(connection.destination())
+        if source_node is None or destination_node is None:
+            return
+
+        src_port_item = source_node._step_port_items[connection.sourceIndex()]
+        destination_port_item = destination_node._step_port_items[connection.destinationIndex()]
+        arc = Arc(src_port_item, destination_port_item)
+        # Overwrite the connection created in the Arc with the original one that is in the
+        # WorkflowScene
+        arc._connection = connection
+        # Again put the arc into the scene straight away so the scene will be valid
+        QtGui.QGraphicsScene.addItem(self, arc)
+        self.blockSignals(True)
+        arc.setSelected(connection.selected())
+        self.blockSignals(False)
+        self._graphics_items[connection] = arc
+
+    def _removeGraphicsItem(self, workflowitem):
+        item = self._graphics_items.pop(workflowitem, None)
+        if item is None:
+            return
+
+        if item.Type == Arc.Type:
+            item.sourceNode().removeArc(item)
+            item.destinationNode().removeArc(item)
+            self._pending_arcs.discard(item)
+        else:
+            self._forgetStatusNode(item)
+        QtGui.QGraphicsScene.removeItem(self, item)
+
+    def _workflowSceneChanged(self, change, workflowitem):
+        '''
+        Apply a change reported by the workflow scene, changes that were
+        made through this scene are already applied and are ignored.
+        '''
+        if change == SCENE_CLEARED:
+            self._pending_arcs.clear()
+            self._move_bounds = None
+            QtGui.QGraphicsScene.clear(self)
+            # Loading adds every item one at a time, building the index
+            # once afterwards in updateModel is much cheaper than keeping
+            # it up to date for each of them.
+            self.setItemIndexMethod(QtGui.QGraphicsScene.NoIndex)
+            self._graphics_items = {}
+            self._status_nodes = {}
+            self._repository_status.clear()
+            self._previousSelection = []
+        elif change == ITEM_ADDED:
+            if workflowitem not in self._graphics_items:
+                if workflowitem.Type == MetaStep.Type:
+                    self._addNode(workflowitem)
+                elif workflowitem.Type == Connection.Type:
+                    self._addArc(workflowitem)
+        elif change == ITEM_REMOVED:
+            self._removeGraphicsItem(workflowitem)
+        elif change == ITEM_MOVED:
+            node = self._graphics_items.get(workflowitem)
+            if node is not None and node.pos() != workflowitem.pos():
+                QtGui.QGraphicsItem.setPos(node, workflowitem.pos())
+        elif change == ITEM_CONFIGURED:
+            node = self._graphics_items.get(workflowitem)
+            if node is not None:
+                node.updateConfigureIcon()
+                node.updateToolTip()
+                node.updateMercurialIcon()
+                node.update()
+
     def updateModel(self):
         '''
-        Clears the QGraphicScene and re-populates it with what is currently 
-        in the WorkflowScene.
+        Brings the QGraphicsScene in line with what is currently in the
+        WorkflowScene.  Only the items that are missing, no longer in the
+        WorkflowScene or have moved are touched.
         '''
-        QtGui.QGraphicsScene.clear(self)
-        meta_steps = {}
-        connections = []
-        for workflowitem in self._workflow_scene.items():
-            if workflowitem.Type == MetaStep.Type:
-                node = Node(workflowitem)
-                workflowitem._step.registerConfiguredObserver(self.stepConfigured)
-                workflowitem._step.registerDoneExecution(self.doneExecution)
-                workflowitem._step.registerOnExecuteEntry(self.setCurrentWidget, self.setWidgetUndoRedoStack)
-                workflowitem._step.registerIdentifierOccursCount(self.identifierOccursCount)
-                # Put the node into the scene straight away so that the items scene will
-                # be valid when we set the position.
-                QtGui.QGraphicsScene.addItem(self, node)
-                node.setPos(workflowitem.pos())
-                self.blockSignals(True)
-                node.setSelected(workflowitem.selected())
-                self.blockSignals(False)
-                meta_steps[workflowitem] = node
-            elif workflowitem.Type == Connection.Type:
-                connections.append(workflowitem)
-
-        for connection in connections:
-            src_port_item = meta_steps[connection.source()]._step_port_items[connection.sourceIndex()]
-            destination_port_item = meta_steps[connection.destination()]._step_port_items[connection.destinationIndex()]
-            arc = Arc(src_port_item, destination_port_item)
-            # Overwrite the connection created in the Arc with the original one that is in the
-            # WorkflowScene
-            arc._connection = connection
-            # Again put the arc into the scene straight away so the scene will be valid
-            QtGui.QGraphicsScene.addItem(self, arc)
-            self.blockSignals(True)
-            arc.setSelected(connection.selected())
-            self.blockSignals(False)
+        self.setItemIndexMethod(QtGui.QGraphicsScene.NoIndex)
+        workflowitems = list(self._workflow_scene.items())
+        current = set(workflowitems)
+        for workflowitem in [item for item in self._graphics_items if item not in current]:
+            self._removeGraphicsItem(workflowitem)
 
+        # Steps first, an arc needs the nodes at both of its ends.
+        for workflowitem in sorted(workflowitems, key=lambda item: item.Type != MetaStep.Type):
+            if workflowitem in self._graphics_items:
+                self._workflowSceneChanged(ITEM_MOVED, workflowitem)
+            else:
+                self._workflowSceneChanged(ITEM_ADDED, workflowitem)
+
+        # Culling through the BSP tree keeps painting large workflows cheap.
+        self.setBspTreeDepth(bspTreeDepth(len(self.items())))
+        self.setItemIndexMethod(QtGui.QGraphicsScene.BspTreeIndex)
         self._previousSelection = self.selectedItems()
 
+    def setLevelOfDetail(self, level_of_detail):
+        '''
+        Hide the ports and icons of the nodes when the view is zoomed out
+        past the point they can be made out.  Nodes are only touched when
+        the threshold is crossed.
+        '''
+        detailed = level_of_detail >= SIMPLE_LEVEL_OF_DETAIL
+        if detailed == self._detailed:
+            return
+
+        self._detailed = detailed
+        for item in self._graphics_items.values():
+            if item.Type == Node.Type:
+                item.setDetailed(detailed)
+
+    def scheduleArcUpdate(self, arc):
+        '''
+        Adjust the given arc at the end of the frame, however many of the
+        nodes it connects move during it.
+        '''
+        self._pending_arcs.add(arc)
+        if not self._frame_timer.isActive():
+            self._frame_timer.start()
+
+    def _endFrame(self):
+        arcs = self._pending_arcs
+        self._pending_arcs = set()
+        self._move_bounds = None
+        for arc in arcs:
+            if arc.scene() is self:
+                arc.adjust()
+
+    def _moveBounds(self):
+        '''
+        Return the united scene bounding rectangle of the selected nodes
+        and their positions, as they were at the start of the frame.
+        '''
+        if self._move_bounds is None:
+            nodes = [item for item in self.selectedItems() if item.type() == Node.Type]
+            bounds = QtCore.QRectF()
+            for node in nodes:
+                bounds = bounds.united(node.sceneBoundingRect())
+            self._move_bounds = (bounds, dict((node, node.pos()) for node in nodes))
+            if not self._frame_timer.isActive():
+                self._frame_timer.start()
+
+        return self._move_bounds
+
+    def _ensureSelectionInScene(self, item, newPos):
+        '''
+        Keep a moving selection inside the scene as a whole, every node in
+        it is moved by the same amount so it keeps its shape.
+        '''
+        bounds, positions = self._moveBounds()
+        start = positions[item]
+        dx = newPos.x() - start.x()
+        dy = newPos.y() - start.y()
+        rect = self.sceneRect()
+        dx = max(rect.left() - bounds.left(), min(dx, rect.right() - bounds.right()))
+        dy = max(rect.top() - bounds.top(), min(dy, rect.bottom() - bounds.bottom()))
+        return QtCore.QPointF(start.x() + dx, start.y() + dy)
+
     def ensureItemInScene(self, item, newPos):
+        if item.isSelected():
+            positions = self._moveBounds()[1]
+            if len(positions) > 1 and item in positions:
+                return self._ensureSelectionInScene(item, newPos)
+
         bRect = item.boundingRect()
         xp1 = bRect.x() + newPos.x()
         yp1 = bRect.y() + newPos.y()
@@ -133,8 +315,34 @@ class WorkflowGraphicsScene(QtGui.QGraphicsScene):
         return newPos
 
     def clear(self):
-        QtGui.QGraphicsScene.clear(self)
+        # The graphics items go when the workflow scene reports it is cleared.
         self._workflow_scene.clear()
+        # Nothing is being loaded, items added from now on are indexed as
+        # they come.
+        self.setItemIndexMethod(QtGui.QGraphicsScene.BspTreeIndex)
+
+    def repositoryStatus(self, location, node=None):
+        '''
+        Return the cached status of the repository at location, None when
+        it is not known yet.  The icon of the given node is updated when
+        it changes.
+        '''
+        if node is not None:
+            self._status_nodes.setdefault(location, set()).add(node)
+        return self._repository_status.status(location)
+
+    def invalidateRepositoryStatus(self, location):
+        self._repository_status.invalidate(location)
+
+    def _forgetStatusNode(self, node):
+        for nodes in self._status_nodes.values():
+            nodes.discard(node)
+
+    def _repositoryStatusChanged(self, location, up_to_date):
+        # A node whose step has since moved to another location just
+        # updates its icon needlessly.
+        for node in list(self._status_nodes.get(location, ())):
+            node.updateMercurialIcon()
 
     def previouslySelectedItems(self):
         return self._previousSelection
@@ -21,11 +21,19 @@ import sys, math
 
 from PySide import QtCore, QtGui
 
+try:
+    from PySide import QtOpenGL
+except ImportError:
+    QtOpenGL = None
+
 from mapclient.mountpoints.workflowstep import workflowStepFactory
 from mapclient.widgets.workflowcommands import CommandSelection, CommandRemove, CommandAdd, CommandMove
 from mapclient.core.workflowscene import MetaStep
 from mapclient.widgets.workflowgraphicsitems import Node, Arc, ErrorItem, ArrowLine, StepPort
 
+# Zoom levels whose grid tile is kept, wheel zooming tends to go back and forth.
+_GRID_TILE_CACHE_SIZE = 8
+
 
 class WorkflowGraphicsView(QtGui.QGraphicsView):
 
@@ -45,12 +53,21 @@ class WorkflowGraphicsView(QtGui.QGraphicsView):
         self._connectSourceNode = None
 
         self._selectionStartPos = None
+        # Numbers the mouse interactions, the selection changes of one are
+        # undone together.  None while no mouse button is held.
+        self._interactionCount = 0
+        self._interaction = None
 
         self.setCacheMode(QtGui.QGraphicsView.CacheBackground)
         self.setRenderHint(QtGui.QPainter.Antialiasing)
+        # The bounding rectangles of the items already allow for the pen.
+        self.setOptimizationFlag(QtGui.QGraphicsView.DontAdjustForAntialiasing)
+        self.setViewportUpdateMode(QtGui.QGraphicsView.SmartViewportUpdate)
 
-        grid_pic = QtGui.QPixmap(':/workflow/images/grid.png')
-        self._grid_brush = QtGui.QBrush(grid_pic)
+        self._grid_pixmap = QtGui.QPixmap(':/workflow/images/grid.png')
+        self._grid_brush = QtGui.QBrush(self._grid_pixmap)
+        self._grid_tiles = {}
+        self._grid_tile_cache = True
 
 #        self.setTransformationAnchor(QtGui.QGraphicsView.AnchorUnderMouse)
 #        self.setResizeAnchor(QtGui.QGraphicsView.AnchorViewCenter)
@@ -60,6 +77,64 @@ class WorkflowGraphicsView(QtGui.QGraphicsView):
     def clear(self):
         self.scene().clear()
 
+    def setOpenGLViewport(self, enabled):
+        '''
+        Paint the canvas through OpenGL when enabled and OpenGL is
+        available, otherwise through the raster engine.  Returns True if
+        the OpenGL viewport is in use.
+        '''
+        use_gl = enabled and QtOpenGL is not None and QtOpenGL.QGLFormat.hasOpenGL()
+        if use_gl == self.isOpenGLViewport():
+            return use_gl
+
+        if use_gl:
+            self.setViewport(QtOpenGL.QGLWidget(QtOpenGL.QGLFormat(QtOpenGL.QGL.SampleBuffers)))
+            # Redrawing the whole frame is cheaper for OpenGL than working
+            # out and clipping to the exposed regions, and the background
+            # cache does not work with it.
+            self.setViewportUpdateMode(QtGui.QGraphicsView.FullViewportUpdate)
+            self.setCacheMode(QtGui.QGraphicsView.CacheNone)
+        else:
+            self.setViewport(QtGui.QWidget())
+            self.setViewportUpdateMode(QtGui.QGraphicsView.SmartViewportUpdate)
+            self.setCacheMode(QtGui.QGraphicsView.CacheBackground)
+
+        return use_gl
+
+    def setGridTileCache(self, enabled):
+        '''
+        Draw the grid from tiles prepared for each zoom level, rather than
+        scaling the grid image on every paint.  On by default.
+        '''
+        self._grid_tile_cache = enabled
+        self._grid_tiles = {}
+        self.resetCachedContent()
+
+    def _gridTileBrush(self):
+        '''
+        Return a brush of the grid image prepared at the current zoom
+        level and resolution, its transform maps the tile back to scene
+        units so painting it is a plain blit.
+        '''
+        scale = self.transform().m11()
+        key = (scale, self.logicalDpiX(), self.logicalDpiY())
+        brush = self._grid_tiles.get(key)
+        if brush is None:
+            if len(self._grid_tiles) >= _GRID_TILE_CACHE_SIZE:
+                self._grid_tiles = {}
+            width = self._grid_pixmap.width()
+            height = self._grid_pixmap.height()
+            tile = self._grid_pixmap.scaled(max(1, int(round(width * scale))), max(1, int(round(height * scale))),
+                                            QtCore.Qt.IgnoreAspectRatio, QtCore.Qt.SmoothTransformation)
+            brush = QtGui.QBrush(tile)
+            brush.setTransform(QtGui.QTransform.fromScale(float(width) / tile.width(), float(height) / tile.height()))
+            self._grid_tiles[key] = brush
+
+        return brush
+
+    def isOpenGLViewport(self):
+        return QtOpenGL is not None and isinstance(self.viewport(), QtOpenGL.QGLWidget)
+
     def setUndoStack(self, stack):
         self._undoStack = stack
 
@@ -85,7 +160,7 @@ class WorkflowGraphicsView(QtGui.QGraphicsView):
     def selectionChanged(self):
         currentSelection = self.scene().selectedItems()
         previousSelection = self.scene().previouslySelectedItems()
-        command = CommandSelection(self.scene(), currentSelection, previousSelection)
+        command = CommandSelection(self.scene(), currentSelection, previousSelection, self._interaction)
         self._undoStack.push(command)
         self.scene().setPreviouslySelectedItems(currentSelection)
 
@@ -114,6 +189,8 @@ class WorkflowGraphicsView(QtGui.QGraphicsView):
             item.showContextMenu(event.globalPos())
 
     def mousePressEvent(self, event):
+        self._interactionCount += 1
+        self._interaction = self._interactionCount
         item = self.scene().itemAt(self.mapToScene(event.pos()))
         if event.button() == QtCore.Qt.RightButton:
             event.ignore()
@@ -152,6 +229,7 @@ class WorkflowGraphicsView(QtGui.QGraphicsView):
                         if item.type() == Node.Type:
                             self._undoStack.push(CommandMove(item, item.pos() - diff, item.pos()))
                     self._undoStack.endMacro()
+        self._interaction = None
 
     def errorIconTimeout(self):
         self.scene().removeItem(self._errorIcon)
@@ -171,7 +249,10 @@ class WorkflowGraphicsView(QtGui.QGraphicsView):
         if bottomShadow.intersects(rect) or bottomShadow.contains(rect):
             painter.fillRect(bottomShadow, QtCore.Qt.darkGray)
 
-        painter.setBrush(self._grid_brush)  # QtCore.Qt.NoBrush
+        if self._grid_tile_cache:
+            painter.setBrush(self._gridTileBrush())
+        else:
+            painter.setBrush(self._grid_brush)  # QtCore.Qt.NoBrush
         painter.drawRect(sceneRect)
 
     def dropEvent(self, event):
@@ -248,5 +329,6 @@ class WorkflowGraphicsView(QtGui.QGraphicsView):
         self.setTransformationAnchor(QtGui.QGraphicsView.AnchorUnderMouse)
         self.scale(scaleFactor, scaleFactor)
         self.setTransformationAnchor(transformation_anchor)
+        self.scene().setLevelOfDetail(self.transform().m11())
 
 
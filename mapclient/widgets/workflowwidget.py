@@ -20,7 +20,7 @@ This file is part of MAP Client. (http://launchpad.net/mapclient)
 import os
 import logging
 
-from PySide import QtGui
+from PySide import QtGui, QtCore
 
 from requests.exceptions import HTTPError
 from mapclient.exceptions import ClientRuntimeError
@@ -36,7 +36,11 @@ from mapclient.mountpoints.workflowstep import WorkflowStepMountPoint
 from mapclient.widgets.workflowgraphicsscene import WorkflowGraphicsScene
 from mapclient.core.workflow import WorkflowError
 from mapclient.tools.pmr.pmrtool import PMRTool
+from mapclient.tools.pmr.requestrunner import PMRRequestRunner
 from mapclient.tools.pmr.pmrsearchdialog import PMRSearchDialog
+from mapclient.tools.pmr.commitplanner import CommitPlanner
+from mapclient.tools.pmr.journal import offlineJournal
+from mapclient.tools.pmr.journaldialog import JournalDialog
 from mapclient.tools.pmr.pmrhgcommitdialog import PMRHgCommitDialog
 import shutil
 from mapclient.widgets.importworkflowdialog import ImportWorkflowDialog
@@ -48,6 +52,10 @@ class WorkflowWidget(QtGui.QWidget):
     '''
     classdocs
     '''
+
+    # Emitted from the clone threads, delivered queued on the GUI thread.
+    _cloneProgressed = QtCore.Signal(int, int, str)
+
     def __init__(self, mainWindow):
         '''
         Constructor
@@ -65,11 +73,18 @@ class WorkflowWidget(QtGui.QWidget):
         self._ui.graphicsView.setScene(self._graphicsScene)
 
         self._ui.graphicsView.setUndoStack(self._undoStack)
+        self._ui.graphicsView.setOpenGLViewport(self._mainWindow.model().openGLViewport())
         self._graphicsScene.setUndoStack(self._undoStack)
 
         self._graphicsScene.setWorkflowScene(self._workflowManager.scene())
         self._graphicsScene.selectionChanged.connect(self._ui.graphicsView.selectionChanged)
 
+        self._clone_runner = PMRRequestRunner(self)
+        self._clone_runner.finished.connect(self._stepWorkspacesCloned)
+        self._clone_runner.failed.connect(self._stepWorkspacesCloneFailed)
+        self._clone_dialog = None
+        self._cloneProgressed.connect(self._stepWorkspaceCloned, QtCore.Qt.QueuedConnection)
+
         self._ui.executeButton.clicked.connect(self.executeWorkflow)
         self.action_Close = None  # Keep a handle to this for modifying the Ui.
         self._action_annotation = self._mainWindow.findChild(QtGui.QAction, "actionAnnotation")
@@ -77,6 +92,13 @@ class WorkflowWidget(QtGui.QWidget):
 
         self.updateStepTree()
 
+        # Pushes and indexer updates, including those left from the last session, happen in the background.
+        journal = offlineJournal()
+        journal.failed.connect(self._journalReplayFailed)
+        journal.parked.connect(self._journalReplayParked)
+        journal.pendingChanged.connect(self._journalPendingChanged)
+        journal.start()
+
         self._updateUi()
 
     def _updateUi(self):
@@ -290,12 +312,48 @@ class WorkflowWidget(QtGui.QWidget):
             m = self._mainWindow.model().workflowManager()
             m.load(workflowDir)
             m.setPreviousLocation(workflowDir)
-            self._graphicsScene.updateModel()
-            self._updateUi()
+            workspaces = m.scene().pmrWorkspaces()
+            if workspaces:
+                self._cloneStepWorkspaces(pmr_tool, workspaces)
+            else:
+                self._graphicsScene.updateModel()
+                self._updateUi()
         except:
             self.close()
             raise
 
+    def _cloneStepWorkspaces(self, pmr_tool, workspaces):
+        '''
+        Clone the data workspaces of the steps in the background, the
+        workflow is shown once they have all been cloned.
+        '''
+        self._clone_dialog = QtGui.QProgressDialog('Cloning data workspaces ...', None, 0, len(workspaces), self)
+        self._clone_dialog.setWindowModality(QtCore.Qt.WindowModal)
+        self._clone_dialog.setMinimumDuration(0)
+        self._clone_dialog.setValue(0)
+        self._clone_runner.start(pmr_tool.cloneWorkspaces, workspaces, progress=self._cloneProgressed.emit)
+
+    def _stepWorkspaceCloned(self, completed, total, workspace_url):
+        if self._clone_dialog is not None:
+            self._clone_dialog.setLabelText('Cloned %s' % workspace_url)
+            self._clone_dialog.setValue(completed)
+
+    def _closeCloneDialog(self):
+        if self._clone_dialog is not None:
+            self._clone_dialog.close()
+            self._clone_dialog = None
+
+    def _stepWorkspacesCloned(self, results):
+        self._closeCloneDialog()
+        self._mainWindow.model().workflowManager().scene().revalidateSteps()
+        self._graphicsScene.updateModel()
+        self._updateUi()
+
+    def _stepWorkspacesCloneFailed(self, error):
+        self._closeCloneDialog()
+        self.close()
+        QtGui.QMessageBox.critical(self, error.title, error.description)
+
     def close(self):
         self._mainWindow.confirmClose()
         m = self._mainWindow.model().workflowManager()
@@ -344,12 +402,23 @@ class WorkflowWidget(QtGui.QWidget):
     def _commitChanges(self, workflowDir, comment, commit_local=False):
         committed_changes = False
         pmr_tool = PMRTool()
+        planner = CommitPlanner(pmr_tool)
+        planner.addFiles(workflowDir,
+            [workflowDir + '/%s' % (DEFAULT_WORKFLOW_PROJECT_FILENAME),
+             workflowDir + '/%s' % (DEFAULT_WORKFLOW_ANNOTATION_FILENAME)])  # XXX make/use file tracker
+        m = self._mainWindow.model().workflowManager()
+        if m.location() == workflowDir:
+            step_locations = [step_location for step_location in m.scene().stepLocations()
+                              if step_location != workflowDir and planner.addChangedRepository(step_location)]
+            if step_locations and QtGui.QMessageBox.question(self, 'Commit Step Changes',
+                    'The following steps have uncommitted changes:\n\n' + '\n'.join(step_locations) +
+                    '\n\nCommit them together with the workflow using the same comment?',
+                    QtGui.QMessageBox.Yes | QtGui.QMessageBox.No) != QtGui.QMessageBox.Yes:
+                for step_location in step_locations:
+                    planner.removeRepository(step_location)
         try:
-            pmr_tool.commitFiles(workflowDir, comment,
-                [workflowDir + '/%s' % (DEFAULT_WORKFLOW_PROJECT_FILENAME),
-                 workflowDir + '/%s' % (DEFAULT_WORKFLOW_ANNOTATION_FILENAME)])  # XXX make/use file tracker
-            if not commit_local:
-                pmr_tool.pushToRemote(workflowDir)
+            # Only commit here, pushing is left to the journal so saving does not wait on PMR.
+            planner.execute(comment, push=False)
             committed_changes = True
         except ClientRuntimeError:
             # handler will deal with this.
@@ -359,21 +428,43 @@ class WorkflowWidget(QtGui.QWidget):
             raise ClientRuntimeError(
                 'Error Saving', 'The commit to PMR did not succeed')
 
+        if not commit_local:
+            for repository in planner.repositories():
+                offlineJournal().queuePush(repository)
+
         return committed_changes
 
-    @handle_runtime_error
-    @set_wait_cursor
     def _setIndexerFile(self, workflow_dir):
         pmr_tool = PMRTool()
 
         if not pmr_tool.hasDVCS(workflow_dir):
             return
-        try:
-            pmr_tool.addFileToIndexer(workflow_dir, DEFAULT_WORKFLOW_ANNOTATION_FILENAME)
-#             pmr_tool.commitFiles(local_workspace_dir, message, files)
-        except ClientRuntimeError:
-            # handler will deal with this.
-            raise
+
+        offlineJournal().queueIndexerPaths(workflow_dir, [DEFAULT_WORKFLOW_ANNOTATION_FILENAME])
+
+    def _journalReplayFailed(self, local_workspace_dir, message):
+        self._mainWindow.statusBar().showMessage(
+            'Could not update PMR for %s, will try again: %s' % (local_workspace_dir, message), 10000)
+
+    def _journalReplayParked(self, local_workspace_dir, message):
+        self._mainWindow.statusBar().showMessage(
+            'Stopped trying to update PMR for %s, see Project > PMR Updates: %s' % (local_workspace_dir, message))
+
+    def showPMRUpdates(self):
+        dlg = JournalDialog(offlineJournal(), self)
+        dlg.setModal(True)
+        dlg.exec_()
+
+    def _journalPendingChanged(self, pending):
+        if pending:
+            self._mainWindow.statusBar().showMessage('%d PMR update(s) waiting to be sent' % pending)
+        else:
+            self._mainWindow.statusBar().showMessage('PMR is up to date', 5000)
+
+    def setOpenGLViewport(self, enabled):
+        enabled = self._ui.graphicsView.setOpenGLViewport(enabled)
+        self.action_OpenGL.setChecked(enabled)
+        self._mainWindow.model().setOpenGLViewport(enabled)
 
     def _setActionProperties(self, action, name, slot, shortcut='', statustip=''):
         action.setObjectName(name)
@@ -404,6 +495,12 @@ class WorkflowWidget(QtGui.QWidget):
         self._setActionProperties(self.action_Save, 'action_Save', self.save, 'Ctrl+S', 'Save Workflow')
         self.action_Execute = QtGui.QAction('E&xecute', menu_Project)
         self._setActionProperties(self.action_Execute, 'action_Execute', self.executeWorkflow, 'Ctrl+X', 'Execute Workflow')
+        self.action_OpenGL = QtGui.QAction('Use &OpenGL Canvas', menu_Project)
+        self.action_OpenGL.setCheckable(True)
+        self.action_OpenGL.setChecked(self._ui.graphicsView.isOpenGLViewport())
+        self._setActionProperties(self.action_OpenGL, 'action_OpenGL', self.setOpenGLViewport, statustip='Paint the workflow canvas with OpenGL')
+        self.action_PMRUpdates = QtGui.QAction('PMR &Updates...', menu_Project)
+        self._setActionProperties(self.action_PMRUpdates, 'action_PMRUpdates', self.showPMRUpdates, statustip='Show, retry or discard the updates waiting to be sent to PMR')
 
         menu_New.insertAction(QtGui.QAction(self), self.action_NewPMR)
         menu_New.insertAction(QtGui.QAction(self), self.action_New)
@@ -417,5 +514,8 @@ class WorkflowWidget(QtGui.QWidget):
         menu_File.insertAction(lastFileMenuAction, self.action_Save)
         menu_File.insertSeparator(lastFileMenuAction)
         menu_Project.addAction(self.action_Execute)
+        menu_Project.addSeparator()
+        menu_Project.addAction(self.action_OpenGL)
+        menu_Project.addAction(self.action_PMRUpdates)
 
 
@@ -0,0 +1,224 @@
+'''
+MAP Client, a program to generate detailed musculoskeletal models for OpenSim.
+    Copyright (C) 2012  University of Auckland
+
+This file is part of MAP Client. (http://launchpad.net/mapclient)
+
+    MAP Client is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    MAP Client is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with MAP Client.  If not, see <http://www.gnu.org/licenses/>..
+'''
+import os
+import json
+import base64
+import hashlib
+import logging
+import tempfile
+import threading
+
+from PySide import QtCore, QtGui
+
+logger = logging.getLogger(__name__)
+
+_INDEX_DIRNAME = 'image-indexes'
+_INDEX_VERSION = 1
+NO_INDEX_SUMMARY = 'No indexed images'
+
+# Summary file name to (mtime, summary) of the summaries read so far.
+_summaries = {}
+_summaries_lock = threading.Lock()
+# Index file name to the lock serializing the updates of that index.
+_update_locks = {}
+_update_locks_lock = threading.Lock()
+
+
+def indexDirectory():
+    '''
+    Return the directory the image indexes are kept in.  They are kept in
+    the user's cache location rather than next to the images, which may
+    be a version controlled working copy.
+    '''
+    location = QtGui.QDesktopServices.storageLocation(QtGui.QDesktopServices.CacheLocation)
+    if not location:
+        location = os.path.join(tempfile.gettempdir(), 'mapclient')
+
+    return os.path.join(location, _INDEX_DIRNAME)
+
+
+def _indexBasename(directory):
+    key = hashlib.sha1(os.path.abspath(directory).encode('utf-8')).hexdigest()
+    return os.path.join(indexDirectory(), key)
+
+
+def indexFilename(directory):
+    return _indexBasename(directory) + '.json'
+
+
+def summaryFilename(directory):
+    return _indexBasename(directory) + '.summary.json'
+
+
+def updateLock(directory):
+    '''
+    Return the lock to hold while loading, updating and saving the index
+    of the given directory, so an update never overwrites another's work.
+    '''
+    filename = indexFilename(directory)
+    with _update_locks_lock:
+        lock = _update_locks.get(filename)
+        if lock is None:
+            lock = _update_locks[filename] = threading.Lock()
+
+    return lock
+
+
+def indexSummary(directory):
+    '''
+    Return the one line summary of the index of the given directory.
+    Only the small summary file written with the index is read, and only
+    again once it has changed, so this is cheap enough for tool tips.
+    '''
+    filename = summaryFilename(directory)
+    try:
+        mtime = os.stat(filename).st_mtime
+    except OSError:
+        return NO_INDEX_SUMMARY
+
+    with _summaries_lock:
+        cached = _summaries.get(filename)
+    if cached is not None and cached[0] == mtime:
+        return cached[1]
+
+    try:
+        with open(filename) as f:
+            content = json.load(f)
+    except (IOError, OSError, ValueError):
+        return NO_INDEX_SUMMARY
+
+    summary = content.get('summary', NO_INDEX_SUMMARY) if content.get('version') == _INDEX_VERSION else NO_INDEX_SUMMARY
+    with _summaries_lock:
+        _summaries[filename] = (mtime, summary)
+
+    return summary
+
+
+def _writeJson(filename, content):
+    # A unique temporary name, two indexers may be saving the same index.
+    handle, temporary_filename = tempfile.mkstemp(suffix='.tmp', dir=os.path.dirname(filename))
+    try:
+        with os.fdopen(handle, 'w') as f:
+            json.dump(content, f)
+        if hasattr(os, 'replace'):
+            os.replace(temporary_filename, filename)
+        else:
+            if os.path.exists(filename):
+                os.remove(filename)
+            os.rename(temporary_filename, filename)
+    except:
+        if os.path.exists(temporary_filename):
+            os.remove(temporary_filename)
+        raise
+
+
+class ImageIndex(object):
+    '''
+    The index of an image directory, kept in the user's cache location.
+    For every image file it holds
+    the size and mtime the entry was made from, the header information and
+    a small PNG thumbnail, so the directory can be summarised without
+    opening any of the images.
+    '''
+
+    def __init__(self, directory, entries=None):
+        self._directory = directory
+        self._entries = entries or {}
+
+    @classmethod
+    def load(cls, directory):
+        '''
+        Load the index of the given directory, an empty index is returned
+        when there is no usable index file.
+        '''
+        try:
+            with open(indexFilename(directory)) as f:
+                content = json.load(f)
+        except (IOError, OSError, ValueError):
+            return cls(directory)
+
+        if content.get('version') != _INDEX_VERSION:
+            return cls(directory)
+
+        return cls(directory, content.get('entries', {}))
+
+    def save(self):
+        try:
+            directory = indexDirectory()
+            if not os.path.exists(directory):
+                os.makedirs(directory)
+            _writeJson(indexFilename(self._directory), {'version': _INDEX_VERSION, 'entries': self._entries})
+            _writeJson(summaryFilename(self._directory), {'version': _INDEX_VERSION, 'summary': self.summary()})
+        except (IOError, OSError):
+            logger.info('Could not write the image index for {0}'.format(self._directory))
+
+    def directory(self):
+        return self._directory
+
+    def names(self):
+        return sorted(self._entries.keys())
+
+    def __len__(self):
+        return len(self._entries)
+
+    def entry(self, name):
+        return self._entries.get(name)
+
+    def setEntry(self, name, entry):
+        self._entries[name] = entry
+
+    def removeEntry(self, name):
+        self._entries.pop(name, None)
+
+    def isCurrent(self, name, size, mtime):
+        entry = self._entries.get(name)
+        return entry is not None and entry['size'] == size and entry['mtime'] == mtime
+
+    def thumbnail(self, name):
+        entry = self._entries.get(name)
+        if entry is None or not entry.get('thumbnail'):
+            return None
+
+        image = QtGui.QImage()
+        image.loadFromData(QtCore.QByteArray(base64.b64decode(entry['thumbnail'].encode('ascii'))), 'PNG')
+        return image
+
+    def summary(self):
+        '''
+        Return a one line description of the indexed images.
+        '''
+        if not self._entries:
+            return NO_INDEX_SUMMARY
+
+        dimensions = set()
+        pixel_types = set()
+        total_size = 0
+        for entry in self._entries.values():
+            dimensions.add((entry['width'], entry['height']))
+            pixel_types.add(entry['pixel_type'])
+            total_size += entry['size']
+
+        if len(dimensions) == 1:
+            dimension_text = '%dx%d' % dimensions.pop()
+        else:
+            dimension_text = 'mixed dimensions'
+
+        return '%d images, %s, %s, %.1f MB' % (len(self._entries), dimension_text,
+                                               ', '.join(sorted(pixel_types)), total_size / (1024.0 * 1024.0))
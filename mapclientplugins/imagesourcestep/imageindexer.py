@@ -0,0 +1,170 @@
+'''
+MAP Client, a program to generate detailed musculoskeletal models for OpenSim.
+    Copyright (C) 2012  University of Auckland
+
+This file is part of MAP Client. (http://launchpad.net/mapclient)
+
+    MAP Client is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    MAP Client is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with MAP Client.  If not, see <http://www.gnu.org/licenses/>..
+'''
+import os
+import base64
+import logging
+import threading
+from multiprocessing.pool import ThreadPool
+
+from PySide import QtCore, QtGui
+
+from mapclientplugins.imagesourcestep.imageindex import ImageIndex, updateLock
+from mapclientplugins.imagesourcestep.imagestack import listImageFiles, readImageFileInfo, isDicom
+
+logger = logging.getLogger(__name__)
+
+THUMBNAIL_SIZE = 64
+# Below this many files to index the start up cost of a pool is not worth it.
+_POOL_THRESHOLD = 32
+_CHUNK_SIZE = 16
+
+
+def _thumbnail(filename):
+    reader = QtGui.QImageReader(filename)
+    size = reader.size()
+    if size.isValid():
+        size.scale(THUMBNAIL_SIZE, THUMBNAIL_SIZE, QtCore.Qt.KeepAspectRatio)
+        # Lets the decoder skip work for formats that support scaled reads.
+        reader.setScaledSize(size)
+    image = reader.read()
+    if image.isNull():
+        return ''
+
+    if image.width() > THUMBNAIL_SIZE or image.height() > THUMBNAIL_SIZE:
+        image = image.scaled(THUMBNAIL_SIZE, THUMBNAIL_SIZE, QtCore.Qt.KeepAspectRatio, QtCore.Qt.SmoothTransformation)
+
+    data = QtCore.QByteArray()
+    buffer_ = QtCore.QBuffer(data)
+    buffer_.open(QtCore.QIODevice.WriteOnly)
+    image.save(buffer_, 'PNG')
+    buffer_.close()
+    return base64.b64encode(data.data()).decode('ascii')
+
+
+def indexImageFile(filename):
+    '''
+    Create the index entry for a single image file.  Runs in the worker
+    threads of the indexer, Qt image reading is reentrant.
+    '''
+    name = os.path.basename(filename)
+    try:
+        info = readImageFileInfo(filename)
+        thumbnail = '' if isDicom(filename) else _thumbnail(filename)
+    except Exception as e:
+        logger.info('Failed to index image {0}: {1}'.format(filename, e))
+        return name, None
+
+    return name, {
+        'size': info.size,
+        'mtime': info.mtime,
+        'width': info.width,
+        'height': info.height,
+        'pixel_type': info.pixel_type,
+        'spacing': list(info.spacing) if info.spacing else None,
+        'thumbnail': thumbnail,
+    }
+
+
+class ImageIndexer(QtCore.QObject):
+    '''
+    Brings the image index of a directory up to date in the background.
+    Only files that are new or whose size or mtime changed are opened, and
+    large batches are spread over a pool of threads.  A process pool is
+    not used as forking the GUI process from a worker thread is unsafe.
+    '''
+
+    progress = QtCore.Signal(int, int)
+    finished = QtCore.Signal(object)
+
+    def __init__(self, directory, image_type, threads=None, parent=None):
+        super(ImageIndexer, self).__init__(parent)
+        self._directory = directory
+        self._image_type = image_type
+        self._threads = threads
+        self._cancelled = False
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self.run, name='ImageIndexer')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def cancel(self):
+        self._cancelled = True
+
+    def isRunning(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def run(self):
+        # A cancelled indexer of the same directory may still be saving,
+        # this one picks up its work once it is done.
+        with updateLock(self._directory):
+            if not self._cancelled:
+                self._update()
+
+    def _update(self):
+        index = ImageIndex.load(self._directory)
+        filenames = listImageFiles(self._directory, self._image_type)
+        names = set(os.path.basename(filename) for filename in filenames)
+        modified = False
+        for name in index.names():
+            if name not in names:
+                index.removeEntry(name)
+                modified = True
+
+        stale = []
+        for filename in filenames:
+            if self._cancelled:
+                break
+            stat = os.stat(filename)
+            if not index.isCurrent(os.path.basename(filename), stat.st_size, stat.st_mtime):
+                stale.append(filename)
+
+        total = len(stale)
+        if total:
+            modified = True
+            if total < _POOL_THRESHOLD:
+                results = (indexImageFile(filename) for filename in stale)
+                pool = None
+            else:
+                pool = ThreadPool(self._threads)
+                results = pool.imap_unordered(indexImageFile, stale, _CHUNK_SIZE)
+
+            try:
+                for count, (name, entry) in enumerate(results):
+                    if self._cancelled:
+                        break
+                    if entry is not None:
+                        index.setEntry(name, entry)
+                    self.progress.emit(count + 1, total)
+            finally:
+                if pool is not None:
+                    if self._cancelled:
+                        pool.terminate()
+                    else:
+                        pool.close()
+                    pool.join()
+
+        if modified:
+            # A partial index is still useful, the remaining files are picked up next time.
+            index.save()
+
+        if not self._cancelled:
+            self.finished.emit(index)
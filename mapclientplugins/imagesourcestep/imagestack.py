@@ -0,0 +1,318 @@
+'''
+MAP Client, a program to generate detailed musculoskeletal models for OpenSim.
+    Copyright (C) 2012  University of Auckland
+
+This file is part of MAP Client. (http://launchpad.net/mapclient)
+
+    MAP Client is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    MAP Client is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with MAP Client.  If not, see <http://www.gnu.org/licenses/>..
+'''
+import os
+import re
+import threading
+from collections import OrderedDict
+
+from PySide import QtGui
+
+from mapclientplugins.imagesourcestep.imageindex import ImageIndex
+
+try:
+    import dicom
+except ImportError:
+    dicom = None
+
+# Indexes match the entries of the image type combo box in the configure dialog.
+IMAGE_TYPE_FROM_EXTENSION = 0
+IMAGE_TYPE_PNG = 1
+IMAGE_TYPE_JPEG = 2
+IMAGE_TYPE_TIFF = 3
+IMAGE_TYPE_DICOM = 4
+
+IMAGE_TYPE_EXTENSIONS = {
+    IMAGE_TYPE_PNG: ('.png',),
+    IMAGE_TYPE_JPEG: ('.jpg', '.jpeg'),
+    IMAGE_TYPE_TIFF: ('.tif', '.tiff'),
+    IMAGE_TYPE_DICOM: ('.dcm',),
+}
+
+DEFAULT_SLICE_CACHE_SIZE = 256 * 1024 * 1024
+
+# The pixel type of an image, QImageReader.format() is the file format.
+_PIXEL_TYPES = {
+    QtGui.QImage.Format_Mono: 'mono',
+    QtGui.QImage.Format_MonoLSB: 'mono',
+    QtGui.QImage.Format_Indexed8: 'indexed8',
+    QtGui.QImage.Format_RGB16: 'rgb16',
+    QtGui.QImage.Format_RGB32: 'rgb32',
+    QtGui.QImage.Format_RGB888: 'rgb24',
+    QtGui.QImage.Format_ARGB32: 'argb32',
+    QtGui.QImage.Format_ARGB32_Premultiplied: 'argb32',
+}
+
+_DIGITS_RE = re.compile(r'(\d+)')
+
+
+def naturalSortKey(filename):
+    '''
+    Sort key that orders 'slice2.png' before 'slice10.png'.
+    '''
+    return [int(part) if part.isdigit() else part.lower() for part in _DIGITS_RE.split(filename)]
+
+
+def imageExtensions(image_type):
+    if image_type in IMAGE_TYPE_EXTENSIONS:
+        return IMAGE_TYPE_EXTENSIONS[image_type]
+
+    extensions = ()
+    for value in IMAGE_TYPE_EXTENSIONS.values():
+        extensions += value
+    return extensions
+
+
+def listImageFiles(location, image_type):
+    '''
+    Return the image files of the given type at location in natural sort order.
+    '''
+    if not os.path.isdir(location):
+        return []
+
+    extensions = imageExtensions(image_type)
+    names = [name for name in os.listdir(location)
+             if os.path.splitext(name)[1].lower() in extensions]
+    names.sort(key=naturalSortKey)
+    return [os.path.join(location, name) for name in names]
+
+
+def isDicom(filename):
+    return os.path.splitext(filename)[1].lower() in IMAGE_TYPE_EXTENSIONS[IMAGE_TYPE_DICOM]
+
+
+class ImageFileInfo(object):
+    '''
+    Header information for a single image file.  The spacing is in
+    millimetres per pixel and is None when it is not known.
+    '''
+
+    def __init__(self, filename, size, mtime, width=0, height=0, pixel_type='', spacing=None):
+        self.filename = filename
+        self.size = size
+        self.mtime = mtime
+        self.width = width
+        self.height = height
+        self.pixel_type = pixel_type
+        self.spacing = spacing
+
+    def dimensions(self):
+        return self.width, self.height
+
+
+def imageFileInfoFromIndex(filename, image_index):
+    '''
+    Return the header information for the given file from the
+    image index, or None if the index has no current entry for it.
+    '''
+    stat = os.stat(filename)
+    name = os.path.basename(filename)
+    if not image_index.isCurrent(name, stat.st_size, stat.st_mtime):
+        return None
+
+    entry = image_index.entry(name)
+    spacing = entry.get('spacing')
+    return ImageFileInfo(filename, entry['size'], entry['mtime'], entry['width'], entry['height'],
+                         entry['pixel_type'], tuple(spacing) if spacing else None)
+
+
+def readImageFileInfo(filename):
+    '''
+    Read the header of the given image file without decoding the pixel data.
+    '''
+    stat = os.stat(filename)
+    info = ImageFileInfo(filename, stat.st_size, stat.st_mtime)
+    if isDicom(filename):
+        if dicom is not None:
+            ds = dicom.read_file(filename, stop_before_pixels=True)
+            info.width = int(getattr(ds, 'Columns', 0))
+            info.height = int(getattr(ds, 'Rows', 0))
+            info.pixel_type = 'uint%d' % int(getattr(ds, 'BitsAllocated', 8))
+            spacing = getattr(ds, 'PixelSpacing', None)
+            if spacing:
+                info.spacing = (float(spacing[1]), float(spacing[0]))
+    else:
+        reader = QtGui.QImageReader(filename)
+        size = reader.size()
+        info.width = size.width()
+        info.height = size.height()
+        info.pixel_type = _PIXEL_TYPES.get(reader.imageFormat(), 'unknown')
+
+    return info
+
+
+def decodeSlice(filename):
+    '''
+    Decode the given image file.  Qt readable formats are returned as a
+    QImage, DICOM files are returned as the pixel array of the dataset and
+    need the optional dicom package.
+    '''
+    if isDicom(filename):
+        if dicom is None:
+            raise IOError('Reading DICOM images requires the dicom package: ' + filename)
+        return dicom.read_file(filename).pixel_array
+
+    image = QtGui.QImage(filename)
+    if image.isNull():
+        raise IOError('Unable to read image: ' + filename)
+
+    return image
+
+
+def sliceByteCount(data):
+    if hasattr(data, 'byteCount'):
+        return data.byteCount()
+
+    return getattr(data, 'nbytes', 0)
+
+
+class SliceCache(object):
+    '''
+    A thread safe least recently used cache of decoded slices bounded by
+    the number of bytes the slices occupy.
+    '''
+
+    def __init__(self, max_bytes=DEFAULT_SLICE_CACHE_SIZE):
+        self._max_bytes = max_bytes
+        self._bytes = 0
+        self._slices = OrderedDict()
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+
+    def get(self, key):
+        with self._lock:
+            data = self._slices.pop(key, None)
+            if data is None:
+                self._misses += 1
+                return None
+
+            self._slices[key] = data
+            self._hits += 1
+            return data
+
+    def put(self, key, data):
+        size = sliceByteCount(data)
+        with self._lock:
+            if key in self._slices:
+                self._bytes -= sliceByteCount(self._slices.pop(key))
+            if size > self._max_bytes:
+                return
+            self._slices[key] = data
+            self._bytes += size
+            while self._bytes > self._max_bytes:
+                _, evicted = self._slices.popitem(last=False)
+                self._bytes -= sliceByteCount(evicted)
+
+    def clear(self):
+        with self._lock:
+            self._slices.clear()
+            self._bytes = 0
+
+    def statistics(self):
+        with self._lock:
+            return {'hits': self._hits, 'misses': self._misses,
+                    'bytes': self._bytes, 'slices': len(self._slices)}
+
+
+class ImageStack(object):
+    '''
+    A sorted index of the image files in a directory, with their header
+    information, and lazy access to the decoded slices.  The index is built
+    on first use and the decoded slices are held in a slice cache that is
+    shared by everything using this stack.
+    '''
+
+    def __init__(self, location, image_type, cache=None):
+        self._location = location
+        self._image_type = image_type
+        self._cache = SliceCache() if cache is None else cache
+        self._lock = threading.Lock()
+        self._filenames = None
+        self._infos = {}
+        self._image_index = None
+
+    def location(self):
+        return self._location
+
+    def imageType(self):
+        return self._image_type
+
+    def cache(self):
+        return self._cache
+
+    def _ensureIndexed(self):
+        if self._filenames is None:
+            with self._lock:
+                if self._filenames is None:
+                    self._image_index = ImageIndex.load(self._location)
+                    self._filenames = listImageFiles(self._location, self._image_type)
+
+    def invalidate(self):
+        with self._lock:
+            self._filenames = None
+            self._infos = {}
+            self._image_index = None
+        self._cache.clear()
+
+    def filenames(self):
+        self._ensureIndexed()
+        return list(self._filenames)
+
+    def __len__(self):
+        self._ensureIndexed()
+        return len(self._filenames)
+
+    def filename(self, index):
+        self._ensureIndexed()
+        return self._filenames[index]
+
+    def info(self, index):
+        filename = self.filename(index)
+        info = self._infos.get(filename)
+        if info is None:
+            info = imageFileInfoFromIndex(filename, self._image_index)
+            if info is None:
+                info = readImageFileInfo(filename)
+            # Kept so the file is only looked at once and slice() can fill in the spacing.
+            self._infos[filename] = info
+
+        return info
+
+    def infos(self):
+        return [self.info(index) for index in range(len(self))]
+
+    def slice(self, index):
+        filename = self.filename(index)
+        data = self._cache.get(filename)
+        if data is None:
+            data = decodeSlice(filename)
+            self._cache.put(filename, data)
+            info = self.info(index)
+            if info.spacing is None and hasattr(data, 'dotsPerMeterX') and data.dotsPerMeterX() > 0:
+                info.spacing = (1000.0 / data.dotsPerMeterX(), 1000.0 / data.dotsPerMeterY())
+
+        return data
+
+    def __getitem__(self, index):
+        return self.slice(index)
+
+    def __iter__(self):
+        for index in range(len(self)):
+            yield self.slice(index)
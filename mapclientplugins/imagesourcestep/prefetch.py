@@ -0,0 +1,157 @@
+'''
+MAP Client, a program to generate detailed musculoskeletal models for OpenSim.
+    Copyright (C) 2012  University of Auckland
+
+This file is part of MAP Client. (http://launchpad.net/mapclient)
+
+    MAP Client is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    MAP Client is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with MAP Client.  If not, see <http://www.gnu.org/licenses/>..
+'''
+import time
+import logging
+import threading
+
+from mapclientplugins.imagesourcestep.imagestack import sliceByteCount
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_READ_AHEAD = 4
+DEFAULT_READ_AHEAD_BYTES = 128 * 1024 * 1024
+DEFAULT_READER_THREADS = 2
+
+
+class PrefetchingReader(object):
+    '''
+    Iterates over the slices of an image stack in order while a pool of
+    reader threads decodes the next slices in the background.  At most
+    depth slices are read ahead, and reading ahead pauses while the slices
+    waiting for the consumer take up max_bytes or more.  The time the
+    consumer spends waiting for a slice is recorded so the read ahead can
+    be tuned.
+    '''
+
+    def __init__(self, stack, depth=DEFAULT_READ_AHEAD, max_bytes=DEFAULT_READ_AHEAD_BYTES, threads=DEFAULT_READER_THREADS):
+        self._stack = stack
+        self._depth = max(1, depth)
+        self._max_bytes = max_bytes
+        self._thread_count = max(1, threads)
+        self._condition = threading.Condition()
+        self._threads = []
+        self._closed = False
+        self._count = 0
+        self._next_to_read = 0
+        self._outstanding = 0
+        self._ready = {}
+        self._buffered_bytes = 0
+        self._wait_time = 0.0
+        self._stalls = 0
+        self._slices_read = 0
+
+    def _start(self):
+        if self._threads:
+            raise RuntimeError('The prefetching reader is already being iterated over.')
+
+        # Each iteration starts afresh, also after an earlier one was closed.
+        with self._condition:
+            self._closed = False
+            self._count = len(self._stack)
+            self._next_to_read = 0
+            self._outstanding = 0
+            self._ready = {}
+            self._buffered_bytes = 0
+        for _ in range(min(self._thread_count, self._depth)):
+            thread = threading.Thread(target=self._readSlices, name='PrefetchingReader')
+            thread.daemon = True
+            thread.start()
+            self._threads.append(thread)
+
+    def _canReadAhead(self):
+        if self._next_to_read >= self._count or self._outstanding >= self._depth:
+            return False
+        # Always allow one slice so the consumer cannot be starved.
+        return self._outstanding == 0 or self._buffered_bytes < self._max_bytes
+
+    def _readSlices(self):
+        while True:
+            with self._condition:
+                while not self._closed and not self._canReadAhead():
+                    if self._next_to_read >= self._count:
+                        return
+                    self._condition.wait()
+                if self._closed:
+                    return
+                index = self._next_to_read
+                self._next_to_read += 1
+                self._outstanding += 1
+
+            try:
+                result = (self._stack.slice(index), None)
+            except Exception as e:
+                result = (None, e)
+
+            with self._condition:
+                self._ready[index] = result
+                self._buffered_bytes += sliceByteCount(result[0]) if result[0] is not None else 0
+                self._condition.notify_all()
+
+    def _take(self, index):
+        start = time.time()
+        with self._condition:
+            if index not in self._ready:
+                self._stalls += 1
+            while index not in self._ready:
+                self._condition.wait()
+            data, error = self._ready.pop(index)
+            self._outstanding -= 1
+            self._buffered_bytes -= sliceByteCount(data) if data is not None else 0
+            self._condition.notify_all()
+        self._wait_time += time.time() - start
+        self._slices_read += 1
+
+        if error is not None:
+            raise error
+
+        return data
+
+    def __iter__(self):
+        self._start()
+        try:
+            for index in range(self._count):
+                yield self._take(index)
+        finally:
+            self.close()
+
+    def close(self):
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+        logger.debug('Prefetching reader statistics: {0}'.format(self.statistics()))
+
+    def ioWaitTime(self):
+        '''
+        Return the total time in seconds the consumer has spent waiting
+        for slices to be read.
+        '''
+        return self._wait_time
+
+    def statistics(self):
+        return {
+            'slices': self._slices_read,
+            'stalls': self._stalls,
+            'wait_time': self._wait_time,
+            'depth': self._depth,
+            'max_bytes': self._max_bytes,
+        }
@@ -23,6 +23,11 @@ from PySide import QtGui, QtCore
 
 from mapclient.mountpoints.workflowstep import WorkflowStepMountPoint
 from mapclientplugins.imagesourcestep.widgets.configuredialog import ConfigureDialog, ConfigureDialogState
+from mapclientplugins.imagesourcestep.imagestack import ImageStack
+from mapclientplugins.imagesourcestep.imageindex import indexSummary
+from mapclientplugins.imagesourcestep.volumecache import VolumeCache, volumeCacheDirectory
+from mapclientplugins.imagesourcestep.prefetch import PrefetchingReader, DEFAULT_READ_AHEAD, \
+    DEFAULT_READ_AHEAD_BYTES
 
 from mapclient.core.threadcommandmanager import ThreadCommandManager
 from mapclient.tools.pmr.pmrtool import PMRTool
@@ -34,10 +39,14 @@ class ImageSourceData(object):
 
     name = 'ImageSourceData'
 
-    def __init__(self, identifier, location, image_type):
+    def __init__(self, identifier, location, image_type, stack=None, volume_cache=None):
         self._identifier = identifier
         self._location = location
         self._image_type = image_type
+        if stack is None:
+            stack = ImageStack(location, image_type)
+        self._stack = stack
+        self._volume_cache = volume_cache
 
     def identifier(self):
         return self._identifier
@@ -48,6 +57,51 @@ class ImageSourceData(object):
     def imageType(self):
         return self._image_type
 
+    def imageStack(self):
+        return self._stack
+
+    def imageCount(self):
+        return len(self._stack)
+
+    def imageFiles(self):
+        '''
+        Return the image files at the location in natural sort order.
+        '''
+        return self._stack.filenames()
+
+    def imageInfo(self, index):
+        '''
+        Return the ImageFileInfo header information for the image at index.
+        '''
+        return self._stack.info(index)
+
+    def image(self, index):
+        '''
+        Return the decoded image at index, decoded images are cached
+        and shared with every other user of this image source.
+        '''
+        return self._stack.slice(index)
+
+    def prefetchingReader(self, depth=DEFAULT_READ_AHEAD, max_bytes=DEFAULT_READ_AHEAD_BYTES):
+        '''
+        Return an iterable over the decoded images, in order, that reads up
+        to depth images ahead of the consumer on background threads.  Reading
+        ahead pauses while the images not yet consumed take up max_bytes.
+        The reader's ioWaitTime() reports how long the consumer waited.
+        '''
+        return PrefetchingReader(self._stack, depth, max_bytes)
+
+    def volume(self):
+        '''
+        Return the image stack as a read only memory mapped array indexed
+        [slice, row, column], colour stacks have a trailing channel axis.  The volume is built on disk once and
+        shared by every step using this image source.
+        '''
+        if self._volume_cache is None:
+            raise RuntimeError('No volume cache is available for image source: ' + self._identifier)
+
+        return self._volume_cache.volume()
+
 
 class ImageSourceStep(WorkflowStepMountPoint):
     '''
@@ -71,6 +125,8 @@ class ImageSourceStep(WorkflowStepMountPoint):
         self._category = 'Source'
         self._state = ConfigureDialogState()
         self._threadCommandManager = ThreadCommandManager()
+        self._image_stack = None
+        self._volume_cache = None
 #         self._threadCommandManager.registerFinishedCallback(self._threadCommandsFinished)
 
     def configure(self):
@@ -96,10 +152,46 @@ class ImageSourceStep(WorkflowStepMountPoint):
                 pmr_tool = PMRTool()
                 pmr_tool.cloneWorkspace(pmr_location, local_dir)
 
+            self._image_stack = None
+            self._volume_cache = None
             self._configured = d.validate()
             if self._configuredObserver is not None:
                 self._configuredObserver()
 
+    def execute(self):
+        # Each run of the workflow gets a fresh index of the image files,
+        # consumers within the run share it.
+        self._image_stack = None
+        self._volume_cache = None
+        self._doneExecution()
+
+    def getPMRWorkspaces(self):
+        pmr_location = self._state.pmrLocation()
+        if not pmr_location:
+            return []
+
+        local_dir = self._state.location()
+        if not local_dir:
+            # The clone destination becomes the location of the images, as
+            # it does when the step is configured with a PMR location.
+            local_dir = os.path.join(self._location, self._state.identifier())
+            self._state.setLocation(local_dir)
+            self.serialize(self._location)
+        if os.path.isdir(local_dir) and os.listdir(local_dir):
+            return []
+
+        return [(pmr_location, local_dir)]
+
+    def getToolTip(self):
+        tool_tip = self.getName()
+        if self._state.identifier():
+            tool_tip += ': ' + self._state.identifier()
+        location = self._state.location()
+        if location and os.path.isdir(location):
+            tool_tip += '\n' + indexSummary(location)
+
+        return tool_tip
+
     def getIdentifier(self):
         return self._state.identifier()
 
@@ -118,5 +210,28 @@ class ImageSourceStep(WorkflowStepMountPoint):
         d = ConfigureDialog(self._state)
         self._configured = d.validate()
 
+    def _imageStack(self):
+        location = self._state.location()
+        image_type = self._state.imageType()
+        stack = self._image_stack
+        if stack is None or stack.location() != location or stack.imageType() != image_type:
+            stack = ImageStack(location, image_type)
+            self._image_stack = stack
+            self._volume_cache = None
+
+        return stack
+
+    def _volumeCache(self, stack):
+        if self._volume_cache is None:
+            try:
+                self._volume_cache = VolumeCache(volumeCacheDirectory(stack.location(), stack.imageType()), stack)
+            except RuntimeError:
+                # numpy is not available, the volume view is not offered.
+                return None
+
+        return self._volume_cache
+
     def getPortData(self, index):
-        return ImageSourceData(self._state.identifier(), self._state.location(), self._state.imageType())
+        stack = self._imageStack()
+        return ImageSourceData(self._state.identifier(), self._state.location(), self._state.imageType(),
+                               stack, self._volumeCache(stack))
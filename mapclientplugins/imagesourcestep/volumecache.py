@@ -0,0 +1,206 @@
+'''
+MAP Client, a program to generate detailed musculoskeletal models for OpenSim.
+    Copyright (C) 2012  University of Auckland
+
+This file is part of MAP Client. (http://launchpad.net/mapclient)
+
+    MAP Client is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    MAP Client is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with MAP Client.  If not, see <http://www.gnu.org/licenses/>..
+'''
+import os
+import json
+import hashlib
+import tempfile
+import threading
+
+from PySide import QtGui
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+_VOLUME_CACHE_DIRNAME = 'image-volumes'
+_VOLUME_FILENAME = 'volume.raw'
+_META_FILENAME = 'volume.json'
+_META_VERSION = 2
+
+
+def volumeCacheDirectory(location, image_type):
+    '''
+    Return the directory for the volume cache of the images of the given
+    type at location.  It is kept in the user's cache location rather than
+    next to the images, which may be a version controlled working copy.
+    '''
+    cache_location = QtGui.QDesktopServices.storageLocation(QtGui.QDesktopServices.CacheLocation)
+    if not cache_location:
+        cache_location = os.path.join(tempfile.gettempdir(), 'mapclient')
+
+    key = hashlib.sha1((os.path.abspath(location) + os.pathsep + str(image_type)).encode('utf-8')).hexdigest()
+    return os.path.join(cache_location, _VOLUME_CACHE_DIRNAME, key)
+
+
+def sliceToArray(data):
+    '''
+    Convert a decoded slice into an array.  Greyscale QImages become a
+    two dimensional 8 bit array, colour QImages keep their channels as a
+    height x width x 3 (RGB) or 4 (RGBA) array.  Arrays are passed through
+    as they are.
+    '''
+    if not hasattr(data, 'convertToFormat'):
+        return numpy.asarray(data)
+
+    has_alpha = data.hasAlphaChannel()
+    image = data.convertToFormat(QtGui.QImage.Format_ARGB32 if has_alpha else QtGui.QImage.Format_RGB32)
+    width, height = image.width(), image.height()
+    pixels = numpy.frombuffer(image.constBits(), dtype=numpy.uint8, count=image.byteCount())
+    pixels = pixels.reshape(height, image.bytesPerLine())[:, :width * 4].reshape(height, width, 4)
+    if data.isGrayscale() and not has_alpha:
+        return pixels[:, :, 0].copy()
+
+    # Pixels are stored as 0xAARRGGBB, so in memory the order is B, G, R, A.
+    if has_alpha:
+        return pixels[:, :, [2, 1, 0, 3]]
+
+    return pixels[:, :, [2, 1, 0]]
+
+
+def pixelFormat(array):
+    '''
+    Describe the element type and channel count of a slice array.
+    '''
+    channels = array.shape[2] if array.ndim == 3 else 1
+    return '%sx%d' % (array.dtype.str, channels)
+
+
+def _replaceFile(source, destination):
+    if hasattr(os, 'replace'):
+        os.replace(source, destination)
+    else:
+        if os.path.exists(destination):
+            os.remove(destination)
+        os.rename(source, destination)
+
+
+class VolumeCache(object):
+    '''
+    An on disk raw volume built from the slices of an image stack.  The
+    volume is rebuilt when any of the image files it was built from change,
+    and is handed out as a read only memory map so any number of steps can
+    share it without copying.
+    '''
+
+    def __init__(self, directory, stack):
+        if numpy is None:
+            raise RuntimeError('The volume cache requires numpy.')
+        self._directory = directory
+        self._stack = stack
+        self._lock = threading.Lock()
+        self._volume = None
+
+    def _volumeFilename(self):
+        return os.path.join(self._directory, _VOLUME_FILENAME)
+
+    def _metaFilename(self):
+        return os.path.join(self._directory, _META_FILENAME)
+
+    def _sourceSignature(self):
+        signature = []
+        for filename in self._stack.filenames():
+            stat = os.stat(filename)
+            signature.append([os.path.basename(filename), stat.st_size, stat.st_mtime])
+
+        # The pixel types are part of the key, a volume is rebuilt if they change.
+        for entry, info in zip(signature, self._stack.infos()):
+            entry.append(info.pixel_type)
+
+        return signature
+
+    def _readMeta(self):
+        try:
+            with open(self._metaFilename()) as f:
+                return json.load(f)
+        except (IOError, OSError, ValueError):
+            return None
+
+    def isValid(self):
+        meta = self._readMeta()
+        if meta is None or meta.get('version') != _META_VERSION:
+            return False
+
+        return os.path.exists(self._volumeFilename()) and meta['files'] == self._sourceSignature()
+
+    def build(self):
+        '''
+        Write the volume to disk one slice at a time.
+        '''
+        if not os.path.exists(self._directory):
+            os.makedirs(self._directory)
+        # Remove the metadata first so an interrupted build is never valid.
+        if os.path.exists(self._metaFilename()):
+            os.remove(self._metaFilename())
+
+        signature = self._sourceSignature()
+        count = len(signature)
+        if count == 0:
+            raise ValueError('There are no images to build a volume from at: ' + self._stack.location())
+
+        first = sliceToArray(self._stack.slice(0))
+        pixel_format = pixelFormat(first)
+        shape = (count,) + first.shape
+        # Built under a new name and moved into place, a volume from an
+        # earlier run may still be mapped and must not be truncated.
+        handle, temporary_filename = tempfile.mkstemp(suffix='.raw', dir=self._directory)
+        os.close(handle)
+        try:
+            volume = numpy.memmap(temporary_filename, dtype=first.dtype, mode='w+', shape=shape)
+            volume[0] = first
+            for index in range(1, count):
+                image = sliceToArray(self._stack.slice(index))
+                if image.shape != first.shape:
+                    raise ValueError('Image %s does not have the same dimensions as the first image.' % self._stack.filename(index))
+                if pixelFormat(image) != pixel_format:
+                    raise ValueError('Image %s does not have the same pixel format as the first image.' % self._stack.filename(index))
+                volume[index] = image
+            volume.flush()
+            del volume
+            _replaceFile(temporary_filename, self._volumeFilename())
+        except:
+            if os.path.exists(temporary_filename):
+                os.remove(temporary_filename)
+            raise
+
+        meta = {
+            'version': _META_VERSION,
+            'shape': list(shape),
+            'dtype': first.dtype.str,
+            'pixel_format': pixel_format,
+            'files': signature,
+        }
+        with open(self._metaFilename(), 'w') as f:
+            json.dump(meta, f)
+
+    def volume(self):
+        '''
+        Return the volume as a read only memory map, building it first
+        if the cache is missing or out of date.
+        '''
+        with self._lock:
+            if self._volume is None:
+                if not self.isValid():
+                    self.build()
+                meta = self._readMeta()
+                self._volume = numpy.memmap(self._volumeFilename(), dtype=numpy.dtype(meta['dtype']),
+                                            mode='r', shape=tuple(meta['shape']))
+
+            return self._volume
@@ -25,6 +25,8 @@ from mapclient.tools.pmr.pmrworkflowwidget import PMRWorkflowWidget
 import os
 from mapclient.tools.pmr.pmrtool import ontological_search_string, \
     plain_text_search_string
+from mapclientplugins.imagesourcestep.imageindex import indexSummary
+from mapclientplugins.imagesourcestep.imageindexer import ImageIndexer
 
 REQUIRED_STYLE_SHEET = 'border: 1px solid red; border-radius: 3px'
 DEFAULT_STYLE_SHEET = 'border: 1px solid gray; border-radius: 3px'
@@ -98,6 +100,7 @@ class ConfigureDialog(QDialog):
         self._ui = Ui_ConfigureDialog()
         self._ui.setupUi(self)
         self._setupPMRTab()
+        self._indexer = None
 
         self.setState(state)
 
@@ -108,6 +111,7 @@ class ConfigureDialog(QDialog):
     def _makeConnections(self):
         self._ui.identifierLineEdit.textChanged.connect(self.validate)
         self._ui.localLineEdit.textChanged.connect(self._localLocationEdited)
+        self._ui.localLineEdit.editingFinished.connect(self._indexLocalLocation)
         self._ui.localButton.clicked.connect(self._localLocationClicked)
         self._pmr_widget._ui.lineEditWorkspace.textChanged.connect(self._workspaceChanged)
 #         self._ui.pmrRegisterLabel.linkActivated.connect(self._register)
@@ -146,6 +150,36 @@ class ConfigureDialog(QDialog):
         if location:
             self._ui.previousLocationLabel.setText(location)
             self._ui.localLineEdit.setText(location)
+            self._indexLocalLocation()
+
+    def _stopIndexer(self):
+        if self._indexer is not None:
+            # Left to wind down on its own thread, the indexers of a
+            # directory take turns at updating its index.
+            self._indexer.finished.disconnect(self._indexFinished)
+            self._indexer.cancel()
+            self._indexer = None
+
+    def _indexLocalLocation(self):
+        '''
+        Bring the image index of the local location up to date in the
+        background, the summary is shown once it is done.
+        '''
+        self._stopIndexer()
+        location = self._ui.localLineEdit.text()
+        if os.path.isdir(location):
+            self._indexer = ImageIndexer(location, self._ui.imageSourceTypeComboBox.currentIndex())
+            self._indexer.finished.connect(self._indexFinished)
+            self._indexer.start()
+
+    def _indexFinished(self, index):
+        self._indexer = None
+        if index.directory() == self._ui.localLineEdit.text():
+            self._ui.localLineEdit.setToolTip(index.summary())
+
+    def done(self, result):
+        self._stopIndexer()
+        QDialog.done(self, result)
 
     def _workspaceChanged(self, text):
         pass
@@ -168,6 +202,12 @@ class ConfigureDialog(QDialog):
         else:
             self._ui.identifierLineEdit.setStyleSheet(REQUIRED_STYLE_SHEET)
 
+        # Only the summary of the index is read here, never the images themselves.
+        if localValid:
+            self._ui.localLineEdit.setToolTip(indexSummary(self._ui.localLineEdit.text()))
+        else:
+            self._ui.localLineEdit.setToolTip('')
+
         return valid and localValid
 
 
@@ -0,0 +1,446 @@
+'''
+MAP Client, a program to generate detailed musculoskeletal models for OpenSim.
+    Copyright (C) 2012  University of Auckland
+
+This file is part of MAP Client. (http://launchpad.net/mapclient)
+
+    MAP Client is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    MAP Client is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with MAP Client.  If not, see <http://www.gnu.org/licenses/>..
+'''
+import os
+import json
+import time
+import uuid
+import random
+import socket
+import logging
+import tempfile
+import threading
+from subprocess import Popen, PIPE
+
+try:
+    from http.server import HTTPServer, BaseHTTPRequestHandler
+    from socketserver import ThreadingMixIn
+    from urllib.parse import urlparse, parse_qs, unquote
+    from urllib.request import Request, urlopen
+    from urllib.error import HTTPError
+except ImportError:
+    from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+    from SocketServer import ThreadingMixIn
+    from urlparse import urlparse, parse_qs
+    from urllib import unquote
+    from urllib2 import Request, urlopen, HTTPError
+
+from mapclient.core.threadcommandmanager import hgExecutable
+
+logger = logging.getLogger(__name__)
+
+_JSON_TYPE = 'application/vnd.physiome.pmr2.json.0'
+_WORKSPACE_ROOT = 'workspace'
+_ADD_WORKSPACE = 'workspace/+/addWorkspace'
+_ADD_WORKSPACE_FORM = 'workspace/+/addWorkspace/form'
+
+
+def _freePort():
+    s = socket.socket()
+    s.bind(('127.0.0.1', 0))
+    port = s.getsockname()[1]
+    s.close()
+    return port
+
+
+class _HgServe(object):
+    '''
+    An 'hg serve' process for one emulated workspace repository.
+    '''
+
+    def __init__(self, repository):
+        self.port = _freePort()
+        self._process = Popen([hgExecutable(), 'serve', '-R', repository, '-a', '127.0.0.1',
+                               '-p', str(self.port), '--config', 'web.push_ssl=False',
+                               '--config', 'web.allow_push=*'], stdout=PIPE, stderr=PIPE)
+        deadline = time.time() + 10
+        while time.time() < deadline:
+            try:
+                socket.create_connection(('127.0.0.1', self.port), 0.2).close()
+                return
+            except socket.error:
+                time.sleep(0.05)
+
+        self.stop()
+        raise RuntimeError('hg serve did not start for: ' + repository)
+
+    def stop(self):
+        if self._process.poll() is None:
+            self._process.terminate()
+            self._process.wait()
+
+
+class _Handler(BaseHTTPRequestHandler):
+
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format_, *args):
+        logger.debug(format_ % args)
+
+    def do_GET(self):
+        self._body = None
+        self.server.emulator._handle(self, 'GET')
+
+    def do_POST(self):
+        self._body = None
+        self.server.emulator._handle(self, 'POST')
+
+    def body(self):
+        # Handlers are reused for every request on a kept alive connection.
+        if self._body is None:
+            length = int(self.headers.get('Content-Length') or 0)
+            self._body = self.rfile.read(length) if length else b''
+
+        return self._body
+
+    def reply(self, status, body=b'', content_type=_JSON_TYPE, headers=None):
+        if not isinstance(body, bytes):
+            body = body.encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def replyJSON(self, value, status=200):
+        self.reply(status, json.dumps(value))
+
+    def redirect(self, location):
+        self.reply(302, headers={'Location': location})
+
+
+class _Server(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class PMREmulator(object):
+    '''
+    A local stand in for a PMR instance for measuring the client against.
+    It answers the dashboard, search, ricordo, map_query, owlterms, add
+    workspace, temporary password, rdf_indexer and OAuth token endpoints
+    from in memory data, and serves the workspace repositories with
+    'hg serve' when Mercurial is installed.  Every response can be delayed
+    by latency seconds, plus up to jitter seconds, and fail with a 503 at
+    failure_rate.  endpoint_faults maps an endpoint name to a dict of
+    'latency', 'jitter' and 'failure_rate' overriding these for it.
+    No OAuth signatures are checked.
+    '''
+
+    def __init__(self, latency=0.0, jitter=0.0, failure_rate=0.0, endpoint_faults=None,
+                 repository_dir=None, seed=None):
+        self.latency = latency
+        self.jitter = jitter
+        self.failure_rate = failure_rate
+        self.endpoint_faults = dict(endpoint_faults or {})
+        self._repository_dir = repository_dir
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._workspaces = {}
+        self._terms = {}
+        self._hg_serves = {}
+        self._statistics = {}
+        self._server = None
+        self._thread = None
+
+    def start(self, port=0):
+        self._server = _Server(('127.0.0.1', port), _Handler)
+        self._server.emulator = self
+        self._thread = threading.Thread(target=self._server.serve_forever, name='PMREmulator')
+        self._thread.daemon = True
+        self._thread.start()
+        return self.url()
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+        with self._lock:
+            hg_serves = list(self._hg_serves.values())
+            self._hg_serves = {}
+        for hg_serve in hg_serves:
+            hg_serve.stop()
+
+    def url(self):
+        return 'http://127.0.0.1:%d' % self._server.server_address[1]
+
+    def statistics(self):
+        '''
+        Return the number of requests and injected failures per endpoint.
+        '''
+        with self._lock:
+            return dict((name, dict(values)) for name, values in self._statistics.items())
+
+    def _repositoryDirectory(self):
+        if self._repository_dir is None:
+            self._repository_dir = tempfile.mkdtemp(prefix='pmr-emulator-')
+
+        return self._repository_dir
+
+    def addWorkspace(self, title, description='', storage='mercurial', workflow=False):
+        '''
+        Add a workspace and return its id.  A repository is created for it
+        when Mercurial is installed.
+        '''
+        with self._lock:
+            workspace_id = 'ws%d' % (len(self._workspaces) + 1)
+            self._workspaces[workspace_id] = {
+                'id': workspace_id,
+                'title': title,
+                'description': description,
+                'storage': storage,
+                'workflow': workflow,
+                'repository': None,
+            }
+
+        if storage == 'mercurial' and hgExecutable() is not None:
+            repository = os.path.join(self._repositoryDirectory(), workspace_id)
+            Popen([hgExecutable(), 'init', repository], stdout=PIPE, stderr=PIPE).communicate()
+            self._workspaces[workspace_id]['repository'] = repository
+
+        return workspace_id
+
+    def workspaceUrl(self, workspace_id):
+        return '/'.join((self.url(), _WORKSPACE_ROOT, workspace_id))
+
+    def addTerm(self, label, uri, workspace_ids=()):
+        '''
+        Add an ontology term annotating the given workspaces.
+        '''
+        with self._lock:
+            self._terms[uri] = (label, list(workspace_ids))
+
+    def populate(self, workspaces=100, terms=500, workflows=10):
+        '''
+        Fill the emulator with generated workspaces and terms.
+        '''
+        workspace_ids = [self.addWorkspace('Workspace %d' % index, 'Generated workspace %d' % index)
+                         for index in range(workspaces)]
+        workspace_ids.extend(self.addWorkspace('Workflow %d' % index, 'Generated workflow %d' % index,
+                                               workflow=True) for index in range(workflows))
+        for index in range(terms):
+            annotated = [workspace_ids[(index + offset) % len(workspace_ids)]
+                         for offset in range(min(3, len(workspace_ids)))]
+            self.addTerm('term %d' % index, 'http://purl.org/obo/owlapi/fma#FMA_%d' % index, annotated)
+
+    def _faults(self, endpoint):
+        faults = self.endpoint_faults.get(endpoint, {})
+        return (faults.get('latency', self.latency), faults.get('jitter', self.jitter),
+                faults.get('failure_rate', self.failure_rate))
+
+    def _handle(self, request, method):
+        # Read the body up front so the connection can be kept alive.
+        request.body()
+        parsed = urlparse(request.path)
+        parts = [unquote(part) for part in parsed.path.strip('/').split('/') if part]
+        query = parse_qs(parsed.query)
+        endpoint, handler = self._route(parts, query)
+
+        latency, jitter, failure_rate = self._faults(endpoint)
+        with self._lock:
+            counts = self._statistics.setdefault(endpoint, {'requests': 0, 'failures': 0})
+            counts['requests'] += 1
+            failed = self._random.random() < failure_rate
+            if failed:
+                counts['failures'] += 1
+            delay = latency + self._random.random() * jitter
+        if delay > 0:
+            time.sleep(delay)
+        if failed:
+            request.reply(503, 'Service Unavailable (injected)', 'text/plain')
+            return
+
+        try:
+            handler(request, method, parts, query)
+        except Exception as e:
+            logger.exception('PMR emulator failed on {0}'.format(request.path))
+            request.reply(500, str(e), 'text/plain')
+
+    def _route(self, parts, query):
+        path = '/'.join(parts)
+        if path == 'pmr2-dashboard':
+            return 'dashboard', self._dashboard
+        elif path == 'search':
+            return 'search', self._search
+        elif path == 'pmr2_ricordo/query':
+            return 'ricordo', self._ricordo
+        elif path == 'map_query':
+            return 'map', self._mapQuery
+        elif path.startswith('pmr2_ricordo/owlterms/'):
+            return 'owlterms', self._owlTerms
+        elif path in (_ADD_WORKSPACE, _ADD_WORKSPACE_FORM):
+            return 'add-workspace', self._addWorkspace
+        elif path in ('OAuthRequestToken', 'OAuthGetAccessToken', 'OAuthAuthorizeToken'):
+            return 'oauth', self._oauth
+        elif len(parts) == 2 and parts[0] == _WORKSPACE_ROOT:
+            if 'cmd' in query:
+                return 'hg', self._hg
+            return 'object-info', self._objectInfo
+        elif len(parts) == 3 and parts[0] == _WORKSPACE_ROOT and parts[2] == 'request_temporary_password':
+            return 'temppass', self._temporaryPassword
+        elif len(parts) == 3 and parts[0] == _WORKSPACE_ROOT and parts[2] == 'rdf_indexer':
+            return 'rdf_indexer', self._rdfIndexer
+
+        return 'not-found', self._notFound
+
+    def _notFound(self, request, method, parts, query):
+        request.reply(404, 'Not Found', 'text/plain')
+
+    def _workspace(self, workspace_id):
+        with self._lock:
+            return self._workspaces.get(workspace_id)
+
+    def _formFields(self, request):
+        try:
+            return json.loads(request.body().decode('utf-8')).get('fields', {})
+        except ValueError:
+            return {}
+
+    def _dashboard(self, request, method, parts, query):
+        request.replyJSON({
+            'workspace-home': {'label': 'List personal workspaces',
+                               'target': '/'.join((self.url(), _WORKSPACE_ROOT))},
+            'workspace-add': {'label': 'Create workspace in private workspace container',
+                              'target': '/'.join((self.url(), _ADD_WORKSPACE))},
+        })
+
+    def _search(self, request, method, parts, query):
+        try:
+            fields = json.loads(request.body().decode('utf-8'))
+        except ValueError:
+            fields = {}
+        text = fields.get('SearchableText', '').replace('*', '').lower()
+        with self._lock:
+            workspaces = sorted(self._workspaces.values(), key=lambda w: w['id'])
+        results = [{'title': w['title'], 'target': self.workspaceUrl(w['id'])} for w in workspaces
+                   if text in w['title'].lower() or text in w['description'].lower()]
+        if 'b_size' in fields:
+            start = int(fields.get('b_start', 0))
+            results = results[start:start + int(fields['b_size'])]
+        request.replyJSON(results)
+
+    def _ricordo(self, request, method, parts, query):
+        text = self._formFields(request).get('simple_query', '').lower()
+        results = []
+        with self._lock:
+            for uri, (label, workspace_ids) in sorted(self._terms.items()):
+                if text in label.lower() or text in uri.lower():
+                    items = []
+                    for workspace_id in workspace_ids:
+                        workspace = self._workspaces[workspace_id]
+                        items.append({'title': workspace['title'], 'value': uri.split('#')[-1],
+                                      'href': self.workspaceUrl(workspace_id),
+                                      'source': self.workspaceUrl(workspace_id)})
+                    results.append({'label': label, 'items': items})
+        request.replyJSON(results)
+
+    def _mapQuery(self, request, method, parts, query):
+        text = self._formFields(request).get('ontological_term', '').lower()
+        with self._lock:
+            workflows = [w for w in self._workspaces.values() if w['workflow']]
+        results = [{'obj': {'title': w['title'], 'description': w['description']},
+                    'source': self.workspaceUrl(w['id'])}
+                   for w in sorted(workflows, key=lambda w: w['id'])
+                   if not text or text in w['title'].lower() or text in w['description'].lower()]
+        request.replyJSON({'results': results})
+
+    def _owlTerms(self, request, method, parts, query):
+        text = parts[2].lower() if len(parts) > 2 else ''
+        limit = int(parts[3]) if len(parts) > 3 else 32
+        with self._lock:
+            terms = [[label, uri] for uri, (label, _) in sorted(self._terms.items())
+                     if label.lower().startswith(text)]
+        request.replyJSON({'results': terms[:limit]})
+
+    def _addWorkspace(self, request, method, parts, query):
+        if method == 'GET':
+            if '/'.join(parts) == _ADD_WORKSPACE:
+                # PMR redirects to the form, the client follows it manually.
+                request.redirect('/'.join((self.url(), _ADD_WORKSPACE_FORM)))
+            else:
+                request.replyJSON({'fields': {'title': {}, 'description': {}, 'storage': {}},
+                                   'actions': {'add': {'title': 'Add'}}})
+            return
+
+        fields = self._formFields(request)
+        workspace_id = self.addWorkspace(fields.get('title', ''), fields.get('description', ''),
+                                         fields.get('storage', 'mercurial'))
+        request.redirect(self.workspaceUrl(workspace_id))
+
+    def _objectInfo(self, request, method, parts, query):
+        workspace = self._workspace(parts[1])
+        if workspace is None:
+            return self._notFound(request, method, parts, query)
+
+        request.replyJSON({'id': workspace['id'], 'title': workspace['title'],
+                           'description': workspace['description'], 'storage': workspace['storage'],
+                           'url': self.workspaceUrl(workspace['id'])})
+
+    def _temporaryPassword(self, request, method, parts, query):
+        if self._workspace(parts[1]) is None:
+            return self._notFound(request, method, parts, query)
+
+        request.replyJSON({'user': 'emulator', 'key': uuid.uuid4().hex, 'expires_in': 300})
+
+    def _rdfIndexer(self, request, method, parts, query):
+        fields = self._formFields(request)
+        request.replyJSON({'fields': {'paths': {'value': '\n'.join(fields.get('paths', []))}},
+                           'actions': {'export_rdf': {'title': 'Apply Changes and Export To RDF Store'}}})
+
+    def _oauth(self, request, method, parts, query):
+        if parts[0] == 'OAuthAuthorizeToken':
+            request.reply(200, 'Authorized, verifier: emulator', 'text/plain')
+            return
+
+        request.reply(200, 'oauth_token=%s&oauth_token_secret=%s' % (uuid.uuid4().hex, uuid.uuid4().hex),
+                      'application/x-www-form-urlencoded')
+
+    def _hgServe(self, workspace):
+        with self._lock:
+            hg_serve = self._hg_serves.get(workspace['id'])
+        if hg_serve is None:
+            hg_serve = _HgServe(workspace['repository'])
+            with self._lock:
+                if workspace['id'] in self._hg_serves:
+                    hg_serve.stop()
+                    hg_serve = self._hg_serves[workspace['id']]
+                else:
+                    self._hg_serves[workspace['id']] = hg_serve
+
+        return hg_serve
+
+    def _hg(self, request, method, parts, query):
+        workspace = self._workspace(parts[1])
+        if workspace is None or workspace['repository'] is None:
+            return self._notFound(request, method, parts, query)
+
+        target = 'http://127.0.0.1:%d/?%s' % (self._hgServe(workspace).port, urlparse(request.path).query)
+        headers = dict((name, value) for name, value in request.headers.items()
+                       if name.lower() not in ('host', 'authorization', 'content-length', 'connection'))
+        data = request.body() if method == 'POST' else None
+        try:
+            response = urlopen(Request(target, data, headers))
+            status = response.getcode()
+        except HTTPError as e:
+            response = e
+            status = e.code
+        body = response.read()
+        request.reply(status, body, response.headers.get('Content-Type', 'application/mercurial-0.1'))
@@ -0,0 +1,207 @@
+'''
+MAP Client, a program to generate detailed musculoskeletal models for OpenSim.
+    Copyright (C) 2012  University of Auckland
+
+This file is part of MAP Client. (http://launchpad.net/mapclient)
+
+    MAP Client is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    MAP Client is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with MAP Client.  If not, see <http://www.gnu.org/licenses/>..
+'''
+import os
+import sys
+import time
+import shutil
+import logging
+import tempfile
+import threading
+
+import requests
+from PySide import QtCore
+
+from mapclient.settings import info
+from mapclient.core.threadcommandmanager import hgExecutable
+from mapclient.tools.pmr.pmrtool import PMRTool, plain_text_search_string, \
+    ontological_search_string, workflow_search_string
+from mapclient.tools.pmr.cache import responseCache
+from mapclient.tools.pmr.credentials import credentialCache
+from mapclient.tools.pmr.core import TokenHelper
+from mapclient.tools.pmr.workerpool import runConcurrently
+
+# Run as a script, python tests/pmr/loadtest.py, with mapclient installed.
+from emulator import PMREmulator
+
+logger = logging.getLogger(__name__)
+
+SCENARIOS = ['search', 'ontological', 'workflow', 'dashboard', 'temppass', 'add-workspace', 'authorise', 'clone']
+
+
+def percentile(values, fraction):
+    if not values:
+        return 0.0
+
+    values = sorted(values)
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+
+class LoadTest(object):
+    '''
+    Drives the PMRTool code paths against a PMR emulator and records the
+    latency of every call.  With cold set the response and credential
+    caches are cleared before every call so each one reaches the server.
+    '''
+
+    def __init__(self, emulator, cold=False):
+        self._emulator = emulator
+        self._cold = cold
+        self._pmr_tool = PMRTool()
+        self._clone_dir = tempfile.mkdtemp(prefix='pmr-loadtest-')
+        self._counter = 0
+        self._lock = threading.Lock()
+
+    def close(self):
+        shutil.rmtree(self._clone_dir, ignore_errors=True)
+
+    def _workspaceUrl(self, iteration):
+        return self._emulator.workspaceUrl('ws%d' % (iteration % 10 + 1))
+
+    def _call(self, scenario, iteration):
+        if scenario == 'search':
+            return self._pmr_tool.search('Workspace*', plain_text_search_string)
+        elif scenario == 'ontological':
+            return self._pmr_tool.search('term %d' % (iteration % 50), ontological_search_string)
+        elif scenario == 'workflow':
+            return self._pmr_tool.search('', workflow_search_string)
+        elif scenario == 'dashboard':
+            return self._pmr_tool.getDashboard()
+        elif scenario == 'temppass':
+            return self._pmr_tool.requestTemporaryPassword(self._workspaceUrl(iteration))
+        elif scenario == 'add-workspace':
+            return self._pmr_tool.addWorkspace('Load test %d' % iteration, 'Created by the load test')
+        elif scenario == 'authorise':
+            return self._authorise()
+        elif scenario == 'clone':
+            with self._lock:
+                self._counter += 1
+                local_dir = os.path.join(self._clone_dir, str(self._counter))
+            os.makedirs(local_dir)
+            return self._pmr_tool.cloneWorkspace(self._workspaceUrl(iteration), local_dir)
+
+        raise ValueError('Unknown scenario: ' + scenario)
+
+    def _authorise(self):
+        '''
+        The OAuth token flow of the authorise application dialog, with the
+        user's approval in the browser replaced by fetching the authorise
+        url directly.
+        '''
+        pmr_info = info.PMRInfo()
+        helper = TokenHelper(
+            client_key=pmr_info.consumer_public_token,
+            client_secret=pmr_info.consumer_secret_token,
+            site_url=self._emulator.url(),
+        )
+        helper.get_temporary_credentials()
+        r = requests.get(helper.get_authorize_url())
+        r.raise_for_status()
+        helper.set_verifier(r.text.split('verifier: ')[-1].strip())
+        return helper.get_token_credentials()
+
+    def run(self, scenario, iterations, concurrency):
+        '''
+        Run the scenario iterations times, concurrency calls at a time, and
+        return a dict of the call count, errors, latencies and throughput.
+        '''
+        def call(iteration):
+            if self._cold:
+                responseCache().clear()
+                credentialCache().clear()
+            start = time.time()
+            self._call(scenario, iteration)
+            return time.time() - start
+
+        start = time.time()
+        outcomes = runConcurrently(call, range(iterations), concurrency, name='PMRLoadTest')
+        elapsed = time.time() - start
+        latencies = [latency for latency, error in outcomes if error is None]
+        return {
+            'calls': iterations,
+            'errors': iterations - len(latencies),
+            'mean': sum(latencies) / len(latencies) if latencies else 0.0,
+            'p50': percentile(latencies, 0.5),
+            'p95': percentile(latencies, 0.95),
+            'max': max(latencies) if latencies else 0.0,
+            'throughput': iterations / elapsed if elapsed > 0 else 0.0,
+        }
+
+
+def _configureSettings(url):
+    settings = QtCore.QSettings()
+    settings.beginGroup('PMR')
+    settings.setValue('pmr-website', url)
+    # The emulator does not check signatures, any token gives access.
+    settings.setValue('user-public-token', 'loadtest')
+    settings.setValue('user-secret-token', 'loadtest')
+    settings.endGroup()
+
+
+def main():
+    from optparse import OptionParser
+
+    usage = 'usage: %prog [options] [scenario ...]\n    Scenarios: ' + ', '.join(SCENARIOS)
+    parser = OptionParser(usage)
+    parser.add_option('-n', '--iterations', type='int', default=100, help='calls per scenario')
+    parser.add_option('-c', '--concurrency', type='int', default=4, help='calls running at once')
+    parser.add_option('-l', '--latency', type='float', default=0.0, help='seconds added to every response')
+    parser.add_option('-j', '--jitter', type='float', default=0.0, help='random seconds added on top of the latency')
+    parser.add_option('-f', '--failure-rate', type='float', default=0.0, help='fraction of responses that fail')
+    parser.add_option('--cold', action='store_true', default=False, help='clear the client caches before every call')
+    options, args = parser.parse_args()
+
+    scenarios = args or [scenario for scenario in SCENARIOS if scenario != 'clone' or hgExecutable()]
+    for scenario in scenarios:
+        if scenario not in SCENARIOS:
+            parser.error('unknown scenario: ' + scenario)
+
+    app = QtCore.QCoreApplication(sys.argv)
+    # A separate application name keeps the load test away from the real settings.
+    QtCore.QCoreApplication.setOrganizationName(info.ORGANISATION_NAME)
+    QtCore.QCoreApplication.setApplicationName(info.APPLICATION_NAME + ' Load Test')
+    logging.basicConfig(level='WARNING')
+
+    emulator = PMREmulator(options.latency, options.jitter, options.failure_rate)
+    _configureSettings(emulator.start())
+    emulator.populate()
+    load_test = LoadTest(emulator, options.cold)
+    try:
+        print('{0:<14} {1:>6} {2:>6} {3:>9} {4:>9} {5:>9} {6:>9} {7:>10}'.format(
+            'scenario', 'calls', 'errors', 'mean ms', 'p50 ms', 'p95 ms', 'max ms', 'calls/s'))
+        for scenario in scenarios:
+            result = load_test.run(scenario, options.iterations, options.concurrency)
+            print('{0:<14} {1:>6} {2:>6} {3:>9.1f} {4:>9.1f} {5:>9.1f} {6:>9.1f} {7:>10.1f}'.format(
+                scenario, result['calls'], result['errors'], result['mean'] * 1000, result['p50'] * 1000,
+                result['p95'] * 1000, result['max'] * 1000, result['throughput']))
+
+        print('')
+        print('client sessions: {0}'.format(PMRTool().sessionStatistics()))
+        print('response cache: {0}'.format(responseCache().statistics()))
+        print('credential cache: {0}'.format(credentialCache().statistics()))
+        print('server: {0}'.format(emulator.statistics()))
+    finally:
+        load_test.close()
+        emulator.stop()
+
+    return app.quit()
+
+
+if __name__ == '__main__':
+    sys.exit(main())
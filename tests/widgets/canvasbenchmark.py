@@ -0,0 +1,158 @@
+'''
+MAP Client, a program to generate detailed musculoskeletal models for OpenSim.
+    Copyright (C) 2012  University of Auckland
+
+This file is part of MAP Client. (http://launchpad.net/mapclient)
+
+    MAP Client is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    MAP Client is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with MAP Client.  If not, see <http://www.gnu.org/licenses/>..
+'''
+import os
+import sys
+import time
+
+from PySide import QtCore, QtGui
+
+from mapclient.mountpoints.workflowstep import WorkflowStepMountPoint
+from mapclient.core.workflowscene import WorkflowScene, MetaStep, Connection
+from mapclient.widgets.workflowgraphicsscene import WorkflowGraphicsScene
+from mapclient.widgets.workflowgraphicsview import WorkflowGraphicsView
+
+# Run as a script, python tests/widgets/canvasbenchmark.py, with mapclient installed.
+
+# Scene units between the generated steps.
+_SPACING = 120
+
+
+class _BenchmarkStep(WorkflowStepMountPoint):
+    '''
+    A step with one uses and one provides port, enough for the canvas to
+    draw it and connect it.
+    '''
+
+    def __init__(self, location):
+        super(_BenchmarkStep, self).__init__('Benchmark', location)
+        self.addPort(('http://physiomeproject.org/workflow/1.0/rdf-schema#port',
+                      'http://physiomeproject.org/workflow/1.0/rdf-schema#uses',
+                      'http://physiomeproject.org/workflow/1.0/rdf-schema#benchmark'))
+        self.addPort(('http://physiomeproject.org/workflow/1.0/rdf-schema#port',
+                      'http://physiomeproject.org/workflow/1.0/rdf-schema#provides',
+                      'http://physiomeproject.org/workflow/1.0/rdf-schema#benchmark'))
+
+    def getIdentifier(self):
+        return ''
+
+
+def generateWorkflow(workflow_scene, steps, columns):
+    '''
+    Fill workflow_scene with steps laid out on a grid, each connected to
+    the step before it.
+    '''
+    previous = None
+    for index in range(steps):
+        metastep = MetaStep(_BenchmarkStep(''))
+        metastep._pos = QtCore.QPointF((index % columns) * _SPACING, (index // columns) * _SPACING)
+        metastep._selected = False
+        workflow_scene.addItem(metastep)
+        if previous is not None:
+            connection = Connection(previous, 1, metastep, 0)
+            connection._selected = False
+            workflow_scene.addItem(connection)
+        previous = metastep
+
+
+def createCanvas(steps, columns, width=1280, height=800):
+    '''
+    Return a shown view of a generated workflow with the given number of steps.
+    '''
+    workflow_scene = WorkflowScene(None)
+    scene = WorkflowGraphicsScene()
+    rows = (steps + columns - 1) // columns
+    # Big enough to hold every step, otherwise they are pushed inside.
+    scene.setSceneRect(-_SPACING, -_SPACING, (columns + 2) * _SPACING, (rows + 2) * _SPACING)
+    scene.setWorkflowScene(workflow_scene)
+    generateWorkflow(workflow_scene, steps, columns)
+    scene.updateModel()
+
+    view = WorkflowGraphicsView()
+    view.setScene(scene)
+    view.resize(width, height)
+    view.show()
+    QtGui.QApplication.processEvents()
+    return view
+
+
+def panFrameTimes(view, frames, step=7):
+    '''
+    Pan the view frames times by step pixels, repainting after each pan,
+    and return the time each frame took.
+    '''
+    scroll_bar = view.horizontalScrollBar()
+    direction = step
+    times = []
+    for _ in range(frames):
+        if not scroll_bar.minimum() <= scroll_bar.value() + direction <= scroll_bar.maximum():
+            direction = -direction
+        start = time.time()
+        scroll_bar.setValue(scroll_bar.value() + direction)
+        view.viewport().repaint()
+        times.append(time.time() - start)
+
+    return times
+
+
+def summary(times):
+    times = sorted(times)
+    mean = sum(times) / len(times) if times else 0.0
+    p95 = times[min(len(times) - 1, int(0.95 * len(times)))] if times else 0.0
+    return mean, p95
+
+
+def main():
+    from optparse import OptionParser
+
+    parser = OptionParser('usage: %prog [options]')
+    parser.add_option('-n', '--steps', type='int', default=3000, help='steps in the generated workflow')
+    parser.add_option('-c', '--columns', type='int', default=60, help='steps in each row')
+    parser.add_option('-f', '--frames', type='int', default=200, help='frames to time for each case')
+    parser.add_option('-s', '--scale', type='float', action='append', help='view scales to time, may be repeated')
+    parser.add_option('--no-grid-tiles', action='store_true', default=False,
+                      help='scale the grid image on every paint instead of using cached tiles')
+    parser.add_option('--software-gl', action='store_true', default=False,
+                      help='use software OpenGL, for machines without a GPU or display')
+    options, _ = parser.parse_args()
+
+    if options.software_gl:
+        os.environ['LIBGL_ALWAYS_SOFTWARE'] = '1'
+    app = QtGui.QApplication(sys.argv)
+
+    view = createCanvas(options.steps, options.columns)
+    view.setGridTileCache(not options.no_grid_tiles)
+    print('{0:<8} {1:>6} {2:>10} {3:>10}'.format('viewport', 'scale', 'mean ms', 'p95 ms'))
+    for viewport in ('raster', 'opengl'):
+        if view.setOpenGLViewport(viewport == 'opengl') != (viewport == 'opengl'):
+            print('{0:<8} not available'.format(viewport))
+            continue
+        for scale in options.scale or [1.0, 0.25]:
+            view.resetTransform()
+            view.scale(scale, scale)
+            view.scene().setLevelOfDetail(scale)
+            QtGui.QApplication.processEvents()
+            mean, p95 = summary(panFrameTimes(view, options.frames))
+            print('{0:<8} {1:>6.2f} {2:>10.2f} {3:>10.2f}'.format(viewport, scale, mean * 1000, p95 * 1000))
+
+    return app.quit()
+
+
+if __name__ == '__main__':
+    sys.exit(main())